@@ -156,7 +156,7 @@ def show_data(respond):
     resource_count = int(g.sparql(" SELECT ( COUNT ( DISTINCT ?x ) AS ?c ) WHERE { ?x ?y ?z } ").count('c'))
     property_count = int(g.sparql("select (count(distinct ?y) as ?c) where {?x ?y ?z}").count('c'))
     object_count = int(g.sparql("select (count(distinct ?z) as ?c) where {?x ?y ?z}").count('c'))
-    triple_count = int(g.sparql("select (count(?z) as ?c) where {?x ?y ?z}").count('c'))
+    triple_count = len(g)
     type_count = int(g.sparql("select (count(distinct ?z) as ?c) where {?x a ?z}").count('c'))
     typed_resource_count = int(g.sparql("select (count(distinct ?x) as ?c) where {?x a ?z}").count('c'))
 
@@ -1,2 +1,12 @@
 
-from rdfgraph import Graph, Dataset, Endpoint, Config
+import sys
+from rdfgraph import Graph, Config, LazyModule, lazy_name
+
+# Dataset and Endpoint come with the SPARQL federation code, loaded on
+# first use.
+def _lazy(name):
+    if name not in ('Dataset', 'Endpoint'):
+        raise AttributeError(name)
+    return lazy_name(name)
+sys.modules[__name__] = LazyModule(sys.modules[__name__], _lazy,
+    ['Dataset', 'Endpoint'])
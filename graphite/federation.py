@@ -0,0 +1,669 @@
+"""SPARQL federation: Datasets of Endpoints, and what's known about them.
+"""
+
+from __future__ import print_function
+
+from rdfgraph import Config, Context, Fetcher, Graph, HttpClient, \
+  NoAutoQuery, ResourceList, SparqlList, DEFAULT_NAMESPACES, caches, \
+  sparql_construct, sparql_request, sparql_select, sparql_term, takes_list
+
+class BatchContext(Context):
+    "A Context that calls `flush` when the outermost block ends."
+    def __init__(self, flush, discard):
+        super(BatchContext, self).__init__()
+        self.flush = flush
+        self.discard = discard
+    def __enter__(self, *t):
+        super(BatchContext, self).__enter__(*t)
+        return self
+    def __exit__(self, x, y, z):
+        super(BatchContext, self).__exit__(x, y, z)
+        if not self.active():
+            if x is None:
+                self.flush()
+            else:
+                self.discard()
+
+class SparqlStats(object):
+    """What an endpoint holds, for deciding whether to send it a query.
+
+    The endpoint's predicates and classes are read from its VoID
+    description, or failing that listed with GROUP BY queries. Lists cut
+    short by `limit` can't rule anything out, so then ASK probes are
+    made for each predicate or class asked about. Everything is kept in
+    caches['sparql-stats'] so other processes and later runs needn't ask
+    again. When the endpoint can't be asked, the answer is always yes,
+    and it isn't asked again for `failure_ttl` seconds.
+    """
+    cache_name = 'sparql-stats'
+    limit = 10000
+    failure_ttl = 600
+
+    def __init__(self, uri, graph):
+        self.uri = uri
+        self.graph = graph
+        self.stats = None
+        self._listed = None
+
+    # Persistence
+    def _cache(self):
+        return caches[self.cache_name]
+
+    def _load(self):
+        import marshal
+        cache = self._cache()
+        try:
+            if self.uri in cache and cache.is_fresh(self.uri):
+                self.stats = marshal.loads(cache.read(self.uri))
+                return True
+        except (KeyError, ValueError, EOFError, TypeError):
+            pass
+        return False
+
+    def _save(self, meta=None):
+        import marshal
+        self._cache().set(self.uri, marshal.dumps(self.stats), meta=meta)
+
+    def ready(self):
+        "Whether stats are at hand, without asking the endpoint."
+        import time
+        if self.stats is not None:
+            retry = self.stats.get('failed', None)
+            if retry is None or time.time() < retry:
+                return True
+            self.stats = None
+        return self._load()
+
+    # Gathering
+    def _select(self, query):
+        return self.graph.endpoint(self.uri).select_rows(query)
+
+    def _ask(self, pattern):
+        import json
+        response = sparql_request(self.uri, u"ASK { %s }" % pattern,
+            'application/sparql-results+json',
+            client=self.graph.endpoint(self.uri).http)
+        return bool(json.loads(response.text())['boolean'])
+
+    def _uris(self, rows, name):
+        return [
+            unicode(row[name].datum) for row in rows
+            if name in row and row[name].is_uri
+        ]
+
+    def _grouped(self, var, where):
+        "The URIs a variable takes, and whether that's all of them."
+        rows = self._select(u"SELECT %s WHERE { %s } GROUP BY %s LIMIT %d" % (
+            var, where, var, self.limit + 1))
+        values = self._uris(rows, var[1:])
+        return values[:self.limit], len(rows) <= self.limit
+
+    def gather(self):
+        """Ask the endpoint what it holds, and return the stats.
+
+        Thread safe: nothing is kept until use() is given the result.
+        """
+        stats = {'predicates': None, 'classes': None, 'asks': {}}
+        void = DEFAULT_NAMESPACES['void']
+        # One query for both partitions of a VoID description.
+        rows = self._select(u"SELECT DISTINCT ?p ?c WHERE {\n"
+            u"  { ?d <%spropertyPartition> ?pp . ?pp <%sproperty> ?p }\n"
+            u"  UNION { ?d <%sclassPartition> ?cp . ?cp <%sclass> ?c }\n"
+            u"}" % (void, void, void, void))
+        predicates = self._uris(rows, 'p')
+        if predicates:
+            # A VoID partition lists everything.
+            stats['predicates'] = predicates
+            stats['classes'] = self._uris(rows, 'c')
+            return stats
+        predicates, complete = self._grouped('?p', u"?s ?p ?o")
+        if complete:
+            stats['predicates'] = predicates
+        classes, complete = self._grouped('?c', u"?s a ?c")
+        if complete:
+            stats['classes'] = classes
+        return stats
+
+    def use(self, stats):
+        "Keep stats from gather(), here and in the cache."
+        self.stats = stats
+        self._save()
+
+    def fail(self, error):
+        "Note the endpoint can't be asked, so everything is sent to it for now."
+        import time
+        self.graph.failures[self.uri] = error
+        retry = time.time() + self.failure_ttl
+        self.stats = {'predicates': None, 'classes': None, 'asks': {},
+            'failed': retry}
+        # Saved too, so other processes don't each try it again.
+        self._save(meta={'expires': repr(retry)})
+
+    def _ensure(self):
+        if not self.ready():
+            try:
+                self.use(self.gather())
+            except Exception as e:
+                self.fail(e)
+        # Sets of what's listed, for quick lookups
+        if self._listed is not self.stats:
+            self._listed = self.stats
+            self._predicates = self.stats['predicates'] and set(self.stats['predicates'])
+            self._classes = self.stats['classes'] and set(self.stats['classes'])
+
+    def _probe(self, key, pattern):
+        "An ASK, remembered by key. True if the endpoint can't be asked."
+        if 'failed' in self.stats:
+            return True
+        asks = self.stats['asks']
+        if key not in asks:
+            try:
+                asks[key] = self._ask(pattern)
+            except Exception as e:
+                self.fail(e)
+                return True
+            self._save()
+        return asks[key]
+
+    @staticmethod
+    def _predicate_ask(uri):
+        return 'p ' + uri, u"?s <%s> ?o" % uri
+
+    @staticmethod
+    def _class_ask(uri):
+        return 'c ' + uri, u"?s a <%s>" % uri
+
+    def has_predicate(self, uri):
+        self._ensure()
+        if self.stats['predicates'] is not None:
+            return uri in self._predicates
+        return self._probe(*self._predicate_ask(uri))
+
+    def has_class(self, uri):
+        self._ensure()
+        if self.stats['classes'] is not None:
+            return uri in self._classes
+        return self._probe(*self._class_ask(uri))
+
+    def _class_of(self, triple):
+        "The class a pattern asks for the instances of, or None."
+        x, y, z = triple
+        if unicode(y.datum) == DEFAULT_NAMESPACES['rdf'] + 'type' \
+                and getattr(z, 'is_uri', False):
+            return unicode(z.datum)
+        return None
+
+    def use_for_triple(self, triple):
+        x, y, z = triple
+        if y is None or not getattr(y, 'is_uri', False):
+            return True
+        cls = self._class_of(triple)
+        if cls is not None:
+            return self.has_class(cls)
+        return self.has_predicate(unicode(y.datum))
+
+    def unasked(self, triple):
+        """The ASK use_for_triple would make, as (key, pattern), or None.
+
+        So a Dataset can make the probes for all its endpoints at once.
+        """
+        x, y, z = triple
+        if y is None or not getattr(y, 'is_uri', False):
+            return None
+        self._ensure()
+        if 'failed' in self.stats:
+            return None
+        cls = self._class_of(triple)
+        if cls is not None:
+            if self.stats['classes'] is not None:
+                return None
+            key, pattern = self._class_ask(cls)
+        else:
+            if self.stats['predicates'] is not None:
+                return None
+            key, pattern = self._predicate_ask(unicode(y.datum))
+        if key in self.stats['asks']:
+            return None
+        return key, pattern
+
+    def answered(self, answers):
+        "Keep the answers to ASKs made elsewhere, by key, in one save."
+        self.stats['asks'].update(answers)
+        self._save()
+
+    def use_for_query(self, query):
+        # Working out what a whole query needs would mean parsing it.
+        return True
+
+
+class PatternCache(object):
+    """Remembers which triple patterns have been fetched.
+
+    A pattern is covered if it, or any pattern made from it by turning
+    bound terms into wildcards, was added: at most eight dict lookups.
+    Entries expire `ttl` seconds after they're added (None for never),
+    and past `max_entries` the least recently used go first. `hits` and
+    `misses` count the answers from covers().
+    """
+    def __init__(self, max_entries=10000, ttl=None):
+        import collections
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # Pattern to the time it was added, least recently used first
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def generalisations(pattern):
+        "The pattern and every pattern with some of its bound terms made wildcards."
+        x, y, z = pattern
+        for x in set([x, None]):
+            for y in set([y, None]):
+                for z in set([z, None]):
+                    yield x, y, z
+
+    def add(self, pattern):
+        import time
+        self.entries.pop(pattern, None)
+        self.entries[pattern] = time.time()
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def discard(self, pattern):
+        self.entries.pop(pattern, None)
+
+    def covers(self, pattern):
+        import time
+        entries = self.entries
+        for general in self.generalisations(pattern):
+            added = entries.get(general, None)
+            if added is None:
+                continue
+            del entries[general]
+            if self.ttl is not None and time.time() - added > self.ttl:
+                continue
+            # Mark it as recently used.
+            entries[general] = added
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+    __contains__ = covers
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+class Endpoint(object):
+    def __init__(self, uri, dataset, timeout=None):
+        self.uri = uri
+        assert getattr(dataset, 'is_dataset', False), dataset
+        self.dataset = dataset
+        self.graph = dataset.create_graph()
+        # Seconds to wait on this endpoint, for the whole query and for
+        # each socket operation.
+        self.timeout = timeout or dataset.endpoint_timeout or Config.http_timeout
+        self.http = HttpClient(timeout=self.timeout)
+
+    def select_rows(self, query):
+        "Make a SPARQL SELECT, as a list of dicts of Nodes. Thread safe."
+        return list(sparql_select(self.uri, query, client=self.http))
+
+    def select(self, query):
+        "Make a SPARQL SELECT and traverse the results"
+        return SparqlList(self.graph._parse_sparql_result(self.select_rows(query)))
+
+    def fetch_construct(self, query):
+        "Make a SPARQL CONSTRUCT, returning its text and format. Thread safe."
+        return sparql_construct(self.uri, query, client=self.http)
+
+    def construct(self, graph, query):
+        "Load data into memory from a SPARQL CONSTRUCT"
+        text, format = self.fetch_construct(query)
+        graph.engine.load_text(text, format)
+        return self
+
+
+class Dataset(object):
+    """Extends Graph with a set of SPARQL endpoints and hooks that load
+    data from these endpoints as you query through the Graph interface.
+
+    The intent is to facilitate gathering exactly the data you want from
+    anywhere it happens to be and make it easy to interrogate as possible.
+
+    And I shall call this module... Magic Spaqrls!"""
+    is_dataset = True
+    stats_class = SparqlStats
+    graph_class = Graph
+    # Most patterns sent to an endpoint in one batched query.
+    batch_size = 100
+    # Seconds to wait for an endpoint before going on without it; None
+    # for Config.http_timeout.
+    endpoint_timeout = None
+    # Patterns remembered as fetched per endpoint, and for how many
+    # seconds (None for ever).
+    query_cache_size = 10000
+    query_cache_ttl = None
+
+    def __init__(self, endpoint=None, uri=None, namespaces=None):
+        self.endpoints = {}
+        self.endpoint_stats = {}
+        self.graphs = []
+        # Endpoint URI to a PatternCache of what's been fetched from it
+        self.query_caches = {}
+        # Endpoint URI to patterns waiting for a batched query
+        self.pending = {}
+        # Endpoint URI to the error from its last failed query
+        self.failures = {}
+        self.batching = BatchContext(self.flush, self.discard)
+        self.namespaces = namespaces or {}
+        # The data cache is a sort of default graph.
+        self.data_cache = self.create_graph(uri=uri, namespaces=namespaces)
+        if endpoint:
+            self.add_endpoints(endpoint)
+
+    def get(self, *t, **k):
+        return self.data_cache.get(*t, **k)
+    resource = get
+    __getitem__ = get
+
+    def endpoint(self, uri):
+        if uri in self.endpoints:
+            return self.endpoints[uri]
+        return Endpoint(uri, self)
+
+    @takes_list
+    def add_endpoint(self, endpoints):
+        for resource in endpoints:
+            uri = resource.uri()
+            self.endpoints[uri] = Endpoint(uri, self)
+            self.endpoint_stats[uri] = self.stats_class(uri, self)
+        return self
+    add_endpoints = add_endpoint
+
+    def add_graph(self, graph):
+        self.graphs.append(graph)
+
+    def create_graph(self, *t, **k):
+        if 'namespaces' not in k:
+            k['namespaces'] = self.namespaces
+        g = self.graph_class(*t, **k)
+        self.add_graph(g)
+        return g
+
+    def query_cache(self, endpoint):
+        "The PatternCache of patterns fetched from an endpoint."
+        cache = self.query_caches.get(endpoint, None)
+        if cache is None:
+            cache = self.query_caches[endpoint] = PatternCache(
+                max_entries=self.query_cache_size,
+                ttl=self.query_cache_ttl,
+            )
+        return cache
+
+    def _in_cache(self, endpoint, triple):
+        "Do a wild-card safe test for caching"
+        return self.query_cache(endpoint).covers(triple)
+
+    def gather_stats(self):
+        """Fetch stats for the endpoints that haven't any yet.
+
+        The endpoints are asked all at once. One that fails or outlives
+        its timeout gets every query until its failure_ttl runs out.
+        """
+        waiting = {}
+        for uri, stats in self.endpoint_stats.items():
+            if not stats.ready():
+                waiting[uri] = stats
+        if not waiting:
+            return
+        endpoints = dict([(uri, self.endpoint(uri)) for uri in waiting])
+        jobs = [(uri,) for uri in waiting]
+        def gather(job):
+            return waiting[job[0]].gather()
+        for job, stats in self._fan_out(gather, endpoints, jobs):
+            waiting.pop(job[0]).use(stats)
+        for uri, stats in waiting.items():
+            stats.fail(self.failures.get(uri, None))
+
+    def probe_stats(self, triple, uris):
+        """Make the ASK probes some endpoints need for a pattern, all at once.
+
+        Each endpoint's answer is saved with its stats; one that can't be
+        asked is marked as failed, as in gather_stats.
+        """
+        waiting = {}
+        for uri in uris:
+            question = self.endpoint_stats[uri].unasked(triple)
+            if question is not None:
+                waiting[uri] = question
+        if not waiting:
+            return
+        endpoints = dict([(uri, self.endpoint(uri)) for uri in waiting])
+        jobs = [(uri,) + question for uri, question in waiting.items()]
+        def ask(job):
+            return self.endpoint_stats[job[0]]._ask(job[2])
+        for job, answer in self._fan_out(ask, endpoints, jobs):
+            del waiting[job[0]]
+            self.endpoint_stats[job[0]].answered({job[1]: answer})
+        for uri in waiting:
+            self.endpoint_stats[uri].fail(self.failures.get(uri, None))
+
+    def select_endpoints(self, *t):
+        if NoAutoQuery.active():
+            return []
+        endpoints = []
+        if len(t) == 0:
+            raise RuntimeError("select for what?")
+        elif len(t) == 3:
+            self.gather_stats()
+            candidates = [ep for ep in self.endpoint_stats if not self._in_cache(ep, t)]
+            self.probe_stats(t, candidates)
+            for ep in candidates:
+                if self.endpoint_stats[ep].use_for_triple(t):
+                    endpoints.append(ep)
+        else:
+            for ep, stats in self.endpoint_stats.items():
+                if stats.use_for_query(t[0]):
+                    endpoints.append(ep)
+        return endpoints
+
+    def prefixes(self):
+        return self.data_cache.prefixes()
+
+    def _parse_subject(self, sub):
+        return self.data_cache._parse_subject(sub)
+    def _parse_property(self, prop):
+        return self.data_cache._parse_property(prop)
+    def _parse_object(self, obj):
+        return self.data_cache._parse_object(obj)
+
+    def _make_query(self, text):
+        query = ""
+        for prefix, uri in self.prefixes().items():
+            query += "PREFIX " + prefix + ": <" + unicode(uri) + ">\n"
+        query += text
+        return query
+
+    def _construct_query(self, patterns):
+        """A CONSTRUCT for the triples matching any of some patterns.
+
+        Patterns with the same terms bound share a VALUES block, and the
+        blocks are joined with UNION. Patterns with blank nodes are
+        skipped, as they can't be sent. Returns None if nothing's left.
+        """
+        names = ['?s', '?p', '?o']
+        shapes = {}
+        for pattern in patterns:
+            bound = tuple([i for i in range(3) if pattern[i] is not None])
+            try:
+                row = [sparql_term(pattern[i]) for i in bound]
+            except ValueError:
+                continue
+            shapes.setdefault(bound, []).append(row)
+        if not shapes:
+            return None
+        if len(shapes) == 1 and len(shapes.values()[0]) == 1:
+            # Just one pattern: write it out plainly.
+            (bound, [row]), = shapes.items()
+            terms = list(names)
+            for i, term in zip(bound, row):
+                terms[i] = term
+            triple = ' '.join(terms)
+            return u"CONSTRUCT { %s }\nWHERE { %s }" % (triple, triple)
+        groups = []
+        for bound, rows in sorted(shapes.items()):
+            values = u''
+            if bound:
+                values = u"VALUES (%s) { %s } " % (
+                    ' '.join([names[i] for i in bound]),
+                    ' '.join([u'(' + u' '.join(row) + u')' for row in rows]),
+                )
+            groups.append(u"{ %s?s ?p ?o }" % values)
+        return u"CONSTRUCT { ?s ?p ?o }\nWHERE {\n  %s\n}" % u"\n  UNION ".join(groups)
+
+    def _fan_out(self, f, endpoints, jobs):
+        """Run f over (endpoint URI, ...) jobs, all endpoints at once.
+
+        Yields (job, result) for the jobs that worked. A job that fails
+        or outlives its endpoint's timeout is noted in `failures` and
+        left out, so the others' results still come through.
+        """
+        import sys
+        def timeout(job):
+            return endpoints[job[0]].timeout
+        if len(jobs) == 1:
+            try:
+                results = [(jobs[0], f(jobs[0]), None)]
+            except:
+                results = [(jobs[0], None, sys.exc_info())]
+        else:
+            results = Fetcher().run(f, jobs, key=lambda job: job[0], timeout=timeout)
+        for job, result, error in results:
+            if error is None:
+                yield job, result
+                continue
+            self.failures[job[0]] = error[1]
+            if Config.sparql_debug:
+                print("Endpoint failed: {0}: {1!r}".format(job[0], error[1]))
+
+    def _construct(self, requests):
+        """Load the triples matching patterns from endpoints.
+
+        `requests` is a list of (endpoint URI, patterns). Queries run in
+        parallel; their results are added to data_cache from this thread.
+        Patterns that fail are forgotten so they'll be asked again.
+        """
+        endpoints = {}
+        jobs = []
+        for uri, patterns in requests:
+            endpoints[uri] = self.endpoint(uri)
+            for i in range(0, len(patterns), self.batch_size):
+                chunk = patterns[i:i+self.batch_size]
+                query = self._construct_query(chunk)
+                if query is None:
+                    continue
+                query = self._make_query(query)
+                if Config.sparql_debug:
+                    print("Auto-query: {0}".format(uri))
+                    print(query)
+                jobs.append((uri, query, chunk))
+        def fetch(job):
+            return endpoints[job[0]].fetch_construct(job[1])
+        done = set()
+        for job, (text, format) in self._fan_out(fetch, endpoints, jobs):
+            self.data_cache.engine.load_text(text, format)
+            done.add(id(job))
+        for job in jobs:
+            if id(job) not in done:
+                uri, query, chunk = job
+                cache = self.query_cache(uri)
+                for pattern in chunk:
+                    cache.discard(pattern)
+
+    def batch(self):
+        """Gather auto-queries made in a with block and send them together.
+
+        Each endpoint then gets one CONSTRUCT for up to `batch_size`
+        patterns, rather than one per pattern. Results returned inside
+        the block are lazy: reading one sends the queries gathered so far.
+        """
+        return self.batching
+
+    def flush(self):
+        "Send the queries gathered by batch()."
+        if self.pending:
+            requests = self.pending.items()
+            self.pending.clear()
+            self._construct(requests)
+
+    def discard(self):
+        "Drop the queries gathered by batch() unsent; they'll be asked again."
+        for uri, patterns in self.pending.items():
+            cache = self.query_cache(uri)
+            for pattern in patterns:
+                cache.discard(pattern)
+        self.pending.clear()
+
+    def triples(self, x, y, z):
+        x = self._parse_subject(x)
+        y = self._parse_property(y)
+        z = self._parse_object(z)
+        requests = []
+        for uri in self.select_endpoints(x, y, z):
+            self.query_cache(uri).add((x, y, z))
+            if self.batching.active():
+                self.pending.setdefault(uri, []).append((x, y, z))
+            else:
+                requests.append((uri, [(x, y, z)]))
+        if requests:
+            self._construct(requests)
+        return ResourceList(self._local_triples(x, y, z))
+
+    def _local_triples(self, x, y, z):
+        # Batched queries have to be answered before anything's read.
+        self.flush()
+        for g in self.graphs:
+            for t in g.triples(x, y, z):
+                yield t
+
+    def sparql(self, query, *t, **k):
+        # TODO: Detect grouping and handle count aggregation differently
+        iter = self._sparql(query, *t, **k)
+        return SparqlList(iter)
+    def _sparql(self, query):
+        for g in self.graphs:
+            for x in g.sparql(query):
+                yield x
+        # Every endpoint is asked at once; each one's rows come out as
+        # soon as it answers.
+        endpoints = {}
+        for uri in self.select_endpoints(query):
+            endpoints[uri] = self.endpoint(uri)
+        def select(job):
+            return endpoints[job[0]].select_rows(query)
+        jobs = [(uri,) for uri in endpoints]
+        for job, rows in self._fan_out(select, endpoints, jobs):
+            for x in endpoints[job[0]].graph._parse_sparql_result(rows):
+                yield x
+
+    def _load_all_sparql(self, query):
+        for uri in self.select_endpoints(query):
+            raise NotImplementedError("Implement Endpoint class for 'read_sparql'")
+            for x in self.endpoint(uri).select(query):
+                yield x
+
+    # SPARQL query methods
+    def describe(self, query):
+        self._load_all_sparql("describe "+query)
+        return self
+    def construct(self, query):
+        self._load_all_sparql("construct "+query)
+        return self
+
+    def to_string(self, *t, **k):
+        # TODO: Dump all local graphs and the local caches of all Endpoints.
+        return self.data_cache.to_string(*t, **k)
@@ -0,0 +1,78 @@
+"""HTML views of Graphs and Resources, as used by the explorer example.
+"""
+
+import cgi
+
+def quote(s):
+    return cgi.escape(unicode(s))
+
+def graph_html(graph):
+    "Every typed resource in a graph, grouped by type."
+    resources = {}
+    seen_resources = {}
+    for res, _, typ in graph.triples(None, 'rdf:type', None):
+        if res.uri in seen_resources: continue
+        seen_resources[res.uri] = True
+        l = resources.setdefault(typ, [])
+        l.append(res)
+    s = '<div class="graph">'
+    for typ in resources.keys():
+        s += '<div class="resource-type">'
+        typ_label = graph[typ]['rdf:label']
+        if typ_label:
+            s += '<h2>'
+            s += quote(typ_label)
+            s += '</h2>'
+        else:
+            s += 'Type:'
+        s += ' <span class="uri">(<a href="%s">%s</a>)</span>' % (
+            quote(graph.expand_uri(typ)),
+            quote(graph.shrink_uri(typ)),
+        )
+        for res in resources[typ]:
+            s += res.dump()
+        s += '</div>'
+    s += '</div>'
+    return s
+
+def resource_link(resource):
+    "A link to a resource, showing its short URI."
+    import urllib
+    uri = resource._uri
+    short_uri = resource.shrink_uri()
+    return '<a href="?url=%s">%s</a>' % (
+        cgi.escape(urllib.quote(uri)),
+        cgi.escape(short_uri),
+    )
+
+def resource_html(resource, extended=True):
+    "A resource and its properties; with `extended`, its inverse ones too."
+    def format(v):
+        if callable(getattr(v, 'short_html', None)):
+            return v.short_html()
+        return quote(v)
+    s = '<div class="resource">'
+    if resource.has('foaf:name'):
+        s += '<h1>' + quote(resource['foaf:name']) + '</h1>'
+    s += '<a href="?url=%s">%s</a>' % (
+        quote(resource._uri),
+        quote(resource._uri),
+    )
+    s += '<div class="properties">'
+    for prop in resource.properties():
+        s += "<span style='font-size:130%%'>&rarr;</span> <a title='%s' href='%s' style='text-decoration:none;color: green'>%s</a> <span style='font-size:130%%'>&rarr;</span> %s<br/>\n" % (
+            quote(prop),
+            quote(prop),
+            resource.graph.shrink_uri(prop),
+            ', '.join(map(format, resource.all(prop))),
+        )
+    if extended:
+        for prop in resource.inverse_properties():
+            s += "<span style='font-size:130%%'>&larr;</span> is <a title='%s' href='%s' style='text-decoration:none;color: green'>%s</a> of <span style='font-size:130%%'>&larr;</span> %s<br/>\n" % (
+                quote(prop),
+                quote(prop),
+                resource.graph.shrink_uri(prop),
+                ', '.join(map(format, resource.all('-'+prop))),
+            )
+    s += '</div></div>'
+    return s
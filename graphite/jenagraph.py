@@ -0,0 +1,608 @@
+"""The Jena engine, which runs Jena in a JVM through JPype.
+
+Nothing here starts Java until a Jena engine is first used.
+"""
+
+from __future__ import print_function
+
+from rdfgraph import Engine, URINode, Literal, Blank, Config, \
+  RDFXML, N3, NTRIPLE, TURTLE, RDF_LANG_STRING, \
+  literal_lexical, literal_value, parse_ntriples, sparql_select
+
+import warnings
+warnings.filterwarnings("ignore", message="the sets module is deprecated")
+
+def jpype_module():
+    """JPype, imported when Java is first needed.
+
+    Only the Jena engines need it, so users of the other engines never
+    pay for loading it.
+    """
+    try:
+        import jpype
+    except ImportError:
+        raise RuntimeError("Install JPype: http://sourceforge.net/projects/jpype/")
+    return jpype
+
+def jena_classpath(libs=None):
+    """The jars to start the JVM with, found in the Jena libs directory.
+
+    Where there are several versions of one jar only the newest is used.
+    """
+    import glob
+    import os
+    import re
+    libs = libs or Config.jena_libs
+    newest = {}
+    for path in glob.glob(os.path.join(libs, '*.jar')):
+        m = re.match(r'^(.*?)-(\d[\d.]*)\.jar$', os.path.basename(path))
+        if m is None:
+            name, version = os.path.basename(path), ()
+        else:
+            name, version = m.group(1), tuple(
+                int(part) for part in m.group(2).split('.') if part)
+        if name not in newest or version > newest[name][0]:
+            newest[name] = (version, path)
+    if newest:
+        return sorted(path for version, path in newest.values())
+    # Name the jars we expect, so a missing install fails clearly.
+    return [libs + name for name in [
+        'jena-2.6.4.jar',
+        'log4j-1.2.13.jar',
+        'arq-2.8.8.jar',
+        'slf4j-api-1.5.8.jar',
+        'slf4j-log4j12-1.5.8.jar',
+        'xercesImpl-2.7.1.jar',
+        'iri-0.8.jar',
+        'icu4j-3.4.4.jar',
+        'stax-api-1.0.1.jar',
+    ]]
+
+def jvm_options(config=None):
+    "JVM arguments, other than the classpath, from the config."
+    config = config or Config
+    jvm_args = [
+        # Be a bit more reasonable with Java memory
+        '-XX:MaxHeapFreeRatio=30',
+        '-XX:MinHeapFreeRatio=10',
+    ]
+    if config.jvm_initial_heap:
+        jvm_args.append('-Xms' + config.jvm_initial_heap)
+    if config.jvm_heap:
+        jvm_args.append('-Xmx' + config.jvm_heap)
+    if config.jvm_gc:
+        jvm_args.append('-XX:+Use' + config.jvm_gc)
+    if config.jvm_share:
+        jvm_args.append('-Xshare:' + config.jvm_share)
+    jvm_args.extend(config.jvm_extra_args.split())
+    return jvm_args
+
+_jvm_running = False
+def runJVM():
+    "Start the JVM, if it isn't running yet."
+    global _jvm_running
+    if _jvm_running:
+        return
+    jpype = jpype_module()
+    if jpype.isJVMStarted():
+        _jvm_running = True
+        return
+    import os
+
+    if os.name == 'nt':
+        cp_sep = ';'
+    else:
+        cp_sep = ':'
+
+    jvm_args = jvm_options()
+    java_classpath = jena_classpath()
+    jvm_file = Config.jvm_file
+    if not jvm_file:
+        jvm_file = jpype.getDefaultJVMPath()
+        if not jvm_file:
+            home = os.environ.get('JAVA_HOME', '')
+            if os.name == 'nt':
+                jvm_file = os.path.join(home, 'bin','client','jvm.dll')
+            else:
+                jvm_file = os.path.join(home, 'jre', 'lib', 'amd64', 'server', 'libjvm.so')
+
+    if java_classpath:
+        jvm_args.append("-Djava.class.path=" + cp_sep.join(
+            map(os.path.abspath, java_classpath))
+        )
+
+
+    jpype.startJVM(jvm_file, *jvm_args)
+    _jvm_running = True
+
+def _jena_anon_id(label):
+    """The AnonId behind a blank node label from Jena's N-Triples writer.
+
+    The writer prefixes 'A', doubles any 'X' and writes other characters
+    that aren't letters or digits as 'X', their hex code, 'X'.
+    """
+    out = []
+    i = 1
+    while i < len(label):
+        c = label[i]
+        if c != 'X':
+            out.append(c)
+            i += 1
+        elif label[i+1:i+2] == 'X':
+            out.append('X')
+            i += 2
+        else:
+            end = label.index('X', i + 1)
+            out.append(unichr(int(label[i+1:end], 16)))
+            i = end + 1
+    return u''.join(out)
+
+class JenaBridge(object):
+    """The Java classes and typed nulls the Jena engines use.
+
+    Finding a class through JPackage or JClass is a reflective lookup,
+    so it's done once here, per Jena package, rather than on each call.
+    The first bridge starts the JVM.
+    """
+    bridges = {}
+
+    @classmethod
+    def get(cls, pkg_name):
+        bridge = cls.bridges.get(pkg_name, None)
+        if bridge is None:
+            runJVM()
+            bridge = cls.bridges[pkg_name] = cls(pkg_name)
+        return bridge
+
+    def __init__(self, pkg_name):
+        jpype = jpype_module()
+        JClass = jpype.JClass
+        self.JObject = JObject = jpype.JObject
+        self.JString = jpype.JString
+        model = pkg_name + '.rdf.model.'
+        query = pkg_name + '.query.'
+        self.ModelFactory = JClass(model + 'ModelFactory')
+        self.Resource = JClass(model + 'Resource')
+        self.Property = JClass(model + 'Property')
+        self.RDFNode = JClass(model + 'RDFNode')
+        self.AnonId = JClass(model + 'AnonId')
+        self.QueryFactory = JClass(query + 'QueryFactory')
+        self.QueryExecutionFactory = JClass(query + 'QueryExecutionFactory')
+        self.ArrayList = JClass('java.util.ArrayList')
+        # ARQ's iterator helpers, for taking a chunk of statements in one call
+        self.Iter = JClass('org.openjena.atlas.iterator.Iter')
+        self.StringReader = JClass('java.io.StringReader')
+        self.StringWriter = JClass('java.io.StringWriter')
+        # Wildcards in listStatements and friends
+        self.any_resource = JObject(None, self.Resource)
+        self.any_property = JObject(None, self.Property)
+        self.any_node = JObject(None, self.RDFNode)
+
+class Jena(object):
+    _jena_pkg_name = 'com.hp.hpl.jena'
+
+    def __init__(self, debug=False):
+        if debug:
+            if callable(debug):
+                self.debug = debug
+            else:
+                def debug(x):
+                    print(x)
+                self.debug = debug
+
+    def debug(self, msg): pass
+
+    # Built on first use, which is when the JVM starts.
+    _bridge = None
+    @property
+    def bridge(self):
+        if self._bridge is None:
+            self._bridge = JenaBridge.get(self._jena_pkg_name)
+        return self._bridge
+
+    def _parse_literal(self, lit):
+        "Convert a Jena Literal from its lexical form, by its datatype URI"
+        datatype = lit.getDatatypeURI() or None
+        lang = lit.getLanguage() or None
+        if datatype is not None:
+            datatype = unicode(datatype)
+        return Literal(
+            literal_value(unicode(lit.getLexicalForm()), datatype),
+            datatype=datatype,
+            lang=lang and unicode(lang),
+        )
+
+    def _parse_resource(self, res):
+        if res.isAnon():
+            return Blank(res.getId())
+        elif res.isLiteral():
+            return self._parse_literal(res.asLiteral())
+        elif res.isURIResource():
+            return URINode(res.getURI())
+
+    def _iter_sparql_results(self, qexec):
+        try:
+            jresults = qexec.execSelect() # ResultsSet
+            while jresults.hasNext():
+                result = {}
+                soln = jresults.nextSolution() # QuerySolution
+                for name in soln.varNames():
+                    try:
+                        v = soln.getResource(name)   # Resource // Get a result variable - must be a resource
+                        if v:
+                            v = URINode(v.getURI())
+                    except:
+                        v = soln.getLiteral(name)    # Literal  // Get a result variable - must be a literal
+                        v = self._parse_literal(v)
+                    result[name] = v
+                yield result
+        finally:
+            qexec.close()
+
+    def load_sparql(self, endpoint, query):
+        return sparql_select(endpoint, query)
+
+
+class JenaGraph(Engine, Jena):
+    def __init__(self, **k):
+        super(JenaGraph, self).__init__(**k)
+        # Made by get_model, when the JVM is first needed.
+        self.jena_model = None
+
+    def _set_model(self, model):
+        self._jena_model = model
+        # Bound methods, looked up once per model
+        if model is None:
+            self._create_resource = None
+            self._create_property = None
+            self._create_typed_literal = None
+            self._create_literal = None
+        else:
+            self._create_resource = model.createResource
+            self._create_property = model.createProperty
+            self._create_typed_literal = model.createTypedLiteral
+            self._create_literal = model.createLiteral
+    jena_model = property(lambda self: self._jena_model, _set_model)
+
+    def get_model(self):
+        if not self.jena_model:
+            self.jena_model = self.bridge.ModelFactory.createDefaultModel()
+        return self.jena_model
+
+    def _new_submodel(self):
+        model = self.bridge.ModelFactory.createDefaultModel()
+        model = model.setNsPrefixes(self.jena_model.getNsPrefixMap())
+        return model
+
+    def add_inference(self, type):
+        if type == 'schema':
+            model = self.bridge.ModelFactory.createRDFSModel(self.get_model())
+            self.jena_model = model
+        else:
+            raise RuntimeError("Unknown inference type", type)
+
+    def expand_uri(self, uri):
+        return str(self.get_model().expandPrefix(self.bridge.JString(uri)))
+
+    def shrink_uri(self, uri):
+        return str(self.get_model().shortForm(self.bridge.JString(uri)))
+
+    def _mk_resource(self, res):
+        "Make this Subject thing suitable to pass to Jena"
+        if res is None:
+            return self.bridge.any_resource
+        assert getattr(res, 'is_node', False), (res, type(res))
+        if res.is_blank:
+            return self._mk_blank(res)
+        uri = res.datum
+        assert isinstance(uri, (unicode, str)), (uri, type(uri))
+        self.get_model()
+        bridge = self.bridge
+        return bridge.JObject(
+            self._create_resource(bridge.JString(uri)),
+            bridge.Resource,
+        )
+
+    def _mk_blank(self, node):
+        "Find the Jena resource for a blank node, by its AnonId or ID string"
+        anon_id = node.datum
+        if isinstance(anon_id, (unicode, str)):
+            anon_id = self.bridge.AnonId(anon_id)
+        return self.get_model().createResource(anon_id)
+
+    def _mk_property(self, uri):
+        "Make this Property thing suitable to pass to Jena"
+        if uri is None:
+            return self.bridge.any_property
+        assert getattr(uri, 'is_node', False), uri
+        assert uri.is_uri, uri
+        uri = uri.datum
+        assert isinstance(uri, (unicode, str)), (uri, type(uri))
+        self.get_model()
+        bridge = self.bridge
+        return bridge.JObject(
+            self._create_property(bridge.JString(uri)),
+            bridge.Property,
+        )
+
+    def _mk_object(self, obj):
+        "Make this Object thing suitable to pass to Jena"
+        if obj is None:
+            return self.bridge.any_node
+        assert getattr(obj, 'is_node', False), obj
+        self.get_model()
+        bridge = self.bridge
+        if obj.is_uri:
+            return bridge.JObject(
+                self._create_resource(obj.datum),
+                bridge.RDFNode,
+            )
+        elif obj.is_blank:
+            return self._mk_blank(obj)
+        JString = bridge.JString
+        lexical, datatype = literal_lexical(obj.value(), obj.datatype)
+        if obj.lang:
+            lit = self._create_literal(JString(lexical), JString(obj.lang))
+        elif datatype is None or datatype == RDF_LANG_STRING:
+            lit = self._create_literal(JString(lexical))
+        else:
+            lit = self._create_typed_literal(JString(lexical), JString(datatype))
+        return bridge.JObject(lit, bridge.RDFNode)
+
+    def as_node(self, obj):
+        return self.bridge.JObject(
+            self.get_model().createResource(obj.uri),
+            self.bridge.RDFNode,
+        )
+
+    def get_jena_format(self, format):
+        if isinstance(format, str):
+            return format
+        if format == TURTLE:
+            format = "TTL"
+        elif format == N3:
+            format = "N3"
+        elif format == NTRIPLE:
+            format = "N-TRIPLE"
+        elif format == RDFXML or format is None:
+            format = "RDF/XML"
+        else:
+            raise RuntimeError("bad format", format)
+        return format
+
+    def load_uri(self, uri, format=None, allow_error=False):
+        self.debug("JENA load "+uri)
+        format = self.get_jena_format(format)
+        jena = self.get_model()
+        try:
+            jena = jena.read(uri, format)
+        except:
+            if not allow_error: raise
+        else:
+            self.jena_model = jena
+
+    def load_text(self, text, format=TURTLE, encoding='utf-8'):
+        format = self.get_jena_format(format)
+        self.debug("JENA load text "+format)
+        jena = self.get_model()
+        uri = "tag:string-input"
+        if not isinstance(text, unicode):
+            text = unicode(text, encoding)
+        jstr = self.bridge.JString(text)
+        input = self.bridge.StringReader(jstr)
+        jena = jena.read(input, uri, format)
+        self.jena_model = jena
+
+    def has_triple(self, x, y, z):
+        self.debug(' '.join(["JENA has_triple ", repr(x), repr(y), repr(z)]))
+        jena = self.get_model()
+        sub = self._mk_resource(x)
+        pred = self._mk_property(y)
+        ob = self._mk_object(z)
+        return bool(jena.contains(sub, pred, ob))
+
+    def count_triples(self, x, y, z):
+        jena = self.get_model()
+        if x is None and y is None and z is None:
+            return int(jena.size())
+        stmts = jena.listStatements(
+            self._mk_resource(x),
+            self._mk_property(y),
+            self._mk_object(z),
+        )
+        # Step over the matches without converting or copying them.
+        count = 0
+        try:
+            has_next = stmts.hasNext
+            next_statement = stmts.nextStatement
+            while has_next():
+                next_statement()
+                count += 1
+        finally:
+            stmts.close()
+        return count
+
+    def set_triple(self, x, y, z):
+        self.debug(' '.join(["JENA add_triple ", repr(x), repr(y), repr(z)]))
+        jena = self.get_model()
+        sub = self._mk_resource(x)
+        pred = self._mk_property(y)
+        ob = self._mk_object(z)
+        stmt = jena.createStatement(
+            sub,
+            pred,
+            ob,
+        )
+        jena.add(stmt)
+
+    def add_triples(self, triples):
+        self.debug("JENA add_triples")
+        self.get_model().add(self._statement_list(triples))
+
+    def remove_triples(self, x, y, z):
+        self.debug(' '.join(["JENA remove_triples ", repr(x), repr(y), repr(z)]))
+        jena = self.get_model()
+        sub = self._mk_resource(x)
+        pred = self._mk_property(y)
+        ob = self._mk_object(z)
+        jena.removeAll(sub, pred, ob)
+
+    def _statement_list(self, triples):
+        jena = self.get_model()
+        stmts = self.bridge.ArrayList()
+        for x, y, z in triples:
+            stmts.add(jena.createStatement(
+                self._mk_resource(x),
+                self._mk_property(y),
+                self._mk_object(z),
+            ))
+        return stmts
+
+    def _update(self, f, *t):
+        "Run an update, inside a transaction if the model supports them."
+        jena = self.get_model()
+        if not jena.supportsTransactions():
+            return f(*t)
+        jena.begin()
+        try:
+            result = f(*t)
+        except:
+            jena.abort()
+            raise
+        jena.commit()
+        return result
+
+    def remove_patterns(self, patterns):
+        self.debug("JENA remove_patterns")
+        # Fully bound patterns go to Jena as one list; wildcards need a
+        # removeAll each.
+        exact = []
+        wild = []
+        for t in patterns:
+            if None in t:
+                wild.append(t)
+            else:
+                exact.append(t)
+        def remove():
+            jena = self.get_model()
+            if exact:
+                jena.remove(self._statement_list(exact))
+            for x, y, z in wild:
+                self.remove_triples(x, y, z)
+        self._update(remove)
+
+    def replace_triples(self, x, y, objects):
+        self.debug(' '.join(["JENA replace_triples ", repr(x), repr(y)]))
+        def replace():
+            jena = self.get_model()
+            jena.removeAll(
+                self._mk_resource(x),
+                self._mk_property(y),
+                self._mk_object(None),
+            )
+            jena.add(self._statement_list([(x, y, z) for z in objects]))
+        self._update(replace)
+
+    # Statements converted per crossing of the Java bridge
+    extract_chunk = 1000
+
+    def triples(self, x, y, z, limit=None, offset=0):
+        self.debug(' '.join(["JENA triples ", repr(x), repr(y), repr(z)]))
+        jena = self.get_model()
+        sub = self._mk_resource(x)
+        pred = self._mk_property(y)
+        ob = self._mk_object(z)
+
+        stmts = jena.listStatements(
+            sub,
+            pred,
+            ob,
+        )
+        for t in self._extract_statements(stmts, limit, offset):
+            yield t
+
+    def _extract_statements(self, stmts, limit=None, offset=0):
+        """Convert statements to Node triples a chunk at a time.
+
+        Each chunk is taken from the iterator as one Java list, added to
+        a scratch model and written out as one N-Triples string, so a
+        chunk costs a handful of bridge calls however many statements it
+        holds. Nothing past the current chunk is read until it's wanted.
+        """
+        take = self.bridge.Iter.take
+        factory = self.bridge.ModelFactory
+        try:
+            # Skip without converting anything.
+            while offset > 0:
+                skipped = take(stmts, min(offset, self.extract_chunk)).size()
+                if not skipped:
+                    return
+                offset -= skipped
+            while limit is None or limit > 0:
+                wanted = self.extract_chunk
+                if limit is not None:
+                    wanted = min(wanted, limit)
+                statements = take(stmts, wanted)
+                taken = statements.size()
+                if not taken:
+                    break
+                chunk = factory.createDefaultModel()
+                chunk.add(statements)
+                out = self.bridge.StringWriter()
+                chunk.write(out, "N-TRIPLE")
+                chunk.close()
+                text = unicode(out.toString())
+                for triple in parse_ntriples(text.splitlines(), blank_scope=''):
+                    yield tuple([
+                        node.is_blank and Blank(_jena_anon_id(node.datum)) or node
+                        for node in triple
+                    ])
+                if taken < wanted:
+                    break
+                if limit is not None:
+                    limit -= taken
+        finally:
+            stmts.close()
+
+    def _dump_model(self, model, format="TTL"):
+        out = self.bridge.StringWriter()
+        model.write(out, format)
+        return unicode.encode(out.toString(), 'utf-8')
+
+    def dump_resources(self, resources, format="TTL", extended=False):
+        model = self._new_submodel()
+        for res in resources:
+            res = res.datum
+            model.add(self.get_model().listStatements(
+                self._mk_resource(res),
+                self._mk_property(None),
+                self._mk_object(None),
+            ))
+            if extended:
+                model.add(self.get_model().listStatements(
+                    self._mk_resource(None),
+                    self._mk_property(None),
+                    self._mk_object(res),
+                ))
+        return self._dump_model(model)
+
+    def to_string(self, format="TTL"):
+        return self._dump_model(self.get_model(), self.get_jena_format(format))
+
+    def dump(self, *t, **k):
+        return self.to_string(*t, **k)
+
+    def add_namespace(self, prefix, uri):
+        self.get_model().setNsPrefix(prefix, uri)
+
+    def namespaces(self):
+        ns_dict = {}
+        for prefix in self.get_model().getNsPrefixMap().entrySet():
+            ns_dict[str(prefix.getKey())] = URINode(prefix.getValue())
+        return ns_dict
+
+    def sparql(self, query_text): # JenaGraph
+        model = self.get_model()
+        query = self.bridge.QueryFactory.create(query_text)
+        qexec = self.bridge.QueryExecutionFactory.create(query, model)
+        return self._iter_sparql_results(qexec)
@@ -0,0 +1,867 @@
+"""The pure Python engines: NativeGraph in memory and DiskGraph on disk.
+"""
+
+from __future__ import print_function
+
+from rdfgraph import Engine, URINode, RDFXML, TURTLE, binary_node, binary_term
+from rdflibgraph import Rdflib
+
+class NativeGraph(Engine, Rdflib):
+    """A pure Python triple store.
+
+    Triples are stored as the integer IDs of their terms (see
+    TermDictionary) and each triple is held three times, in SPO, POS and
+    OSP permutation indexes, so any pattern with a bound term is answered
+    from the matching index without a scan. No JVM is needed; rdflib is
+    only borrowed to parse and serialise RDF text.
+    """
+    def __init__(self, debug=False):
+        if debug:
+            if callable(debug):
+                self.debug = debug
+            else:
+                def debug(x):
+                    print(x)
+                self.debug = debug
+        self.ns = {}
+        # Keeps every stored Node alive, so its ID stays valid.
+        self.term_nodes = {}
+        self.spo = {}
+        self.pos = {}
+        self.osp = {}
+        # Index statistics: the number of triples, and how many use each
+        # term as a subject, predicate and object.
+        self.size = 0
+        self.subject_counts = {}
+        self.predicate_counts = {}
+        self.object_counts = {}
+
+    def debug(self, msg): pass
+
+    # Term IDs
+    def _term_id(self, node):
+        "Look up the ID of a term, or None if the store has never seen it."
+        if node.id in self.term_nodes:
+            return node.id
+        return None
+
+    def _intern(self, node):
+        if node.id is None:
+            raise ValueError("Can't store an unhashable term", node)
+        self.term_nodes[node.id] = node
+        return node.id
+
+    # Index maintenance
+    def _index_add(self, s, p, o):
+        objects = self.spo.setdefault(s, {}).setdefault(p, set())
+        if o in objects:
+            return
+        objects.add(o)
+        self.pos.setdefault(p, {}).setdefault(o, set()).add(s)
+        self.osp.setdefault(o, {}).setdefault(s, set()).add(p)
+        self.size += 1
+        for counts, tid in [
+            (self.subject_counts, s),
+            (self.predicate_counts, p),
+            (self.object_counts, o),
+        ]:
+            counts[tid] = counts.get(tid, 0) + 1
+
+    def _index_remove(self, s, p, o):
+        for index, a, b, c in [
+            (self.spo, s, p, o),
+            (self.pos, p, o, s),
+            (self.osp, o, s, p),
+        ]:
+            level = index[a]
+            leaves = level[b]
+            leaves.discard(c)
+            if not leaves:
+                del level[b]
+                if not level:
+                    del index[a]
+        self.size -= 1
+        for counts, tid in [
+            (self.subject_counts, s),
+            (self.predicate_counts, p),
+            (self.object_counts, o),
+        ]:
+            counts[tid] -= 1
+            if not counts[tid]:
+                del counts[tid]
+
+    def _match(self, s, p, o):
+        """Yield the ID triples matching a pattern of IDs, with None as a wildcard.
+
+        Each index level is copied before it's walked, so callers may add
+        and remove triples while they iterate, as they can on the other
+        engines.
+        """
+        if s is not None:
+            by_pred = self.spo.get(s, {})
+            if p is not None:
+                objects = by_pred.get(p, ())
+                if o is not None:
+                    if o in objects:
+                        yield s, p, o
+                else:
+                    for o in list(objects):
+                        yield s, p, o
+            elif o is not None:
+                for p in list(self.osp.get(o, {}).get(s, ())):
+                    yield s, p, o
+            else:
+                for p, objects in by_pred.items():
+                    for o in list(objects):
+                        yield s, p, o
+        elif p is not None:
+            by_obj = self.pos.get(p, {})
+            if o is not None:
+                for s in list(by_obj.get(o, ())):
+                    yield s, p, o
+            else:
+                for o, subjects in by_obj.items():
+                    for s in list(subjects):
+                        yield s, p, o
+        elif o is not None:
+            for s, preds in self.osp.get(o, {}).items():
+                for p in list(preds):
+                    yield s, p, o
+        else:
+            for s, by_pred in self.spo.items():
+                for p, objects in by_pred.items():
+                    for o in list(objects):
+                        yield s, p, o
+
+    def _pattern_ids(self, x, y, z):
+        "Map a pattern of Nodes to IDs, or return None if it can't match."
+        ids = []
+        for node in (x, y, z):
+            if node is None:
+                ids.append(None)
+                continue
+            tid = self._term_id(node)
+            if tid is None:
+                return None
+            ids.append(tid)
+        return ids
+
+    # Engine interface
+    def set_triple(self, x, y, z):
+        self.debug(' '.join(["NATIVE add_triple ", repr(x), repr(y), repr(z)]))
+        self._index_add(self._intern(x), self._intern(y), self._intern(z))
+
+    def add_triples(self, triples):
+        intern = self._intern
+        add = self._index_add
+        for x, y, z in triples:
+            add(intern(x), intern(y), intern(z))
+
+    def remove_triples(self, x, y, z):
+        self.debug(' '.join(["NATIVE remove_triples ", repr(x), repr(y), repr(z)]))
+        ids = self._pattern_ids(x, y, z)
+        if ids is None:
+            return
+        for s, p, o in list(self._match(*ids)):
+            self._index_remove(s, p, o)
+
+    def replace_triples(self, x, y, objects):
+        self.remove_triples(x, y, None)
+        s, p = self._intern(x), self._intern(y)
+        for z in objects:
+            self._index_add(s, p, self._intern(z))
+
+    def has_triple(self, x, y, z):
+        ids = self._pattern_ids(x, y, z)
+        if ids is None:
+            return False
+        for _ in self._match(*ids):
+            return True
+        return False
+
+    def count_triples(self, x, y, z):
+        ids = self._pattern_ids(x, y, z)
+        if ids is None:
+            return 0
+        s, p, o = ids
+        bound = 3 - ids.count(None)
+        if bound == 0:
+            return self.size
+        elif bound == 1:
+            if s is not None:
+                return self.subject_counts.get(s, 0)
+            elif p is not None:
+                return self.predicate_counts.get(p, 0)
+            return self.object_counts.get(o, 0)
+        elif bound == 2:
+            if o is None:
+                return len(self.spo.get(s, {}).get(p, ()))
+            elif s is None:
+                return len(self.pos.get(p, {}).get(o, ()))
+            return len(self.osp.get(o, {}).get(s, ()))
+        return int(self.has_triple(x, y, z))
+
+    def triples(self, x, y, z, limit=None, offset=0):
+        self.debug(' '.join(["NATIVE triples ", repr(x), repr(y), repr(z)]))
+        ids = self._pattern_ids(x, y, z)
+        if ids is None:
+            return
+        matches = self._match(*ids)
+        if limit is not None or offset:
+            import itertools
+            if limit is not None:
+                limit += offset
+            matches = itertools.islice(matches, offset, limit)
+        nodes = self.term_nodes
+        for s, p, o in matches:
+            yield nodes[s], nodes[p], nodes[o]
+
+    def _load_rdflib_graph(self, graph):
+        for s, p, o in graph:
+            self.set_triple(
+                self._convert_rdflib_value(s),
+                self._convert_rdflib_value(p),
+                self._convert_rdflib_value(o),
+            )
+        for prefix, uri in graph.namespaces():
+            self.ns.setdefault(unicode(prefix), unicode(uri))
+
+    def _to_rdflib_graph(self, triples=None):
+        import rdflib
+        graph = rdflib.Graph()
+        for prefix, uri in self.ns.items():
+            graph.bind(prefix, uri, True)
+        if triples is None:
+            triples = self.triples(None, None, None)
+        for s, p, o in triples:
+            graph.add((
+                self._convert_data_value(s),
+                self._convert_data_value(p),
+                self._convert_data_value(o),
+            ))
+        return graph
+
+    def load_uri(self, uri, format=TURTLE):
+        self.debug("NATIVE load "+uri)
+        import rdflib
+        graph = rdflib.Graph()
+        graph.parse(uri, format=self._convert_format_id(format or RDFXML))
+        self._load_rdflib_graph(graph)
+
+    def load_text(self, text, format=TURTLE, encoding='utf-8'):
+        self.debug("NATIVE load text")
+        import rdflib
+        graph = rdflib.Graph()
+        graph.parse(data=text, format=self._convert_format_id(format))
+        self._load_rdflib_graph(graph)
+
+    def sparql(self, query_text): # NativeGraph
+        import rdfextras
+        graph = self._to_rdflib_graph()
+        return self._iter_rdflib_results(graph.query(query_text))
+
+    def to_string(self, format=TURTLE):
+        graph = self._to_rdflib_graph()
+        return graph.serialize(format=self._convert_format_id(format))
+
+    def dump(self, *t, **k):
+        return self.to_string(*t, **k)
+
+    def dump_resources(self, resources, format=TURTLE, extended=False):
+        def matching():
+            for res in resources:
+                res = res.datum
+                for t in self.triples(res, None, None):
+                    yield t
+                if extended:
+                    for t in self.triples(None, None, res):
+                        yield t
+        graph = self._to_rdflib_graph(matching())
+        return graph.serialize(format=self._convert_format_id(format))
+
+    def add_inference(self, type):
+        raise RuntimeError("Unknown inference type", type)
+
+    def expand_uri(self, uri):
+        if ':' not in uri:
+            return uri
+        prefix, rest = uri.split(':', 1)
+        if prefix in self.ns:
+            return self.ns[prefix] + rest
+        return uri
+
+    def shrink_uri(self, uri):
+        best = None
+        for prefix, ns_uri in self.ns.items():
+            if uri.startswith(ns_uri):
+                if best is None or len(ns_uri) > len(self.ns[best]):
+                    best = prefix
+        if best is None:
+            return uri
+        return best + ':' + uri[len(self.ns[best]):]
+
+    def add_namespace(self, prefix, uri):
+        self.ns[prefix] = uri
+
+    def namespaces(self):
+        ns_dict = {}
+        for prefix, uri in self.ns.items():
+            ns_dict[str(prefix)] = URINode(uri)
+        return ns_dict
+
+
+class DiskGraph(NativeGraph):
+    """A persistent triple store kept in memory-mapped files.
+
+    The store is a directory. Terms are numbered and held in a term file
+    with an offsets table beside it, plus a table of term hashes sorted
+    for binary search. Triples are held as sorted SPO, POS and OSP
+    records of three big-endian term numbers, so a pattern with bound
+    terms is a binary search over the matching file. Opening the store
+    only maps the files; pages are read in as queries touch them.
+
+    Changes are appended to a log and kept in memory (the NativeGraph
+    indexes hold new triples, `removed` the stored triples since
+    deleted). merge() folds them into a new generation of the files,
+    which happens by itself once `merge_limit` triples are pending. Only
+    one process should write to a store at a time.
+    """
+    manifest_name = 'manifest'
+    log_name = 'log'
+    terms_name = 'terms'
+    offsets_name = 'terms.offsets'
+    hashes_name = 'terms.hashes'
+    orders = [
+        ('spo', (0, 1, 2)),
+        ('pos', (1, 2, 0)),
+        ('osp', (2, 0, 1)),
+    ]
+    _order_of = dict(orders)
+    record_size = 12
+    # Bound terms in a pattern, by position, pick the index to search.
+    _index_for = {
+        (): 'spo', (0,): 'spo', (0, 1): 'spo', (0, 1, 2): 'spo',
+        (1,): 'pos', (1, 2): 'pos',
+        (2,): 'osp', (0, 2): 'osp',
+    }
+    merge_limit = 1000000
+    node_cache_size = 100000
+
+    def __init__(self, path, debug=False):
+        import os
+        NativeGraph.__init__(self, debug=debug)
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.maps = {}
+        self.files = []
+        self.removed = set()
+        self.log = None
+        self.open_files()
+        self.replay_log()
+
+    def _file(self, name):
+        import os
+        return os.path.join(self.path, name)
+
+    # Opening and closing
+    def open_files(self):
+        import marshal
+        try:
+            f = open(self._file(self.manifest_name), 'rb')
+        except IOError:
+            self.manifest = {'generation': 0, 'terms': 0, 'triples': 0}
+        else:
+            try:
+                self.manifest = marshal.load(f)
+            finally:
+                f.close()
+        self.ns.update(self.manifest.get('namespaces', {}))
+        names = [self.terms_name, self.offsets_name]
+        names += [self._index_name(name) for name in self._generation_files()]
+        for name in names:
+            self.maps[name] = self._map(name)
+        self.term_count = self.manifest['terms']
+        self.triple_count = self.manifest['triples']
+        self._nodes = {}
+        self._ids = {}
+        # Namespace entries in the log, which a merge folds into the manifest
+        self.ns_changes = 0
+
+    def _map(self, name):
+        "Map a file read-only, or return an empty string for an empty file."
+        import mmap
+        try:
+            f = open(self._file(name), 'rb')
+        except IOError:
+            return ''
+        try:
+            f.seek(0, 2)
+            if not f.tell():
+                return ''
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            # The map stays valid once the file is closed.
+            f.close()
+
+    def _generation_files(self):
+        return [self.hashes_name] + [name for name, order in self.orders]
+
+    def _index_name(self, name, generation=None):
+        if generation is None:
+            generation = self.manifest['generation']
+        return '%s.%d' % (name, generation)
+
+    @staticmethod
+    def _spo(order, record):
+        "Put a record from the index with the given order back in SPO order."
+        triple = [None, None, None]
+        for i, n in zip(order, record):
+            triple[i] = n
+        return tuple(triple)
+
+    def close_files(self):
+        for m in self.maps.values():
+            if hasattr(m, 'close'):
+                m.close()
+        self.maps = {}
+
+    def close(self):
+        self.close_files()
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+
+    # The change log
+    def replay_log(self):
+        import marshal
+        try:
+            f = open(self._file(self.log_name), 'rb')
+        except IOError:
+            pass
+        else:
+            good = 0
+            try:
+                while True:
+                    try:
+                        entry = marshal.load(f)
+                    except (EOFError, ValueError, TypeError):
+                        break
+                    self._apply(entry)
+                    good = f.tell()
+                f.seek(0, 2)
+                torn = f.tell() != good
+            finally:
+                f.close()
+            if torn:
+                # A write was cut short; drop the partial entry.
+                self.debug("DISK dropping a torn log entry")
+                f = open(self._file(self.log_name), 'r+b')
+                try:
+                    f.truncate(good)
+                finally:
+                    f.close()
+        self.log = open(self._file(self.log_name), 'ab')
+
+    def _write_log(self, entry):
+        import marshal
+        marshal.dump(entry, self.log)
+        self.log.flush()
+
+    def _apply(self, entry):
+        op = entry[0]
+        if op == 'add':
+            self._add(map(binary_node, t) for t in entry[1])
+        elif op == 'remove':
+            self._remove(*[t if t is None else binary_node(t) for t in entry[1]])
+        elif op == 'ns':
+            self.ns[entry[1]] = entry[2]
+            self.ns_changes += 1
+        else:
+            raise ValueError("Unknown log entry", op)
+
+    # Reading the files
+    def _offset(self, tid):
+        import struct
+        return struct.unpack_from('>Q', self.maps[self.offsets_name], tid * 8)[0]
+
+    def _node(self, tid):
+        "Decode a stored term number to a Node."
+        node = self._nodes.get(tid, None)
+        if node is None:
+            import marshal
+            start, end = self._offset(tid), self._offset(tid + 1)
+            node = binary_node(marshal.loads(self.maps[self.terms_name][start:end]))
+            if len(self._nodes) >= self.node_cache_size:
+                self._nodes.clear()
+            self._nodes[tid] = node
+        return node
+
+    @staticmethod
+    def _term_hash(data):
+        import hashlib
+        return hashlib.sha1(data).digest()[:8]
+
+    def _stored_id(self, node):
+        "The stored term number of a Node, or None if it isn't stored."
+        import marshal
+        import struct
+        if not self.term_count or node.id is None:
+            return None
+        if node.id in self._ids:
+            return self._ids[node.id]
+        data = marshal.dumps(binary_term(node))
+        key = self._term_hash(data)
+        hashes = self.maps[self._index_name(self.hashes_name)]
+        i = self._lower_bound(hashes, key, self.term_count)
+        found = None
+        while i < self.term_count:
+            pos = i * self.record_size
+            if hashes[pos:pos+8] != key:
+                break
+            tid = struct.unpack_from('>I', hashes, pos + 8)[0]
+            if self.maps[self.terms_name][self._offset(tid):self._offset(tid + 1)] == data:
+                found = tid
+                break
+            i += 1
+        if len(self._ids) >= self.node_cache_size:
+            self._ids.clear()
+        self._ids[node.id] = found
+        return found
+
+    def _lower_bound(self, data, key, count):
+        "The first record in sorted fixed size records not less than key."
+        size = self.record_size
+        width = len(key)
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = mid * size
+            if data[pos:pos+width] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _upper_bound(self, data, key, count):
+        "The first record in sorted fixed size records past the key prefix."
+        size = self.record_size
+        width = len(key)
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = mid * size
+            if data[pos:pos+width] <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _stored_pattern(self, x, y, z):
+        """Map a pattern of Nodes to stored term numbers.
+
+        Returns None if a bound term isn't stored, so nothing can match.
+        """
+        ids = []
+        for node in (x, y, z):
+            if node is None:
+                ids.append(None)
+                continue
+            tid = self._stored_id(node)
+            if tid is None:
+                return None
+            ids.append(tid)
+        return ids
+
+    def _stored_range(self, ids):
+        "Pick an index for a pattern of term numbers and find its records."
+        import struct
+        bound = tuple(i for i in range(3) if ids[i] is not None)
+        name = self._index_for[bound]
+        order = self._order_of[name]
+        prefix = []
+        for i in order:
+            if ids[i] is None:
+                break
+            prefix.append(ids[i])
+        data = self.maps[self._index_name(name)]
+        key = struct.pack('>%dI' % len(prefix), *prefix)
+        if not key:
+            return name, order, data, 0, self.triple_count
+        return (name, order, data,
+            self._lower_bound(data, key, self.triple_count),
+            self._upper_bound(data, key, self.triple_count))
+
+    def _stored_match(self, ids):
+        "Yield the stored ID triples, in SPO order, matching a pattern."
+        import struct
+        name, order, data, lo, hi = self._stored_range(ids)
+        removed = self.removed
+        unpack = struct.unpack_from
+        spo = self._spo
+        size = self.record_size
+        for pos in xrange(lo * size, hi * size, size):
+            triple = spo(order, unpack('>III', data, pos))
+            if removed and triple in removed:
+                continue
+            yield triple
+
+    def _stored_triples(self, x, y, z):
+        if not self.triple_count:
+            return
+        ids = self._stored_pattern(x, y, z)
+        if ids is None:
+            return
+        node = self._node
+        for s, p, o in self._stored_match(ids):
+            yield node(s), node(p), node(o)
+
+    # Applying changes
+    def _add(self, triples):
+        pending = []
+        for x, y, z in triples:
+            ids = self._stored_pattern(x, y, z)
+            if ids is not None and None not in ids:
+                ids = tuple(ids)
+                if ids in self.removed:
+                    self.removed.discard(ids)
+                if self._stored_has(ids):
+                    continue
+            pending.append((x, y, z))
+        NativeGraph.add_triples(self, pending)
+
+    def _stored_has(self, ids):
+        name, order, data, lo, hi = self._stored_range(ids)
+        return hi > lo
+
+    def _remove(self, x, y, z):
+        if self.triple_count:
+            ids = self._stored_pattern(x, y, z)
+            if ids is not None:
+                self.removed.update(list(self._stored_match(ids)))
+        NativeGraph.remove_triples(self, x, y, z)
+
+    # Engine interface
+    def set_triple(self, x, y, z):
+        self.debug(' '.join(["DISK add_triple ", repr(x), repr(y), repr(z)]))
+        self.add_triples([(x, y, z)])
+
+    def add_triples(self, triples):
+        triples = list(triples)
+        if not triples:
+            return
+        self._write_log(('add', [map(binary_term, t) for t in triples]))
+        self._add(triples)
+        self._check_merge()
+
+    def _check_merge(self):
+        if self.size + self.ns_changes >= self.merge_limit:
+            self.merge()
+
+    def remove_triples(self, x, y, z):
+        self.debug(' '.join(["DISK remove_triples ", repr(x), repr(y), repr(z)]))
+        self._write_log(('remove', [t if t is None else binary_term(t) for t in (x, y, z)]))
+        self._remove(x, y, z)
+
+    def replace_triples(self, x, y, objects):
+        self.remove_triples(x, y, None)
+        self.add_triples((x, y, z) for z in objects)
+
+    def _load_rdflib_graph(self, graph):
+        convert = self._convert_rdflib_value
+        self.add_triples(
+            (convert(s), convert(p), convert(o)) for s, p, o in graph)
+        for prefix, uri in graph.namespaces():
+            if unicode(prefix) not in self.ns:
+                self.add_namespace(unicode(prefix), unicode(uri))
+
+    def scratch_engine(self):
+        return NativeGraph()
+
+    def add_namespace(self, prefix, uri):
+        # Every Graph opened over the store adds the default namespaces.
+        if self.ns.get(prefix, None) == uri:
+            return
+        self._write_log(('ns', prefix, uri))
+        self.ns[prefix] = uri
+        self.ns_changes += 1
+        self._check_merge()
+
+    def has_triple(self, x, y, z):
+        for _ in self.triples(x, y, z, limit=1):
+            return True
+        return False
+
+    def count_triples(self, x, y, z):
+        total = NativeGraph.count_triples(self, x, y, z)
+        if not self.triple_count:
+            return total
+        ids = self._stored_pattern(x, y, z)
+        if ids is None:
+            return total
+        if self.removed:
+            for _ in self._stored_match(ids):
+                total += 1
+            return total
+        name, order, data, lo, hi = self._stored_range(ids)
+        return total + hi - lo
+
+    def triples(self, x, y, z, limit=None, offset=0):
+        self.debug(' '.join(["DISK triples ", repr(x), repr(y), repr(z)]))
+        import itertools
+        matches = itertools.chain(
+            self._stored_triples(x, y, z),
+            NativeGraph.triples(self, x, y, z),
+        )
+        if limit is not None or offset:
+            if limit is not None:
+                limit += offset
+            matches = itertools.islice(matches, offset, limit)
+        return matches
+
+    # Merging
+    def merge(self):
+        """Fold the logged changes into a new generation of the files.
+
+        New terms are appended to the term files, and each index is
+        rewritten by merging its sorted records with the sorted new ones,
+        so only the pending changes are held in memory.
+        """
+        import marshal
+        import os
+        import struct
+        self.debug("DISK merge")
+        if not self.size and not self.removed:
+            self._write_manifest(dict(self.manifest, namespaces=dict(self.ns)))
+            self._reset_log()
+            return
+        # Number the new terms after the stored ones.
+        new_terms = []
+        numbers = {}
+        def number(node):
+            tid = numbers.get(node.id, None)
+            if tid is None:
+                tid = self._stored_id(node)
+                if tid is None:
+                    tid = self.term_count + len(new_terms)
+                    new_terms.append(marshal.dumps(binary_term(node)))
+                numbers[node.id] = tid
+            return tid
+        added = [
+            (number(x), number(y), number(z))
+            for x, y, z in NativeGraph.triples(self, None, None, None)
+        ]
+        generation = self.manifest['generation'] + 1
+        term_count = self.term_count + len(new_terms)
+        self._append_terms(new_terms)
+        self._write_sorted(self._index_name(self.hashes_name, generation),
+            self._hash_records(new_terms),
+            self._records(self.maps[self._index_name(self.hashes_name)], self.term_count))
+        triple_count = None
+        for name, order in self.orders:
+            pending = sorted(
+                struct.pack('>III', *[t[i] for i in order]) for t in added)
+            stored = self._stored_records(name, order)
+            count = self._write_sorted(self._index_name(name, generation), pending, stored)
+            if triple_count is None:
+                triple_count = count
+        self.close_files()
+        old = [self._index_name(name) for name in self._generation_files()]
+        manifest = {
+            'generation': generation,
+            'terms': term_count,
+            'triples': triple_count,
+            'namespaces': dict(self.ns),
+        }
+        self._write_manifest(manifest)
+        for name in old:
+            try:
+                os.remove(self._file(name))
+            except OSError:
+                pass
+        self._reset_log()
+        NativeGraph.__init__(self)
+        self.removed = set()
+        self.open_files()
+
+    def _append_terms(self, new_terms):
+        import struct
+        # Cut off anything a failed merge left past the stored terms.
+        end = self.term_count and self._offset(self.term_count)
+        f = open(self._file(self.terms_name), 'ab')
+        try:
+            f.truncate(end)
+            for data in new_terms:
+                f.write(data)
+        finally:
+            f.close()
+        f = open(self._file(self.offsets_name), 'ab')
+        try:
+            f.truncate(self.term_count and (self.term_count + 1) * 8)
+            offsets = [] if self.term_count else [0]
+            for data in new_terms:
+                end += len(data)
+                offsets.append(end)
+            f.write(struct.pack('>%dQ' % len(offsets), *offsets))
+        finally:
+            f.close()
+
+    def _hash_records(self, new_terms):
+        import struct
+        first = self.term_count
+        return sorted(
+            self._term_hash(data) + struct.pack('>I', first + i)
+            for i, data in enumerate(new_terms))
+
+    def _records(self, data, count):
+        size = self.record_size
+        for pos in xrange(0, count * size, size):
+            yield data[pos:pos+size]
+
+    def _stored_records(self, name, order):
+        "Yield an index's records, less the removed triples."
+        import struct
+        data = self.maps[self._index_name(name)]
+        if not self.removed:
+            for record in self._records(data, self.triple_count):
+                yield record
+            return
+        removed = self.removed
+        spo = self._spo
+        for record in self._records(data, self.triple_count):
+            if spo(order, struct.unpack('>III', record)) not in removed:
+                yield record
+
+    def _write_sorted(self, name, *sources):
+        "Merge sorted records from each source into a file; return the count."
+        import heapq
+        count = 0
+        f = open(self._file(name), 'wb')
+        try:
+            for record in heapq.merge(*sources):
+                f.write(record)
+                count += 1
+        finally:
+            f.close()
+        return count
+
+    def _write_manifest(self, manifest):
+        import marshal
+        import os
+        name = self._file(self.manifest_name)
+        f = open(name + '.new', 'wb')
+        try:
+            marshal.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        # Renaming the manifest into place commits the generation.
+        os.rename(name + '.new', name)
+        self.manifest = manifest
+
+    def _reset_log(self):
+        if self.log is not None:
+            self.log.close()
+        self.log = open(self._file(self.log_name), 'wb')
+        self.ns_changes = 0
@@ -4,6 +4,9 @@ Ripped off from Chris Gutteridge's Graphite: http://graphite.ecs.soton.ac.uk/
 
 from __future__ import print_function
 
+import sys
+import types
+
 # CONFIG! (finally)
 
 class Config(object):
@@ -12,9 +15,34 @@ class Config(object):
     ]
     sparql_debug = False
     cache_dir = 'rdfgraph.cache'
+    # Bytes each cache may use before evicting entries; 0 for no limit.
+    cache_max_bytes = 256 << 20
+    # Seconds before a cached web document is checked again; negative
+    # for never.
+    cache_ttl = 24 * 60 * 60
+    # Threads fetching documents when many URIs are loaded at once, and
+    # how many of them may talk to one host at a time.
+    fetch_threads = 8
+    fetch_per_host = 2
+    # Seconds to wait on an HTTP connection before giving up.
+    http_timeout = 30.0
+    # JVM heap sizes (as -Xms/-Xmx take them, eg. '512m'), garbage
+    # collector (eg. 'SerialGC'), class data sharing mode ('auto', 'on'
+    # or 'off') and any other arguments. None leaves Java's default.
+    jvm_initial_heap = None
+    jvm_heap = None
+    jvm_gc = None
+    jvm_share = None
+    jvm_extra_args = ''
+
+    _loaded = False
+    def __getattribute__(self, name):
+        # The config files are read on first use, not at import.
+        if not name.startswith('_') and not object.__getattribute__(self, '_loaded'):
+            self._loaded = True
+            self.load()
+        return object.__getattribute__(self, name)
 
-    def __init__(self):
-        self.load()
     def load(self):
         import os
         base_dir = os.path.dirname(__file__)
@@ -53,6 +81,26 @@ class Config(object):
         except:
             cache_dir = self.cache_dir
         self.cache_dir = os.path.join(work_dir, cache_dir)
+        try:
+            self.cache_max_bytes = cp.getint('config', 'cache_max_bytes')
+        except: pass
+        try:
+            self.cache_ttl = cp.getint('config', 'cache_ttl')
+        except: pass
+        try:
+            self.fetch_threads = cp.getint('config', 'fetch_threads')
+        except: pass
+        try:
+            self.fetch_per_host = cp.getint('config', 'fetch_per_host')
+        except: pass
+        try:
+            self.http_timeout = cp.getfloat('config', 'http_timeout')
+        except: pass
+        for name in ['jvm_initial_heap', 'jvm_heap', 'jvm_gc', 'jvm_share',
+          'jvm_extra_args']:
+            try:
+                setattr(self, name, cp.get('config', name))
+            except: pass
 
 Config = Config()
 
@@ -81,6 +129,7 @@ N3 = 1002
 NTRIPLE = 1003
 TURTLE = 1004
 HTML = 1005 # Will support RDFa eventually.
+NQUADS = 1006
 
 # Some decorators
 def takes_list(f):
@@ -134,11 +183,13 @@ class FileCache(object):
     __contains__ = has
     def get_path(self, name):
         return self.index[name]
-    def get(self, name):
+    def read(self, name):
         if name not in self.index:
             raise KeyError(name)
         with self.open(self.index[name], 'rb') as f:
-            return f.read().decode('utf-8')
+            return f.read()
+    def get(self, name):
+        return self.read(name).decode('utf-8')
     __getitem__ = get
     def set(self, name, data):
         fname = self.index.get(name, None)
@@ -155,6 +206,7 @@ class FileCache(object):
         import os
         import tempfile
         fnum, fname = tempfile.mkstemp(prefix='d-', suffix='.rawdata', dir=self.dir)
+        os.close(fnum)
         return fname
 
     def load_index(self, allow_error=True):
@@ -179,9 +231,366 @@ class FileCache(object):
         finally:
             f.close()
 
+class FileLock(object):
+    """An advisory lock on a file, held shared or exclusively.
+
+    Locking is skipped where fcntl isn't available.
+    """
+    def __init__(self, path, exclusive=False):
+        self.path = path
+        self.exclusive = exclusive
+        self.f = None
+    def __enter__(self):
+        self.f = open(self.path, 'ab')
+        try:
+            import fcntl
+        except ImportError:
+            return self
+        if self.exclusive:
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_EX)
+        else:
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_SH)
+        return self
+    def __exit__(self, x, y, z):
+        # Closing the file releases the lock.
+        self.f.close()
+        self.f = None
+
+class ContentCache(object):
+    """A cache directory that many processes can share safely.
+
+    Entries are stored under the SHA-1 of their content: each is written
+    to a temporary file and renamed into place, so readers never see a
+    partial entry. The name to content index is an append-only journal,
+    folded into an index snapshot once it grows past `journal_limit`
+    bytes. Everyone holds a lock file shared while reading or appending;
+    only compaction and eviction take it exclusively.
+
+    Each entry can carry a dict of string metadata. An entry stored with
+    a `ttl` is stale that many seconds later. Once the content adds up to
+    more than `max_bytes`, the least recently used entries are evicted.
+    """
+    index_name = 'index'
+    journal_name = 'journal'
+    lock_name = 'lock'
+    objects_name = 'objects'
+    journal_limit = 1 << 20
+
+    def __init__(self, path):
+        import os
+        import threading
+        self.dir = os.path.join(Config.cache_dir, path)
+        self.max_bytes = Config.cache_max_bytes
+        self.ttl = Config.cache_ttl
+        # Name to (digest, metadata)
+        self.index = {}
+        # Bytes of content, as far as this process knows; None until counted
+        self.total_bytes = None
+        self.index_stamp = None
+        self.journal_offset = 0
+        self.mutex = threading.RLock()
+        for d in [self.dir, self._path(self.objects_name)]:
+            try:
+                os.makedirs(d)
+            except OSError:
+                if not os.path.isdir(d):
+                    raise
+        self.refresh()
+
+    def _path(self, *names):
+        import os
+        return os.path.join(self.dir, *names)
+
+    def _object_path(self, digest):
+        return self._path(self.objects_name, digest[:2], digest)
+
+    def _lock(self, exclusive=False):
+        return FileLock(self._path(self.lock_name), exclusive=exclusive)
+
+    # Reading the index
+    def _index_stamp(self):
+        import os
+        try:
+            st = os.stat(self._path(self.index_name))
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime, st.st_size)
+
+    def _entry_line(self, name, digest, meta=None):
+        "A journal line; a digest of '-' records a deletion."
+        import urllib
+        if isinstance(name, unicode):
+            name = name.encode('utf-8')
+        line = digest + ' ' + urllib.quote(name, safe='')
+        if meta:
+            line += ' ' + urllib.urlencode(sorted(meta.items()))
+        return line + '\n'
+
+    def _parse_lines(self, data, index):
+        "Apply complete journal lines to `index`; returns the bytes used."
+        import urllib
+        import urlparse
+        used = data.rfind('\n') + 1
+        for line in data[:used].splitlines():
+            if not line:
+                continue
+            parts = line.split(' ')
+            name = urllib.unquote(parts[1]).decode('utf-8')
+            if parts[0] == '-':
+                index.pop(name, None)
+                continue
+            meta = {}
+            if len(parts) > 2:
+                meta = dict(urlparse.parse_qsl(parts[2]))
+            index[name] = (parts[0], meta)
+        return used
+
+    def _reload(self):
+        "Catch up with other processes. Call with the lock held."
+        stamp = self._index_stamp()
+        if stamp != self.index_stamp:
+            # Someone compacted the journal - start again.
+            index = {}
+            try:
+                with open(self._path(self.index_name), 'rb') as f:
+                    self._parse_lines(f.read(), index)
+            except IOError:
+                pass
+            self.index = index
+            self.index_stamp = stamp
+            self.journal_offset = 0
+        try:
+            f = open(self._path(self.journal_name), 'rb')
+        except IOError:
+            return
+        try:
+            f.seek(self.journal_offset)
+            self.journal_offset += self._parse_lines(f.read(), self.index)
+        finally:
+            f.close()
+
+    def refresh(self):
+        "Pick up entries written by other processes."
+        with self.mutex:
+            with self._lock():
+                self._reload()
+
+    # Cache interface
+    def has(self, name):
+        if name not in self.index:
+            self.refresh()
+        return name in self.index
+    __contains__ = has
+
+    def get_path(self, name):
+        import os
+        if not self.has(name):
+            raise KeyError(name)
+        path = self._object_path(self.index[name][0])
+        try:
+            # The modification time doubles as the last use, for eviction.
+            os.utime(path, None)
+            return path
+        except OSError:
+            pass
+        # Another process evicted it since we last read the journal. Look
+        # again while holding the lock, so nothing can evict it meanwhile.
+        with self.mutex:
+            with self._lock():
+                self._reload()
+                entry = self.index.get(name, None)
+                if entry is not None:
+                    path = self._object_path(entry[0])
+                    try:
+                        os.utime(path, None)
+                        return path
+                    except OSError:
+                        pass
+        raise KeyError(name)
+
+    def read(self, name):
+        "Get an entry's content as bytes."
+        try:
+            f = open(self.get_path(name), 'rb')
+        except IOError:
+            # Evicted between finding and opening it.
+            raise KeyError(name)
+        with f:
+            return f.read()
+
+    def get(self, name):
+        return self.read(name).decode('utf-8')
+    __getitem__ = get
+
+    def meta(self, name):
+        "The metadata stored with an entry."
+        if not self.has(name):
+            raise KeyError(name)
+        return dict(self.index[name][1])
+
+    def is_fresh(self, name):
+        "False once an entry has outlived its TTL."
+        import time
+        expires = self.meta(name).get('expires', None)
+        return expires is None or time.time() < float(expires)
+
+    def _append(self, line, before=None):
+        with self.mutex:
+            with self._lock():
+                self._reload()
+                if before is not None:
+                    before()
+                # One write in append mode, so lines from different
+                # processes never interleave.
+                with open(self._path(self.journal_name), 'ab') as f:
+                    f.write(line)
+                    size = f.tell()
+                self._reload()
+            if size > self.journal_limit:
+                self.compact()
+
+    def set(self, name, data, meta=None):
+        import hashlib
+        import os
+        import time
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        meta = dict(meta or {})
+        if self.ttl >= 0 and 'expires' not in meta:
+            meta['expires'] = repr(time.time() + self.ttl)
+        digest = hashlib.sha1(data).hexdigest()
+        path = self._object_path(digest)
+        def store():
+            # Under the lock, so an eviction can't remove a shared object
+            # between this check and the entry being written.
+            if not os.path.exists(path):
+                self._write_object(path, data)
+                if self.total_bytes is not None:
+                    self.total_bytes += len(data)
+        self._append(self._entry_line(name, digest, meta), store)
+        if self.max_bytes > 0:
+            if self.total_bytes is None or self.total_bytes > self.max_bytes:
+                self.evict()
+    __setitem__ = set
+
+    def touch(self, name, meta=None):
+        """Mark an entry as fresh again without rewriting its content.
+
+        `meta` replaces the stored metadata, if given.
+        """
+        import time
+        if not self.has(name):
+            raise KeyError(name)
+        digest, old_meta = self.index[name]
+        meta = dict(meta or old_meta)
+        meta.pop('expires', None)
+        if self.ttl >= 0:
+            meta['expires'] = repr(time.time() + self.ttl)
+        self._append(self._entry_line(name, digest, meta))
+
+    def delete(self, name):
+        self._append(self._entry_line(name, '-'))
+    __delitem__ = delete
+
+    def evict(self):
+        "Drop least recently used entries until the cache fits max_bytes."
+        import os
+        with self.mutex:
+            with self._lock(exclusive=True):
+                self._reload()
+                by_digest = {}
+                for name, (digest, meta) in self.index.items():
+                    by_digest.setdefault(digest, []).append(name)
+                objects = []
+                total = 0
+                for digest in by_digest:
+                    try:
+                        st = os.stat(self._object_path(digest))
+                    except OSError:
+                        continue
+                    objects.append((st.st_mtime, st.st_size, digest))
+                    total += st.st_size
+                objects.sort()
+                evicted = []
+                for mtime, size, digest in objects:
+                    if self.max_bytes <= 0 or total <= self.max_bytes:
+                        break
+                    evicted.append(digest)
+                    total -= size
+                if evicted:
+                    lines = []
+                    for digest in evicted:
+                        for name in by_digest[digest]:
+                            lines.append(self._entry_line(name, '-'))
+                    with open(self._path(self.journal_name), 'ab') as f:
+                        f.write(''.join(lines))
+                    self._reload()
+                    for digest in evicted:
+                        try:
+                            os.remove(self._object_path(digest))
+                        except OSError:
+                            pass
+                self.total_bytes = total
+
+    def _write_object(self, path, data):
+        import os
+        import tempfile
+        d = os.path.dirname(path)
+        try:
+            os.makedirs(d)
+        except OSError:
+            if not os.path.isdir(d):
+                raise
+        fno, tmp = tempfile.mkstemp(prefix='tmp-', dir=d)
+        try:
+            f = os.fdopen(fno, 'wb')
+            try:
+                f.write(data)
+            finally:
+                f.close()
+            self._rename(tmp, path)
+        except:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def _rename(self, src, dst):
+        import os
+        if os.name == 'nt' and os.path.exists(dst):
+            # No atomic replace on Windows.
+            os.remove(dst)
+        os.rename(src, dst)
+
+    def compact(self):
+        "Fold the journal into the index snapshot."
+        import os
+        import tempfile
+        with self.mutex:
+            with self._lock(exclusive=True):
+                self._reload()
+                fno, tmp = tempfile.mkstemp(prefix='tmp-', dir=self.dir)
+                f = os.fdopen(fno, 'wb')
+                try:
+                    for name, (digest, meta) in self.index.items():
+                        f.write(self._entry_line(name, digest, meta))
+                finally:
+                    f.close()
+                self._rename(tmp, self._path(self.index_name))
+                open(self._path(self.journal_name), 'wb').close()
+                self.index_stamp = self._index_stamp()
+                self.journal_offset = 0
+
+
+class LazyCache(object):
+    "A class attribute that opens one of the caches when first used."
+    def __init__(self, name):
+        self.name = name
+    def __get__(self, obj, cls):
+        return caches[self.name]
+
 class CacheFactory(object):
     caches = {}
-    def __init__(self, klass=FileCache):
+    def __init__(self, klass=ContentCache):
         self.klass = klass
     def get(self, name):
         import os
@@ -192,6 +601,424 @@ class CacheFactory(object):
 
 caches = CacheFactory()
 
+def sniff_format(data, type=None):
+    "Guess the RDF format of a document from its start and its MIME type."
+    if type and type not in [
+        'text/plain',
+        'application/octet-stream',
+    ]:
+        if type in [
+            'text/turtle',
+        ]:
+            return TURTLE
+        elif type in [
+            'application/rdf+xml',
+            'text/xml',
+        ]:
+            return RDFXML
+        elif type in [
+            'text/n3',
+        ]:
+            return N3
+        elif type in [
+            'application/n-triples',
+        ]:
+            return NTRIPLE
+        elif type in [
+            'application/n-quads',
+        ]:
+            return NQUADS
+    all_data = data
+    data = data[:2048]
+    ldata = data.lower()
+    if ldata.find('<html>') >= 0:
+        return HTML
+    if ldata.find('<!doctype') >= 0:
+        return HTML
+    if ldata.find('<rdf:rdf>') >= 0:
+        return RDFXML
+    if ldata.find('@prefix') >= 0:
+        return TURTLE
+    if ldata.find('/rdf>') >= 0:
+        return RDFXML
+    if ldata.find(':rdf>') >= 0:
+        return RDFXML
+    return TURTLE
+
+
+#
+# The HTTP bit.
+#
+
+class HttpError(RuntimeError):
+    "An HTTP response with an error status."
+    def __init__(self, uri, status, response=None):
+        RuntimeError.__init__(self, "HTTP error", uri, status)
+        self.uri = uri
+        self.code = status
+        self.response = response
+
+class HttpResponse(object):
+    """A complete HTTP response.
+
+    `data` has been decoded from any gzip or deflate content coding.
+    """
+    def __init__(self, uri, status, msg, data):
+        self.uri = uri
+        self.status = status
+        self.msg = msg
+        self.data = data
+
+    def info(self):
+        return self.msg
+
+    def getheader(self, name, default=None):
+        return self.msg.getheader(name, default)
+
+    def mime(self):
+        "The MIME type, without parameters, or None."
+        ctype = self.getheader('content-type') or ''
+        return ctype.split(';')[0].strip().lower() or None
+
+    def charset(self, default='utf-8'):
+        ctype = self.getheader('content-type') or ''
+        for param in ctype.split(';')[1:]:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'charset':
+                return value.strip().strip('"') or default
+        return default
+
+    def text(self):
+        return self.data.decode(self.charset())
+
+def _decode_content(data, coding):
+    import zlib
+    coding = (coding or '').strip().lower()
+    if coding in ('', 'identity'):
+        return data
+    elif coding in ('gzip', 'x-gzip'):
+        return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+    elif coding == 'deflate':
+        try:
+            return zlib.decompress(data)
+        except zlib.error:
+            # Some servers send a raw deflate stream without the header.
+            return zlib.decompress(data, -zlib.MAX_WBITS)
+    raise ValueError("Unknown content coding", coding)
+
+class HttpClient(object):
+    """Makes HTTP requests over pooled keep-alive connections.
+
+    Idle connections are kept per host, up to `max_idle` of each, and
+    reused by later requests from any thread. Responses are read in full
+    and handed back as HttpResponses; redirects are followed, and other
+    error statuses raise HttpError. URIs other than http and https go
+    through urllib2.
+    """
+    max_idle = 4
+    max_redirects = 5
+    redirect_codes = (301, 302, 303, 307, 308)
+
+    def __init__(self, timeout=None):
+        import threading
+        self._timeout = timeout
+        # (scheme, host) to idle connections
+        self.idle = {}
+        self.mutex = threading.Lock()
+
+    @property
+    def timeout(self):
+        # Read late, so the module-level client doesn't load the config.
+        return self._timeout or Config.http_timeout
+
+    def _new_connection(self, scheme, netloc):
+        """Open a connection for a host, through a proxy if one is set.
+
+        Returns the connection and whether requests need the full URI.
+        """
+        import httplib
+        import urllib
+        klass = httplib.HTTPSConnection if scheme == 'https' else httplib.HTTPConnection
+        proxy = urllib.getproxies().get(scheme)
+        if proxy and not urllib.proxy_bypass(netloc.split(':')[0]):
+            import urlparse
+            proxy_host = urlparse.urlsplit(proxy)[1] or proxy
+            if scheme == 'https':
+                conn = klass(proxy_host, timeout=self.timeout)
+                conn.set_tunnel(netloc)
+                return conn, False
+            return httplib.HTTPConnection(proxy_host, timeout=self.timeout), True
+        return klass(netloc, timeout=self.timeout), False
+
+    def _connection(self, key):
+        "An idle connection for (scheme, host) if there is one, or a new one."
+        with self.mutex:
+            idle = self.idle.get(key)
+            if idle:
+                return idle.pop(), True
+        return self._new_connection(*key), False
+
+    def _release(self, key, conn):
+        with self.mutex:
+            idle = self.idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn[0].close()
+
+    def close(self):
+        "Close all the idle connections."
+        with self.mutex:
+            idle, self.idle = self.idle, {}
+        for conns in idle.values():
+            for conn, absolute in conns:
+                conn.close()
+
+    def request(self, uri, method='GET', headers=None, body=None):
+        """Make a request and return the HttpResponse.
+
+        A 304 Not Modified is returned rather than raised.
+        """
+        import urlparse
+        headers = dict(headers or {})
+        if not [h for h in headers if h.lower() == 'accept-encoding']:
+            headers['accept-encoding'] = 'gzip, deflate'
+        for i in range(self.max_redirects + 1):
+            scheme, netloc, path, query, fragment = urlparse.urlsplit(uri)
+            scheme = scheme.lower()
+            if scheme not in ('http', 'https'):
+                return self._urlopen(uri, headers)
+            target = path or '/'
+            if query:
+                target += '?' + query
+            response = self._send((scheme, netloc), uri, method, target, headers, body)
+            location = response.getheader('location')
+            if response.status in self.redirect_codes and location:
+                uri = urlparse.urljoin(uri, location)
+                if response.status == 303 or method == 'POST' and response.status in (301, 302):
+                    method, body = 'GET', None
+                continue
+            if response.status >= 300 and response.status != 304:
+                raise HttpError(uri, response.status, response)
+            return response
+        raise HttpError(uri, response.status, response)
+
+    def _send(self, key, uri, method, target, headers, body):
+        import httplib
+        import socket
+        while True:
+            conn, reused = self._connection(key)
+            http, absolute = conn
+            try:
+                http.request(method, uri if absolute else target, body, headers)
+                try:
+                    # Read headers through a buffer, not a byte at a time.
+                    # Safe as long as requests aren't pipelined.
+                    r = http.getresponse(buffering=True)
+                except TypeError:
+                    # Python 2.6
+                    r = http.getresponse()
+                data = r.read()
+            except (httplib.HTTPException, socket.error):
+                http.close()
+                if reused:
+                    # The server closed a kept-alive connection; try a new one.
+                    continue
+                raise
+            if r.will_close:
+                http.close()
+            else:
+                self._release(key, conn)
+            return HttpResponse(uri, r.status, r.msg,
+                _decode_content(data, r.getheader('content-encoding')))
+
+    def _urlopen(self, uri, headers):
+        import urllib2
+        f = urllib2.urlopen(urllib2.Request(uri, headers=headers), timeout=self.timeout)
+        try:
+            msg = f.info()
+            return HttpResponse(uri, 200, msg,
+                _decode_content(f.read(), msg.getheader('content-encoding')))
+        finally:
+            f.close()
+
+http_client = HttpClient()
+
+def sparql_request(endpoint, query, accept, client=None):
+    """Send a query to a SPARQL protocol endpoint.
+
+    Short queries are sent as a GET, which caches better; long ones are
+    POSTed.
+    """
+    import urllib
+    client = client or http_client
+    params = urllib.urlencode({'query': query.encode('utf-8')})
+    headers = {'accept': accept}
+    if len(params) < 2000:
+        sep = '&' if '?' in endpoint else '?'
+        return client.request(endpoint + sep + params, headers=headers)
+    headers['content-type'] = 'application/x-www-form-urlencoded'
+    return client.request(endpoint, method='POST', headers=headers, body=params)
+
+def _sparql_json_value(value):
+    kind = value['type']
+    if kind == 'uri':
+        return URINode(value['value'])
+    elif kind == 'bnode':
+        return Blank(value['value'])
+    datatype = value.get('datatype')
+    return Literal(literal_value(value['value'], datatype),
+        datatype=datatype, lang=value.get('xml:lang'))
+
+def sparql_term(node):
+    "Write a Node as a SPARQL term."
+    if node.is_uri:
+        return u'<' + unicode(node.datum) + u'>'
+    elif node.is_blank:
+        raise ValueError("Blank nodes can't be sent in a query", node)
+    lexical, datatype = literal_lexical(node.value(), node.datatype)
+    for char, escape in [
+        (u'\\', u'\\\\'),
+        (u'"', u'\\"'),
+        (u'\n', u'\\n'),
+        (u'\r', u'\\r'),
+    ]:
+        lexical = lexical.replace(char, escape)
+    term = u'"' + lexical + u'"'
+    if node.lang:
+        term += u'@' + unicode(node.lang)
+    elif datatype and datatype != RDF_LANG_STRING:
+        term += u'^^<' + unicode(datatype) + u'>'
+    return term
+
+def sparql_select(endpoint, query, client=None):
+    "Run a SELECT at an endpoint, as dicts of Nodes by variable name."
+    import json
+    response = sparql_request(endpoint, query,
+        'application/sparql-results+json', client=client)
+    results = json.loads(response.text())
+    for binding in results['results']['bindings']:
+        result = {}
+        for name, value in binding.items():
+            result[name] = _sparql_json_value(value)
+        yield result
+
+def sparql_construct(endpoint, query, client=None):
+    "Run a CONSTRUCT or DESCRIBE at an endpoint; return its text and format."
+    response = sparql_request(endpoint, query,
+        'text/turtle, application/n-triples; q=0.9, application/rdf+xml; q=0.5',
+        client=client)
+    text = response.text()
+    format = sniff_format(text[:2048], type=response.mime())
+    if format == HTML:
+        raise RuntimeError("Got HTML data", endpoint, text[:2048])
+    return text, format
+
+
+class Fetcher(object):
+    """Runs a function over many items on a pool of threads.
+
+    At most `per_host` items with the same key (normally a URI's host)
+    are worked on at once. Results come back to the calling thread as
+    they finish, so it can do everything that isn't thread safe itself.
+    """
+    def __init__(self, threads=None, per_host=None):
+        self.threads = threads or Config.fetch_threads
+        self.per_host = per_host or Config.fetch_per_host
+
+    @staticmethod
+    def host(uri):
+        import urlparse
+        return urlparse.urlparse(uri)[1]
+
+    def run(self, f, items, key=None, timeout=None):
+        """Yield (item, result, exc_info) for each item, in completion order.
+
+        exc_info is None unless f raised. `timeout`, a number of seconds
+        or a function giving one for an item, gives up on items still
+        unfinished that long after the run starts: they come back with a
+        FetchTimeout error, and anything they return later is dropped.
+        Closing the generator early stops any items that haven't started.
+        """
+        import sys
+        import threading
+        import time
+        import Queue
+        key = key or self.host
+        items = list(items)
+        pending = list(enumerate(items))
+        active = {}
+        ready = threading.Condition()
+        results = Queue.Queue()
+        deadlines = {}
+        if timeout is not None:
+            start = time.time()
+            for i, item in pending:
+                seconds = timeout(item) if callable(timeout) else timeout
+                if seconds is not None:
+                    deadlines[i] = start + seconds
+        def next_item():
+            # Called with `ready` held.
+            while pending:
+                for n, (i, item) in enumerate(pending):
+                    k = key(item)
+                    if active.get(k, 0) < self.per_host:
+                        del pending[n]
+                        active[k] = active.get(k, 0) + 1
+                        return i, item, k
+                ready.wait()
+            return None, None, None
+        def work():
+            while True:
+                with ready:
+                    i, item, k = next_item()
+                if i is None:
+                    return
+                try:
+                    result = (i, item, f(item), None)
+                except:
+                    result = (i, item, None, sys.exc_info())
+                with ready:
+                    active[k] -= 1
+                    ready.notify_all()
+                results.put(result)
+        for n in range(min(self.threads, len(items))):
+            thread = threading.Thread(target=work)
+            thread.daemon = True
+            thread.start()
+        waiting = set(range(len(items)))
+        try:
+            while waiting:
+                # A timeout keeps the wait interruptible.
+                wait = 60
+                due = [deadlines[i] for i in waiting if i in deadlines]
+                if due:
+                    wait = max(0, min(wait, min(due) - time.time()))
+                try:
+                    i, item, result, error = results.get(True, wait)
+                except Queue.Empty:
+                    now = time.time()
+                    for i in sorted(waiting):
+                        if deadlines.get(i, now + 1) <= now:
+                            waiting.discard(i)
+                            with ready:
+                                pending[:] = [p for p in pending if p[0] != i]
+                            error = FetchTimeout("Timed out", items[i])
+                            yield items[i], None, (FetchTimeout, error, None)
+                    continue
+                if i not in waiting:
+                    # Already given up on.
+                    continue
+                waiting.discard(i)
+                yield item, result, error
+        finally:
+            with ready:
+                del pending[:]
+                ready.notify_all()
+
+class FetchTimeout(RuntimeError):
+    "A Fetcher gave up waiting for an item."
+
 class Context(object):
     def __init__(self):
         self.stack = []
@@ -211,12 +1038,16 @@ class Graph(object):
     Provides methods to load data and query in a nice way.
     """
     is_graph = True
-    web_cache = caches['web']
+    web_cache = LazyCache('web')
+    http = http_client
     def __init__(self, uri=None, namespaces=None, engine=None):
         if not engine:
             engine = self.create_default_engine()
         self.engine = engine
         self.graph = None
+        import weakref
+        # Resources already handed out, by Node ID.
+        self.resources = weakref.WeakValueDictionary()
         # A log of which URIs have been loaded already, for efficiency
         self.loaded = {}
         if uri:
@@ -225,115 +1056,204 @@ class Graph(object):
         if namespaces:
             self.add_ns(namespaces)
 
+    # Named rather than held, so the engine's module loads when first used.
+    _default_graph_class = 'RdflibGraph'
     @classmethod
     def get_default_engine_class(cls):
-        return getattr(Graph, '_default_graph_class', JenaGraph)
+        engine_class = Graph._default_graph_class
+        if isinstance(engine_class, str):
+            engine_class = lazy_name(engine_class)
+        return engine_class
     @classmethod
     def use_jena(cls):
-        Graph._default_graph_class = JenaGraph
+        Graph._default_graph_class = 'JenaGraph'
     @classmethod
     def use_rdflib(cls):
-        Graph._default_graph_class = RdflibGraph
+        Graph._default_graph_class = 'RdflibGraph'
+    @classmethod
+    def use_native(cls):
+        Graph._default_graph_class = 'NativeGraph'
 
     def create_default_engine(self):
         return self.get_default_engine_class()()
 
     @takes_list
     def read_uri(self, lst, allow_error=False, _cache=[], **k):
+        """Load documents from the web, through the web cache.
+
+        Several URIs are fetched at once on a Fetcher's threads; their
+        triples are added to the engine from this thread only.
+        """
         reload = k.get('reload', False)
+        format = k.get('format', None)
+        if format is not None:
+            format = self._parse_rdf_format(format)
         assert lst, "Load what?"
+        uris = []
         for datum in lst:
             assert getattr(datum, 'isURIResource', False), "Can't load {0!r}".format(datum)
+            uri = datum.uri()
+            if self._mark_loaded(uri, reload):
+                uris.append(uri)
+        def fetch(uri):
+            return self._fetch_uri(uri, reload=reload, format=format)
+        if len(uris) == 1:
+            results = [(uris[0], None, None)]
+        else:
+            results = Fetcher().run(fetch, uris)
+        for uri, fetched, error in results:
             try:
-                self._load_uri(datum.uri(), reload=reload, format=k.get('format', None))
+                if error is not None:
+                    raise error[0], error[1], error[2]
+                if fetched is None:
+                    fetched = fetch(uri)
+                self._ingest_uri(uri, fetched)
             except:
                 if not allow_error:
                     raise
         return self
     load = read_uri
 
+    def _mark_loaded(self, uri, reload=False):
+        "Note a URI as loaded; False if it was already and needn't be again."
+        import urlparse
+        # Strip the fragment from this URI before caching it.
+        uri_key = ''.join(urlparse.urlparse(uri)[:5])
+        if not reload and uri_key in self.loaded:
+            return False
+        self.loaded[uri_key] = True
+        return True
+
     def _sniff_format(self, data, type=None):
-        if type and type not in [
-            'text/plain',
-            'application/octet-stream',
-        ]:
-            if type in [
-                'text/turtle',
-            ]:
-                return TURTLE
-            elif type in [
-                'application/rdf+xml',
-                'text/xml',
-            ]:
-                return RDFXML
-            elif type in [
-                'text/n3',
-            ]:
-                return N3
-        all_data = data
-        data = data[:2048]
-        ldata = data.lower()
-        if ldata.find('<html>') >= 0:
-            return HTML
-        if ldata.find('<!doctype') >= 0:
-            return HTML
-        if ldata.find('<rdf:rdf>') >= 0:
-            return RDFXML
-        if ldata.find('@prefix') >= 0:
-            return TURTLE
-        if ldata.find('/rdf>') >= 0:
-            return RDFXML
-        if ldata.find(':rdf>') >= 0:
-            return RDFXML
-        return TURTLE
+        return sniff_format(data, type=type)
 
     def _load_uri(self, uri, **k):
-        "Load data from the web into the web cache and return the new model."
+        "Load data from the web, through the web cache."
         reload = k.get('reload', False)
-        if 'format' in k:
-            k['format'] = self._parse_rdf_format(k['format'])
-        # Strip the fragment from this URI before caching it.
+        format = k.get('format', None)
+        if format is not None:
+            format = self._parse_rdf_format(format)
         assert isinstance(uri, (str, unicode)), uri
-        import urlparse
-        uri_key = ''.join(urlparse.urlparse(uri)[:5])
-        if not reload and uri_key in self.loaded: return
-        self.loaded[uri_key] = True
-        # I preferred turtle here, but RDFXML seems more robust with dodgy input data.
-        CACHE_FORMAT = RDFXML
-        if uri in self.web_cache:
-            try:
-                self.import_uri('file:///'+self.web_cache.get_path(uri), format=CACHE_FORMAT)
-            except:
-                print("Error getting <"+uri+"> from cache")
-                raise
+        if not self._mark_loaded(uri, reload):
+            return
+        self._ingest_uri(uri, self._fetch_uri(uri, reload=reload, format=format))
+
+    def _fetch_uri(self, uri, reload=False, format=None):
+        """Get a document from the web cache or the network.
+
+        This doesn't touch the engine, so it's safe to run on another
+        thread. Returns a (kind, data, response) tuple for _ingest_uri:
+        'cached' with the cache entry's bytes, or 'text' with the
+        document's text and format. The response is None for a fresh
+        cache hit.
+        """
+        accept = {
+            'accept': 'text/turtle; q=0.9, text/n3; q=0.8, application/rdf+xml; q=0.5'
+        }
+        headers = dict(accept)
+        try:
+            meta = self.web_cache.meta(uri)
+            fresh = not reload and self.web_cache.is_fresh(uri)
+        except KeyError:
+            meta = None
+        if meta is not None:
+            if fresh:
+                data = self._read_cached_uri(uri)
+                if data is not None:
+                    return 'cached', data, None
+            else:
+                # Ask the server whether our copy is still good.
+                headers.update(self._cache_validators(meta))
+        r = self.http.request(uri, headers=headers)
+        if r.status == 304:
+            if meta is None:
+                raise HttpError(uri, r.status, r)
+            data = self._read_cached_uri(uri)
+            if data is not None:
+                return 'cached', data, r.info()
+            # Evicted while we asked; get it again in full.
+            r = self.http.request(uri, headers=accept)
+        if format is None:
+            format = self._sniff_format(r.data[:1024], type=r.mime())
+        if format == HTML:
+            raise RuntimeError("Got HTML data", uri, r.data[:1024], r.mime())
+        return 'text', (r.text(), format), r.info()
+
+    def _ingest_uri(self, uri, fetched):
+        "Add a document from _fetch_uri to the engine, and cache it."
+        kind, data, msg = fetched
+        if kind == 'cached':
+            if msg is not None:
+                # The server says our copy is still good.
+                try:
+                    self.web_cache.touch(uri, self._cache_meta(msg, self.web_cache.meta(uri)))
+                except KeyError:
+                    # Evicted since we read it; we still have the data.
+                    pass
+            self._load_cached_data(uri, data)
+            return
+        data, format = data
+        # Parse once, into a scratch engine, so the document's own triples
+        # can be cached in binary and then bulk loaded here.
+        scratch = Graph(engine=self.engine.scratch_engine())
+        scratch._read_formatted_text(data, format)
+        triples = list(scratch.engine.triples(None, None, None))
+        namespaces = {}
+        for prefix, ns_uri in scratch.prefixes().items():
+            namespaces[prefix] = unicode(ns_uri)
+        self._load_binary_triples(triples, namespaces)
+        self.web_cache.set(
+            uri,
+            dump_binary(triples, namespaces),
+            meta=self._cache_meta(msg),
+        )
+
+    def _read_cached_uri(self, uri):
+        "A cached document's bytes, or None if it has since been evicted."
+        try:
+            return self.web_cache.read(uri)
+        except KeyError:
+            return None
+        except:
+            print("Error getting <"+uri+"> from cache")
+            raise
+
+    def _load_cached_data(self, uri, data):
+        if is_binary(data):
+            self._load_binary_triples(*load_binary(data))
         else:
-            import urllib2
-            r = urllib2.Request(
-                uri,
-                headers={
-                    'accept': 'text/turtle; q=0.9, text/n3; q=0.8, application/rdf+xml; q=0.5'
-                }
-            )
-            f = urllib2.urlopen(r)
-            msg = f.info()
-            data = f.read(1024)
-            mime = msg.getheader("content-type")
-            enc = msg.getheader("content-encoding", 'utf-8')
-            format = self._sniff_format(data, type=mime)
-            if format == HTML:
-                raise RuntimeError("Got HTML data", uri, data, mime)
-            data += f.read()
-            data = data.decode(enc)
-            self.engine.load_text(data, format)
-
-            # Then write the data to the cache.
-            g = Graph()
-            g._read_formatted_text(data, format)
-            data2 = g.to_string(format=CACHE_FORMAT)
-            # TODO: optimise this out:
-            # Prove that the data loads before writing it to disk.
-            g.engine.load_text(data2, format=CACHE_FORMAT)
-            self.web_cache[uri] = data2
+            # Written as RDF/XML by an older version.
+            self.load_rdfxml(data.decode('utf-8'))
+
+    def _load_binary_triples(self, triples, namespaces):
+        self.engine.add_triples(triples)
+        known = self.prefixes()
+        for prefix, ns_uri in namespaces.items():
+            if prefix not in known:
+                self.engine.add_namespace(prefix, ns_uri)
+
+    def _cache_meta(self, msg, old=None):
+        "The web cache metadata for a response; validators are kept if absent."
+        meta = {}
+        if old:
+            for key in ['etag', 'modified']:
+                if key in old:
+                    meta[key] = old[key]
+        etag = msg.getheader('etag')
+        if etag:
+            meta['etag'] = etag
+        modified = msg.getheader('last-modified')
+        if modified:
+            meta['modified'] = modified
+        return meta
+
+    def _cache_validators(self, meta):
+        headers = {}
+        if 'etag' in meta:
+            headers['if-none-match'] = meta['etag']
+        if 'modified' in meta:
+            headers['if-modified-since'] = meta['modified']
+        return headers
 
     def file_uri(self, path):
         import urllib
@@ -346,6 +1266,10 @@ class Graph(object):
             k['format'] = self._sniff_format(data)
         else:
             k['format'] = self._parse_rdf_format(k['format'])
+        if k['format'] in (NTRIPLE, NQUADS):
+            with open(path, 'rb') as f:
+                self.load_stream(f, k['format'])
+            return
         uri = self.file_uri(path)
         self.import_uri(uri, **k)
 
@@ -380,6 +1304,11 @@ class Graph(object):
             'ntriple',
         ]:
             return NTRIPLE
+        elif f in [
+            'nquads',
+            'n-quads',
+        ]:
+            return NQUADS
         elif f in [
             'n3',
         ]:
@@ -399,6 +1328,8 @@ class Graph(object):
             self.read_ntriples(text)
         elif format == RDFXML:
             self.read_rdfxml(text)
+        elif format == NQUADS:
+            self.read_nquads(text)
         else:
             raise RuntimeError("bad format", format)
 
@@ -428,14 +1359,44 @@ class Graph(object):
     load_ntriples = load_ntriple
     load_NTRIPLE = load_ntriple
 
+    def read_nquads(self, text):
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        import StringIO
+        return self.load_stream(StringIO.StringIO(text), NQUADS)
+    load_nquads = read_nquads
+
+    def read_stream(self, stream, format=NTRIPLE,
+      chunk_size=1 << 16, batch_size=10000):
+        """Load N-Triples or N-Quads from a file-like object.
+
+        The stream is read `chunk_size` bytes at a time and parsed triples
+        go to the engine in batches of `batch_size`, so memory use doesn't
+        grow with the size of the input. Graph names in N-Quads are ignored.
+        """
+        format = self._parse_rdf_format(format)
+        if format not in (NTRIPLE, NQUADS):
+            raise RuntimeError("Can only stream N-Triples or N-Quads", format)
+        batch = []
+        lines = read_lines(stream, chunk_size)
+        for triple in parse_ntriples(lines, quads=(format == NQUADS)):
+            batch.append(triple)
+            if len(batch) >= batch_size:
+                self.engine.add_triples(batch)
+                batch = []
+        if batch:
+            self.engine.add_triples(batch)
+        return self
+    load_stream = read_stream
+
     def _parse_uri(self, data):
         if getattr(data, 'is_node', False):
             return data
         if isinstance(data, Resource):
-            if data.is_uri():
-                return data.datum
-            else:
+            if data.is_literal():
                 return None
+            else:
+                return data.datum
         if not isinstance(data, (str, unicode)):
             return None
         return URINode(self._expand_uri(data))
@@ -471,6 +1432,9 @@ class Graph(object):
         attempt = self._parse_uri(obj)
         if attempt is not None:
             return attempt
+        if isinstance(obj, Resource):
+            # Keep its datatype and language.
+            return obj.datum
         if callable(getattr(obj, 'value', None)):
             return Literal(obj.value())
         raise ValueError(obj)
@@ -489,35 +1453,8 @@ class Graph(object):
         return data
 
     def dump(self): # Graph
-        resources = {}
-        seen_resources = {}
-        for res, _, typ in self.triples(None, 'rdf:type', None):
-            if res.uri in seen_resources: continue
-            seen_resources[res.uri] = True
-            l = resources.setdefault(typ, [])
-            l.append(res)
-        import cgi
-        def quote(s):
-            return cgi.escape(unicode(s))
-        s = '<div class="graph">'
-        for typ in resources.keys():
-            s += '<div class="resource-type">'
-            typ_label = self[typ]['rdf:label']
-            if typ_label:
-                s += '<h2>'
-                s += quote(typ_label)
-                s += '</h2>'
-            else:
-                s += 'Type:'
-            s += ' <span class="uri">(<a href="%s">%s</a>)</span>' % (
-                quote(self.expand_uri(typ)),
-                quote(self.shrink_uri(typ)),
-            )
-            for res in resources[typ]:
-                s += res.dump()
-            s += '</div>'
-        s += '</div>'
-        return s
+        import htmldump
+        return htmldump.graph_html(self)
 
     def to_string(self, **k):
         return self.engine.dump(**k)
@@ -530,12 +1467,28 @@ class Graph(object):
             self.engine.dump_resources(res, extended=extended)
         )
 
-    def has_triple(self, *t): # Graph
-        "Returns True if triples(*t) would return any triples."
-        # TODO: Optimise this! Should use 'has...' in the engine.
-        for x in self.triples(*t):
-            return True
-        return False
+    def count(self, x, y, z): # Graph
+        "Returns the number of triples matching the pattern."
+        return self.engine.count_triples(
+            self._parse_subject(x),
+            self._parse_property(y),
+            self._parse_object(z),
+        )
+
+    def __len__(self):
+        return self.count(None, None, None)
+
+    def __nonzero__(self):
+        # An empty graph is still a graph.
+        return True
+
+    def has_triple(self, x, y, z): # Graph
+        "Returns True if triples(x, y, z) would return any triples."
+        return self.engine.has_triple(
+            self._parse_subject(x),
+            self._parse_property(y),
+            self._parse_object(z),
+        )
 
     def set_triple(self, x, y, z):
         self.engine.set_triple(
@@ -545,6 +1498,36 @@ class Graph(object):
         )
         return self
     add = set_triple
+
+    def add_many(self, triples, batch_size=10000):
+        """Add an iterable of (subject, property, object) triples.
+
+        Terms are parsed as for set_triple and sent to the engine in batches
+        of `batch_size`. Each distinct URI string is only parsed once.
+        """
+        parsed = {}
+        def parser(parse):
+            def parse_cached(term):
+                if not isinstance(term, (str, unicode)):
+                    return parse(term)
+                node = parsed.get(term, None)
+                if node is None:
+                    node = parsed[term] = parse(term)
+                return node
+            return parse_cached
+        parse_subject = parser(self._parse_subject)
+        parse_property = parser(self._parse_property)
+        parse_object = parser(self._parse_object)
+        batch = []
+        for x, y, z in triples:
+            batch.append((parse_subject(x), parse_property(y), parse_object(z)))
+            if len(batch) >= batch_size:
+                self.engine.add_triples(batch)
+                batch = []
+        if batch:
+            self.engine.add_triples(batch)
+        return self
+    set_triples = add_many
     def remove_triples(self, x, y, z):
         self.engine.remove_triples(
             self._parse_subject(x),
@@ -554,19 +1537,58 @@ class Graph(object):
         return self
     remove = remove_triples
 
+    def remove_many(self, patterns):
+        "Remove every triple matching any of an iterable of (x, y, z) patterns."
+        self.engine.remove_patterns([
+            (
+                self._parse_subject(x),
+                self._parse_property(y),
+                self._parse_object(z),
+            )
+            for x, y, z in patterns
+        ])
+        return self
+
+    def replace(self, x, y, values):
+        """Replace all values of property `y` on `x` with `values`.
+
+        `values` is a single value or a list of them. The engine does the
+        removal and the additions as one update.
+        """
+        if getattr(values, 'isResourceList', False) \
+          or isinstance(values, (list, tuple)):
+            values = list(values)
+        else:
+            values = [values]
+        self.engine.replace_triples(
+            self._parse_subject(x),
+            self._parse_property(y),
+            map(self._parse_object, values),
+        )
+        return self
+
     @gives_list
-    def triples(self, x, y, z):
+    def triples(self, x, y, z, limit=None, offset=0):
         triple_iter = self.engine.triples(
             self._parse_subject(x),
             self._parse_property(y),
             self._parse_object(z),
+            limit=limit,
+            offset=offset,
         )
+        wrap = self._resource
         for sub, pred, ob in triple_iter:
-            ob = Resource(self, ob)
-            sub = Resource(self, sub)
-            pred = Resource(self, pred)
+            yield wrap(sub), wrap(pred), wrap(ob)
 
-            yield sub, pred, ob
+    def _resource(self, node):
+        "Get the Resource wrapping a Node, sharing it while it's alive."
+        if node.id is None:
+            return Resource(self, node)
+        res = self.resources.get(node.id, None)
+        if res is None:
+            res = Resource(self, node)
+            self.resources[node.id] = res
+        return res
 
     def sparql(self, query_text): # Graph
         return SparqlList(self._parse_sparql_result(self.engine.sparql(query_text)))
@@ -576,18 +1598,18 @@ class Graph(object):
             output = {}
             for k, v in result.items():
                 if v.is_uri:
-                    v = Resource(self, v)
+                    v = self._resource(v)
                 output[k] = v
             yield output
 
     def resource(self, uri):
         if getattr(uri, 'is_resource', False):
             return uri
-        return Resource(self, self._parse_uri(uri))
+        return self._resource(self._parse_uri(uri))
     get = resource
     __getitem__ = resource
     def literal(self, thing):
-        return Resource(self, Literal(thing))
+        return self._resource(Literal(thing))
 
     def add_ns(self, *t, **k):
         return self.add_namespaces(*t, **k)
@@ -625,23 +1647,6 @@ def no_auto_query(f):
         with NoAutoQuery:
             return f(*t, **k)
     return g
-class SparqlStats(object):
-    """This is a non functional stub class.
-
-    Implementors could store stats on endpoint for deciding whether to send it a
-    particular query.
-    """
-    def __init__(self, uri, graph):
-        self.uri = uri
-        self.graph = graph
-
-    def use_for_triple(self, triple):
-        return True
-
-    def use_for_query(self, query):
-        return True
-
-
 class Reiterable(object):
     def __init__(self, iterable):
         self.iterable = iterable
@@ -692,8 +1697,8 @@ class ResourceList(Reiterable):
         return ResourceList(self.map_concat('all', prop))
 
     def has(self, prop):
-        for b in self.map('has', prop):
-            if b:
+        for r in self:
+            if r.has(prop):
                 return True
         return False
 
@@ -702,11 +1707,15 @@ class ResourceList(Reiterable):
     __getitem__ = get
 
     def load(self):
-        self.map('load')
+        _load_resources(self)
         return self
 
     def load_same_as(self):
-        self.map('load_same_as')
+        others = []
+        for res in self:
+            if getattr(res, 'isURIResource', False):
+                others.extend(res._same_as_others())
+        _load_resources(others)
         return self
 
     def sort(self, prop):
@@ -728,19 +1737,46 @@ class ResourceList(Reiterable):
             yield x
         for x in self:
             yield x
-    union = add
+
+    @gives_list
+    @takes_list
+    def union(self, others):
+        "Resources in either list, without repeats."
+        seen = set()
+        for lst in (others, self):
+            for x in lst:
+                if x not in seen:
+                    seen.add(x)
+                    yield x
 
     @gives_list
     @takes_list
     def remove(self, others):
-        dct = dict.fromkeys(others)
+        others = set(others)
         for x in self:
-            if x not in dct:
+            if x not in others:
                 yield x
-    intersection = remove
 
+    @gives_list
+    @takes_list
+    def intersection(self, others):
+        others = set(others)
+        for x in self:
+            if x in others:
+                yield x
+
+
+def _load_resources(resources):
+    "Load URI resources with one Graph.load call per graph, so they're fetched together."
+    graphs = {}
+    for res in resources:
+        if getattr(res, 'isURIResource', False):
+            graphs.setdefault(id(res.graph), (res.graph, []))[1].append(res)
+    for graph, lst in graphs.values():
+        graph.load(lst, allow_error=True)
 
 class Resource(object):
+    __slots__ = ('graph', 'datum', '_uri', '_same_as', '__weakref__')
     isResource = True
     is_resource = True
 
@@ -750,10 +1786,18 @@ class Resource(object):
         assert datum.is_node, datum
         self.graph = graph
         self.datum = datum
-        self.same_as_resources = []
+        # Most resources never load their sameAs links.
+        self._same_as = None
+        self._uri = None
         if datum.is_uri:
             self._uri = unicode(datum)
 
+    @property
+    def same_as_resources(self):
+        if self._same_as is None:
+            self._same_as = []
+        return self._same_as
+
     def _get_raw_datum(self):
         return self.datum
 
@@ -761,9 +1805,13 @@ class Resource(object):
         return [self]
 
     def __eq__(self, other):
+        if self is other:
+            return True
         if getattr(other, 'is_resource', False):
             other = other.datum
         return self.datum == other
+    def __ne__(self, other):
+        return not self.__eq__(other)
 
     def is_literal(self):
         return self.datum.is_literal
@@ -778,7 +1826,9 @@ class Resource(object):
     def __repr__(self):
         return "Resource(" + repr(self.datum) + ")"
     def __cmp__(self, other):
-        return cmp(self.datum, other.datum)
+        if getattr(other, 'is_resource', False):
+            other = other.datum
+        return cmp(self.datum, other)
     dump = __str__
 
     def uri(self):
@@ -816,7 +1866,9 @@ class Resource(object):
         return hash(self.datum)
 
     def _all_resources(self):
-        return [self] + self.same_as_resources
+        if not self._same_as:
+            return [self]
+        return [self] + self._same_as
 
     def properties(self):
         seen = {}
@@ -845,7 +1897,7 @@ class Resource(object):
     def get(self, *props):
         "Get a property"
         for prop in props:
-            for x in self.all(prop):
+            for x in self._all(prop, limit=1):
                 return x
         return None
     __getitem__ = get
@@ -858,8 +1910,7 @@ class Resource(object):
     def set(self, prop, obj):
         if not getattr(obj, 'is_resource', False):
             obj = self.graph.literal(obj)
-        self.graph.remove(self, prop, None)
-        self.graph.add(self, prop, obj)
+        self.graph.replace(self, prop, obj)
         return self
     __setitem__ = set
 
@@ -876,12 +1927,15 @@ class Resource(object):
 
     def all(self, prop):
         "Get a list of properties"
+        return self._all(prop)
+
+    def _all(self, prop, limit=None):
         prop, invert = self._parse_prop(prop)
         if invert:
-            for x, y, z in self.graph.triples(None, prop, self._get_raw_datum()):
+            for x, y, z in self.graph.triples(None, prop, self._get_raw_datum(), limit=limit):
                 yield x
         else:
-            for x, y, z in self.graph.triples(self._get_raw_datum(), prop, None):
+            for x, y, z in self.graph.triples(self._get_raw_datum(), prop, None, limit=limit):
                 yield z
 
     def has(self, prop):
@@ -897,63 +1951,34 @@ class Resource(object):
         return self
 
     def load_same_as(self): # URIResource
+        _load_resources(self._same_as_others())
+        return self
+
+    def _same_as_others(self):
+        "Note and return the resources this one is the same as."
+        others = []
         for i in [
             self.all('owl:sameAs'),
             self.all('-owl:sameAs'),
         ]:
-            for other in i:
+            # Loading adds triples, so finish reading before loading any.
+            for other in list(i):
                 other = Resource(self.graph, other)
                 if other not in self.same_as_resources:
                     self.same_as_resources.append(other)
-                other.load()
-        return self
+                others.append(other)
+        return others
 
     def to_string(self, extended=True): # Resource
         return self.graph.dump_resources(self._all_resources(), extended=extended)
 
     def short_html(self): # URIResource
-        import cgi
-        import urllib
-        uri = self._uri
-        short_uri = self.shrink_uri()
-        return '<a href="?url=%s">%s</a>' % (
-            cgi.escape(urllib.quote(uri)),
-            cgi.escape(short_uri),
-        )
+        import htmldump
+        return htmldump.resource_link(self)
 
     def dump(self, extended=True): # URIResource
-        import cgi
-        def quote(s):
-            return cgi.escape(unicode(s))
-        def format(v):
-            if callable(getattr(v, 'short_html', None)):
-                return v.short_html()
-            return quote(v)
-        s = '<div class="resource">'
-        if self.has('foaf:name'):
-            s += '<h1>' + quote(self['foaf:name']) + '</h1>'
-        s += '<a href="?url=%s">%s</a>' % (
-            quote(self._uri),
-            quote(self._uri),
-        )
-        s += '<div class="properties">'
-        for prop in self.properties():
-            s += "<span style='font-size:130%%'>&rarr;</span> <a title='%s' href='%s' style='text-decoration:none;color: green'>%s</a> <span style='font-size:130%%'>&rarr;</span> %s<br/>\n" % (
-                quote(prop),
-                quote(prop),
-                self.graph.shrink_uri(prop),
-                ', '.join(map(format, self.all(prop))),
-            )
-        if extended:
-            for prop in self.inverse_properties():
-                s += "<span style='font-size:130%%'>&larr;</span> is <a title='%s' href='%s' style='text-decoration:none;color: green'>%s</a> of <span style='font-size:130%%'>&larr;</span> %s<br/>\n" % (
-                    quote(prop),
-                    quote(prop),
-                    self.graph.shrink_uri(prop),
-                    ', '.join(map(format, self.all('-'+prop))),
-                )
-        s += '</div></div>'
-        return s
+        import htmldump
+        return htmldump.resource_html(self, extended=extended)
 
     def shrink_uri(self):
         return self.graph.shrink_uri(self._uri)
@@ -977,6 +2002,414 @@ class Resource(object):
         return uri[:uri.rfind('/')]
 
 
+#
+# The N-Triples bit.
+#
+
+def read_lines(stream, chunk_size=1 << 16):
+    "Split a file-like object into lines, reading a chunk at a time."
+    tail = ''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        lines = (tail + chunk).split('\n')
+        tail = lines.pop()
+        for line in lines:
+            yield line
+    if tail:
+        yield tail
+
+def _ntriples_line_re():
+    import re
+    iri = r'<([^>]*)>'
+    blank = r'_:([\w\-](?:[\w\-.]*[\w\-])?)'
+    literal = r'"((?:[^"\\]|\\.)*)"(?:@([a-zA-Z]+(?:-[a-zA-Z0-9]+)*)|\^\^<([^>]*)>)?'
+    term = '(?:%s|%s)' % (iri, blank)
+    return re.compile(
+        r'^\s*' + term +                         # subject: groups 1-2
+        r'\s*' + iri +                           # predicate: group 3
+        r'\s*(?:%s|%s|%s)' % (iri, blank, literal) + # object: groups 4-8
+        r'(?:\s*(?:%s|%s))?' % (iri, blank) +     # graph: groups 9-10
+        r'\s*\.\s*(?:#.*)?$',
+        re.UNICODE,
+    )
+_ntriples_line = _ntriples_line_re()
+
+def _ntriples_escape_re():
+    import re
+    return re.compile(r'\\(?:u([0-9A-Fa-f]{4})|U([0-9A-Fa-f]{8})|(.))')
+_ntriples_escape = _ntriples_escape_re()
+_ntriples_escapes = {
+    't': u'\t', 'b': u'\b', 'n': u'\n', 'r': u'\r', 'f': u'\f',
+    '"': u'"', "'": u"'", '\\': u'\\',
+}
+
+def _ntriples_unescape_match(m):
+    code = m.group(1) or m.group(2)
+    if code:
+        code = int(code, 16)
+        try:
+            return unichr(code)
+        except ValueError:
+            # Narrow Python builds need a surrogate pair.
+            code -= 0x10000
+            return unichr(0xD800 + (code >> 10)) + unichr(0xDC00 + (code & 0x3FF))
+    return _ntriples_escapes.get(m.group(3), m.group(0))
+
+def _ntriples_unescape(text):
+    if '\\' not in text:
+        return text
+    return _ntriples_escape.sub(_ntriples_unescape_match, text)
+
+
+#
+# Literal datatypes.
+#
+
+XSD = DEFAULT_NAMESPACES['xsd']
+RDF_LANG_STRING = DEFAULT_NAMESPACES['rdf'] + 'langString'
+
+def _xsd_boolean(lexical):
+    lexical = lexical.strip()
+    if lexical in ('true', '1'):
+        return True
+    if lexical in ('false', '0'):
+        return False
+    raise ValueError("Bad xsd:boolean", lexical)
+
+def _xsd_float(lexical):
+    lexical = lexical.strip()
+    # XSD spells infinity INF; Python wants inf.
+    return float({'INF': 'inf', '-INF': '-inf', '+INF': 'inf'}.get(lexical, lexical))
+
+def _xsd_decimal(lexical):
+    import decimal
+    try:
+        return decimal.Decimal(lexical.strip())
+    except decimal.InvalidOperation:
+        raise ValueError("Bad xsd:decimal", lexical)
+
+def _xsd_timezone_class():
+    import datetime
+    class XsdTimezone(datetime.tzinfo):
+        "A fixed UTC offset, as written on an xsd:dateTime."
+        def __init__(self, minutes):
+            self.minutes = minutes
+            self.offset = datetime.timedelta(minutes=minutes)
+        def utcoffset(self, dt):
+            return self.offset
+        def dst(self, dt):
+            return None
+        def tzname(self, dt):
+            if not self.minutes:
+                return 'Z'
+            sign = self.minutes < 0 and '-' or '+'
+            return '%s%02d:%02d' % ((sign,) + divmod(abs(self.minutes), 60))
+        def __repr__(self):
+            return 'XsdTimezone(%d)' % (self.minutes,)
+        def __eq__(self, other):
+            return isinstance(other, XsdTimezone) and self.minutes == other.minutes
+        def __ne__(self, other):
+            return not self.__eq__(other)
+        def __hash__(self):
+            return hash(self.minutes)
+    return XsdTimezone
+XsdTimezone = _xsd_timezone_class()
+
+def _xsd_time_parts(lexical):
+    "Split an XSD time into hour, minute, second, microsecond and tzinfo."
+    m = _xsd_time.match(lexical)
+    if m is None:
+        raise ValueError("Bad XSD time", lexical)
+    hour, minute, second, fraction, zone, sign, zh, zm = m.groups()
+    tz = None
+    if zone == 'Z':
+        tz = XsdTimezone(0)
+    elif zone:
+        minutes = int(zh) * 60 + int(zm)
+        tz = XsdTimezone(sign == '-' and -minutes or minutes)
+    micro = int(((fraction or '') + '000000')[:6])
+    return int(hour), int(minute), int(second), micro, tz
+
+def _xsd_time_re():
+    import re
+    return re.compile(
+        r'^(\d\d):(\d\d):(\d\d)(?:\.(\d+))?(Z|([+-])(\d\d):(\d\d))?$')
+_xsd_time = _xsd_time_re()
+
+def _xsd_datetime(lexical):
+    import datetime
+    date, _, time = lexical.strip().partition('T')
+    year, month, day = _xsd_date_parts(date)
+    hour, minute, second, micro, tz = _xsd_time_parts(time)
+    if hour == 24:
+        # 24:00:00 is midnight at the end of the day.
+        return datetime.datetime(year, month, day, 0, minute, second,
+            micro, tz) + datetime.timedelta(days=1)
+    return datetime.datetime(year, month, day, hour, minute, second, micro, tz)
+
+def _xsd_date_parts(lexical):
+    parts = lexical.split('-')
+    if len(parts) != 3:
+        raise ValueError("Bad xsd:date", lexical)
+    return tuple(map(int, parts))
+
+def _xsd_date(lexical):
+    import datetime
+    return datetime.date(*_xsd_date_parts(lexical.strip()))
+
+def _xsd_time_value(lexical):
+    import datetime
+    hour, minute, second, micro, tz = _xsd_time_parts(lexical.strip())
+    return datetime.time(hour, minute, second, micro, tz)
+
+def _xsd_text(lexical):
+    return lexical
+
+def _xsd_format_boolean(value):
+    return value and u'true' or u'false'
+
+def _xsd_format_float(value):
+    if value != value:
+        return u'NaN'
+    if value in (float('inf'), float('-inf')):
+        return value > 0 and u'INF' or u'-INF'
+    return unicode(repr(value))
+
+def _xsd_format_decimal(value):
+    return unicode(value)
+
+def _xsd_format_temporal(value):
+    text = value.isoformat()
+    if text.endswith('+00:00'):
+        text = text[:-6] + 'Z'
+    return unicode(text)
+
+def _literal_datatypes():
+    """Build the tables that map XSD datatypes to and from Python values.
+
+    decimal is slow to import, so Decimal is added by _literal_decimal
+    when one is first seen.
+    """
+    import datetime
+    parsers = {
+        XSD+'boolean': _xsd_boolean,
+        XSD+'double': _xsd_float,
+        XSD+'float': _xsd_float,
+        XSD+'decimal': _xsd_decimal,
+        XSD+'dateTime': _xsd_datetime,
+        XSD+'dateTimeStamp': _xsd_datetime,
+        XSD+'date': _xsd_date,
+        XSD+'time': _xsd_time_value,
+        RDF_LANG_STRING: _xsd_text,
+    }
+    for name in [
+        'integer', 'int', 'long', 'short', 'byte',
+        'nonNegativeInteger', 'positiveInteger',
+        'nonPositiveInteger', 'negativeInteger',
+        'unsignedLong', 'unsignedInt', 'unsignedShort', 'unsignedByte',
+    ]:
+        parsers[XSD+name] = int
+    for name in [
+        'string', 'normalizedString', 'token', 'language', 'Name',
+        'NCName', 'NMTOKEN', 'anyURI',
+    ]:
+        parsers[XSD+name] = _xsd_text
+    # The datatype a Python value gets when it has none of its own.
+    # Keyed by exact type: bool is an int, and datetime is a date.
+    datatypes = {
+        bool: XSD+'boolean',
+        int: XSD+'integer',
+        long: XSD+'integer',
+        float: XSD+'double',
+        datetime.datetime: XSD+'dateTime',
+        datetime.date: XSD+'date',
+        datetime.time: XSD+'time',
+    }
+    formatters = {
+        bool: _xsd_format_boolean,
+        int: unicode,
+        long: unicode,
+        float: _xsd_format_float,
+        datetime.datetime: _xsd_format_temporal,
+        datetime.date: _xsd_format_temporal,
+        datetime.time: _xsd_format_temporal,
+    }
+    return parsers, datatypes, formatters
+literal_parsers, literal_datatypes, literal_formatters = _literal_datatypes()
+
+def _literal_decimal():
+    import decimal
+    literal_datatypes[decimal.Decimal] = XSD+'decimal'
+    literal_formatters[decimal.Decimal] = _xsd_format_decimal
+
+def literal_value(lexical, datatype=None):
+    """The Python value for a literal's lexical form and datatype.
+
+    Datatypes with no conversion, and lexical forms that don't parse,
+    keep the text.
+    """
+    parse = literal_parsers.get(datatype, None)
+    if parse is None:
+        return lexical
+    try:
+        return parse(lexical)
+    except ValueError:
+        return lexical
+
+def literal_lexical(value, datatype=None):
+    "The lexical form and datatype to write a literal's Python value as."
+    kind = type(value)
+    format = literal_formatters.get(kind, None)
+    if format is None and kind.__module__ == 'decimal':
+        _literal_decimal()
+        format = literal_formatters.get(kind, None)
+    if format is None:
+        return unicode(value), datatype
+    return format(value), datatype or literal_datatypes[kind]
+
+def literal_datatype(value):
+    "The XSD datatype a Python value is written as, or None for text."
+    kind = type(value)
+    if kind.__module__ == 'decimal' and kind not in literal_datatypes:
+        _literal_decimal()
+    return literal_datatypes.get(kind, None)
+
+def parse_ntriples(lines, quads=False, blank_scope=None):
+    """Parse N-Triples (or N-Quads) lines into triples of Nodes.
+
+    Blank node labels are scoped to one call, so two documents that both
+    use _:b0 don't end up sharing a node. Pass a `blank_scope` prefix
+    (perhaps '') to choose the scope instead.
+    """
+    match = _ntriples_line.match
+    unescape = _ntriples_unescape
+    parsers = literal_parsers
+    if blank_scope is None:
+        blank_scope = 'n%d-' % next(_ntriples_documents)
+    for lineno, line in enumerate(lines):
+        if not isinstance(line, unicode):
+            line = line.decode('utf-8')
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        m = match(line)
+        if m is None or (not quads and (m.group(9) or m.group(10))):
+            raise ValueError("Bad N-Triples line", lineno + 1, line)
+        g = m.groups()
+        if g[0] is not None:
+            sub = URINode(unescape(g[0]))
+        else:
+            sub = Blank(blank_scope + g[1])
+        pred = URINode(unescape(g[2]))
+        if g[3] is not None:
+            ob = URINode(unescape(g[3]))
+        elif g[4] is not None:
+            ob = Blank(blank_scope + g[4])
+        else:
+            value = unescape(g[5])
+            datatype = g[7]
+            if datatype in parsers:
+                value = literal_value(value, datatype)
+            ob = Literal(value, datatype=datatype, lang=g[6])
+        yield sub, pred, ob
+
+def _counter():
+    import itertools
+    return itertools.count()
+_ntriples_documents = _counter()
+
+
+#
+# The binary cache format.
+#
+
+BINARY_MAGIC = 'GRB1'
+BINARY_URI = 0
+BINARY_BLANK = 1
+BINARY_LITERAL = 2
+# Literal values marshal can store as they are.
+_binary_values = (int, long, float, bool, str, unicode)
+
+def is_binary(data):
+    return data.startswith(BINARY_MAGIC)
+
+def binary_term(node):
+    "Encode a Node as a tuple marshal can store."
+    if node.is_uri:
+        return (BINARY_URI, unicode(node.value()))
+    elif node.is_blank:
+        return (BINARY_BLANK, unicode(node.datum))
+    value = node.value()
+    datatype = node.datatype
+    # marshal needs the exact types, not subclasses.
+    if type(value) not in _binary_values:
+        value, datatype = literal_lexical(value, datatype)
+    # Parsers give unicode and the XSD tables str; marshal tells them
+    # apart, and DiskGraph finds stored terms by their bytes.
+    if datatype is not None:
+        datatype = unicode(datatype)
+    if node.lang:
+        return (BINARY_LITERAL, value, datatype, unicode(node.lang))
+    return (BINARY_LITERAL, value, datatype)
+
+def binary_node(term):
+    "Decode a tuple from binary_term back into a Node."
+    if term[0] == BINARY_URI:
+        return URINode(term[1])
+    elif term[0] == BINARY_BLANK:
+        return Blank(term[1])
+    value, datatype = term[1], term[2]
+    if isinstance(value, unicode) and datatype in literal_parsers:
+        value = literal_value(value, datatype)
+    return Literal(value, datatype=datatype, lang=term[3:] and term[3] or None)
+
+def dump_binary(triples, namespaces=None):
+    """Encode Node triples as a term table plus an array of term numbers.
+
+    load_binary turns the result back into triples without an RDF parser.
+    """
+    import array
+    import marshal
+    numbers = {}
+    terms = []
+    refs = array.array('i')
+    for triple in triples:
+        for node in triple:
+            key = node.id
+            if key is None:
+                key = ('unhashable', id(node))
+            n = numbers.get(key, None)
+            if n is None:
+                n = numbers[key] = len(terms)
+                terms.append(binary_term(node))
+            refs.append(n)
+    return BINARY_MAGIC + marshal.dumps((
+        terms,
+        refs.itemsize,
+        refs.tostring(),
+        dict(namespaces or {}),
+    ))
+
+def load_binary(data):
+    "Decode dump_binary's output to a list of Node triples and a namespace dict."
+    import array
+    import marshal
+    if not is_binary(data):
+        raise ValueError("Not a binary triple dump")
+    terms, itemsize, ref_data, namespaces = marshal.loads(data[len(BINARY_MAGIC):])
+    refs = array.array('i')
+    if refs.itemsize != itemsize:
+        raise ValueError("Binary triple dump from an incompatible platform")
+    refs.fromstring(ref_data)
+    nodes = map(binary_node, terms)
+    triples = []
+    for i in xrange(0, len(refs), 3):
+        triples.append((nodes[refs[i]], nodes[refs[i+1]], nodes[refs[i+2]]))
+    return triples, namespaces
+
+
 #
 # The SPARQL/Endpoint/Dataset bit
 #
@@ -995,219 +2428,64 @@ class SparqlList(Reiterable):
             total += dct[var]
         return total
 
-class Endpoint(object):
-    def __init__(self, uri, dataset):
-        self.uri = uri
-        assert getattr(dataset, 'is_dataset', False), dataset
-        self.dataset = dataset
-        self.graph = dataset.create_graph()
-        self.engine = self.create_engine()
-
-    def create_engine(self):
-        return Jena()
-
-    def select(self, query):
-        "Make a SPARQL SELECT and traverse the results"
-        return SparqlList(self.graph._parse_sparql_result(
-            self.engine.load_sparql(self.uri, query)
-        ))
-
-    def construct(self, graph, query):
-        "Load data into memory from a SPARQL CONSTRUCT"
-        graph.engine.import_sparql(self.uri, query)
-        return self
-
+class Engine(object):
+    """Defines an interface for an RDF triple store and query engine.
+    """
+    def sparql(self, query_text):
+        raise NotImplementedError("SPARQL querying not supported by this engine")
 
-class Dataset(object):
-    """Extends Graph with a set of SPARQL endpoints and hooks that load
-    data from these endpoints as you query through the Graph interface.
-
-    The intent is to facilitate gathering exactly the data you want from
-    anywhere it happens to be and make it easy to interrogate as possible.
-
-    And I shall call this module... Magic Spaqrls!"""
-    is_dataset = True
-    stats_class = SparqlStats
-    graph_class = Graph
-
-    def __init__(self, endpoint=None, uri=None, namespaces=None):
-        self.endpoints = {}
-        self.endpoint_stats = {}
-        self.graphs = []
-        self._triple_query_cache = {}
-        self.namespaces = namespaces or {}
-        if endpoint:
-            self.add_endpoints(endpoint)
-        # The data cache is a sort of default graph.
-        self.data_cache = self.create_graph(uri=uri, namespaces=namespaces)
-
-    def get(self, *t, **k):
-        return self.data_cache.get(*t, **k)
-    resource = get
-    __getitem__ = get
+    def triples(self, subject, predicate, object, limit=None, offset=0):
+        """Select triples from the store, as an iterable of Node triples.
 
-    def endpoint(self, uri):
-        if uri in self.endpoints:
-            return self.endpoints[uri]
-        return Endpoint(uri, self)
+        Skips the first `offset` matches and stops after `limit` of them.
+        Results may be produced lazily. The native and rdflib engines let
+        the store change during iteration, though whether the changes show
+        up in the results isn't defined. Jena's iterators refuse it.
+        """
+        raise NotImplementedError("Select triples from the store")
 
-    @takes_list
-    def add_endpoint(self, endpoints):
-        for resource in endpoints:
-            uri = resource.uri()
-            self.endpoints[uri] = Endpoint(uri, self)
-            self.endpoint_stats[uri] = self.stats_class(uri, self)
-        return self
-    add_endpoints = add_endpoint
-
-    def add_graph(self, graph):
-        self.graphs.append(graph)
-
-    def create_graph(self, *t, **k):
-        if 'namespaces' not in k:
-            k['namespaces'] = self.namespaces
-        g = self.graph_class(*t, **k)
-        self.add_graph(g)
-        return g
-
-    def _in_cache(self, endpoint, triple):
-        "Do a wild-card safe test for caching"
-        tests = []
-        cache = self._triple_query_cache.get(endpoint, None)
-        if not cache:
-            return False
-        x, y, z = triple
-        xs = [None]
-        ys = [None]
-        zs = [None]
-        if x is not None: xs.append(x)
-        if y is not None: ys.append(y)
-        if z is not None: zs.append(z)
-        for x in xs:
-            for y in ys:
-                for z in zs:
-                    t = (x, y, z)
-                    if t in cache:
-                        return True
+    def has_triple(self, subject, predicate, object):
+        "Returns True if triples() would return anything for this pattern"
+        for t in self.triples(subject, predicate, object):
+            return True
         return False
 
-    def select_endpoints(self, *t):
-        if NoAutoQuery.active():
-            return []
-        all_endpoints = self.endpoints.keys()
-        endpoints = []
-        if len(t) == 0:
-            raise RuntimeError("select for what?")
-        elif len(t) == 3:
-            for ep, stats in self.endpoint_stats.items():
-                if not self._in_cache(ep, t):
-                    if stats.use_for_triple(t):
-                        endpoints.append(ep)
-        else:
-            for ep, stats in self.endpoint_stats.items():
-                if stats.use_for_query(t[0]):
-                    endpoints.append(ep)
-        return endpoints
-
-    def _make_query(self, text):
-        query = ""
-        for prefix, uri in self.prefixes().items():
-            query += "PREFIX " + prefix + ": <" + uri + ">\n"
-        query += text
-        return query
-
-    def _make_query_value(self, v, uri=False):
-        if uri or getattr(v, 'is_uri', False) or getattr(v, 'isURIResource', False):
-            return "<"+unicode(v)+">"
-        else:
-            return '"'+unicode(v)+'"'
-
-    def triples(self, x, y, z):
-        x = self._parse_subject(x)
-        y = self._parse_property(y)
-        z = self._parse_object(z)
-        endpoints = list(self.select_endpoints(x, y, z))
-        if endpoints:
-            if x:
-                qx = self._make_query_value(x, uri=True)
-            else:
-                qx = '?x'
-            if y:
-                qy = self._make_query_value(y, uri=True)
-            else:
-                qy = '?y'
-            if z:
-                qz = self._make_query_value(z)
-            else:
-                qz = '?z'
-            query = self._make_query("""
-                CONSTRUCT { %(x)s %(y)s %(z)s }
-                WHERE     { %(x)s %(y)s %(z)s }
-                """ % {
-                'x': qx,
-                'y': qy,
-                'z': qz,
-            })
-            for uri in endpoints:
-                if Config.sparql_debug:
-                    print("Auto-query: {0}".format(uri))
-                    print(query)
-                self._triple_query_cache.setdefault(uri, {})[(x, y, z)] = True
-                self.endpoint(uri).construct(self.data_cache, query)
-        #
-        # TODO: Aggregate results from all graphs here.
-        #
-        import itertools
-        iters = []
-        for g in self.graphs:
-            iters.append(g.triples(x, y, z))
-        return ResourceList(itertools.chain(iters))
-        #
-
-    def sparql(self, query, *t, **k):
-        # TODO: Detect grouping and handle count aggregation differently
-        iter = self._sparql(query, *t, **k)
-        return SparqlList(iter)
-    def _sparql(self, query):
-        for g in self.graphs:
-            for x in g.sparql(query):
-                yield x
-        for uri in self.select_endpoints(query):
-            for x in self.endpoint(uri).select(query):
-                yield x
-
-    def _load_all_sparql(self, query):
-        for uri in self.select_endpoints(query):
-            raise NotImplementedError("Implement Endpoint class for 'read_sparql'")
-            for x in self.endpoint(uri).select(query):
-                yield x
+    def count_triples(self, subject, predicate, object):
+        "Count the triples matching a pattern"
+        total = 0
+        for t in self.triples(subject, predicate, object):
+            total += 1
+        return total
 
-    # SPARQL query methods
-    def describe(self, query):
-        self._load_all_sparql("describe "+query)
-        return self
-    def construct(self, query):
-        self._load_all_sparql("construct "+query)
-        return self
+    def set_triple(self, subject, predicate, object):
+        raise NotImplementedError("Add a triple to the store")
 
-    def to_string(self, *t, **k):
-        # TODO: Dump all local graphs and the local caches of all Endpoints.
-        return self.data_cache.to_string(*t, **k)
+    def scratch_engine(self):
+        "An empty in-memory engine of this kind, for parsing into."
+        return self.__class__()
 
+    def import_sparql(self, endpoint, query):
+        "Load the triples from a SPARQL CONSTRUCT or DESCRIBE at an endpoint."
+        text, format = sparql_construct(endpoint, query)
+        self.load_text(text, format)
 
-#
-# The JPype/Jena bit.
-#
+    def add_triples(self, triples):
+        "Add a batch of (subject, predicate, object) Node triples"
+        for x, y, z in triples:
+            self.set_triple(x, y, z)
 
+    def remove_triples(self, subject, predicate, object):
+        raise NotImplementedError("Remove triples matching a pattern")
 
-class Engine(object):
-    """Defines an interface for an RDF triple store and query engine.
-    """
-    def sparql(self, query_text):
-        raise NotImplementedError("SPARQL querying not supported by this engine")
+    def remove_patterns(self, patterns):
+        "Remove the triples matching a batch of patterns"
+        for x, y, z in patterns:
+            self.remove_triples(x, y, z)
 
-    def triples(self, subject, predicate, object):
-        raise NotImplementedError("Select triples from the store")
+    def replace_triples(self, subject, predicate, objects):
+        "Set the objects of a subject and predicate to exactly `objects`"
+        self.remove_triples(subject, predicate, None)
+        self.add_triples([(subject, predicate, z) for z in objects])
 
     def load_uri(self, uri, format=TURTLE):
         raise NotImplementedError("Load RDF from a URI into the store")
@@ -1227,98 +2505,143 @@ class Engine(object):
     def add_namespace(self, prefix, uri):
         raise NotImplementedError("Register a namespace and it's prefix")
 
-import warnings
-warnings.filterwarnings("ignore", message="the sets module is deprecated")
-
-try:
-    import jpype
-    del jpype
-except ImportError:
-    raise RuntimeError("Install JPype: http://sourceforge.net/projects/jpype/")
-
-from jpype import startJVM, shutdownJVM, ByteArrayCustomizer, \
-  CharArrayCustomizer, ConversionConfig, ConversionConfigClass, JArray, \
-  JBoolean, JByte, JChar, JClass, JClassUtil, JDouble, JException, \
-  JFloat, JInt, JIterator, JLong, JObject, JPackage, JProxy, JString, \
-  JavaException, java
-_jvm_running = False
-def runJVM():
-    global _jvm_running
-    if _jvm_running:
-        return
-    jvm_args = [
-        # Be a bit more reasonable with Java memory
-        '-XX:MaxHeapFreeRatio=30',
-        '-XX:MinHeapFreeRatio=10',
-    ]
-    import os
-
-    if os.name == 'nt':
-        cp_sep = ';'
-    else:
-        cp_sep = ':'
-
-    java_classpath = [
-        Config.jena_libs+'jena-2.6.4.jar',
-        Config.jena_libs+'log4j-1.2.13.jar',
-        Config.jena_libs+'arq-2.8.8.jar',
-        Config.jena_libs+'slf4j-api-1.5.8.jar',
-        Config.jena_libs+'slf4j-log4j12-1.5.8.jar',
-        Config.jena_libs+'xercesImpl-2.7.1.jar',
-        Config.jena_libs+'iri-0.8.jar',
-        Config.jena_libs+'icu4j-3.4.4.jar',
-        Config.jena_libs+'stax-api-1.0.1.jar',
-    ]
-    jvm_file = Config.jvm_file
-    if not jvm_file:
-        import jpype
-        jvm_file = jpype.getDefaultJVMPath()
-        if not jvm_file:
-            home = os.environ.get('JAVA_HOME', '')
-            if os.name == 'nt':
-                jvm_file = os.path.join(home, 'bin','client','jvm.dll')
-            else:
-                jvm_file = os.path.join(home, 'jre', 'lib', 'amd64', 'server', 'libjvm.so')
+    def namespaces(self):
+        raise NotImplementedError("Map registered prefixes to their namespaces")
 
-    if java_classpath:
-        jvm_args.append("-Djava.class.path=" + cp_sep.join(
-            map(os.path.abspath, java_classpath))
-        )
+class TermDictionary(object):
+    """Maps each distinct RDF term to a small integer ID.
+
+    Nodes are flyweights: constructing a Node for a term that is already
+    alive returns the existing instance, so repeated URIs share one object
+    and one ID. Entries are weak, so terms nothing refers to are dropped.
+    IDs are never reused. Nodes may be made on any thread.
+    """
+    def __init__(self):
+        import threading
+        import weakref
+        self.by_key = weakref.WeakValueDictionary()
+        self.next_id = 0
+        self.lock = threading.Lock()
+
+    def lookup(self, key):
+        return self.by_key.get(key, None)
+
+    def intern(self, key, make):
+        """The live Node for a key, or a new one from `make(id)`.
+
+        Making and registering happen under the lock, so two threads
+        can't make two Nodes for one term or hand out one ID twice.
+        """
+        node = self.by_key.get(key, None)
+        if node is not None:
+            return node
+        with self.lock:
+            node = self.by_key.get(key, None)
+            if node is None:
+                node = make(self.next_id)
+                self.next_id += 1
+                self.by_key[key] = node
+        return node
 
+    def __len__(self):
+        return len(self.by_key)
 
-    startJVM(jvm_file, *jvm_args)
-    _jvm_running = True
+terms = TermDictionary()
 
 class Node(object):
     "Represents a graph node to the engine"
+    __slots__ = ('datum', 'id', '__weakref__')
     is_node = True
     is_blank = False
     is_uri = False
     is_literal = False
+    # True when two distinct IDs always mean two unequal terms.
+    ids_are_values = True
+
+    def __new__(cls, datum, **k):
+        try:
+            key = cls.term_key(datum, **k)
+            node = terms.lookup(key)
+        except TypeError:
+            # Unhashable data can't be shared.
+            return cls._make(datum, None, k)
+        if node is not None:
+            return node
+        return terms.intern(key, lambda tid: cls._make(datum, tid, k))
+    @classmethod
+    def _make(cls, datum, tid, k):
+        node = object.__new__(cls)
+        node.datum = datum
+        node.init(**k)
+        assert node.check(), datum
+        node.id = tid
+        return node
     def __init__(self, datum, **k):
-        self.datum = datum
-        self.init(**k)
-        assert self.check(), datum
+        # All the work happens in __new__, which may return a shared Node.
+        pass
     def init(self):
         pass
 
+    @classmethod
+    def term_key(cls, datum):
+        return (cls, datum)
+
     def __str__(self):
         return unicode(self.datum)
     def __repr__(self):
         return self.__class__.__name__+'('+repr(self.datum)+')'
 
     def __eq__(self, other):
+        if self is other:
+            return True
         if getattr(other, 'is_node', False):
             if self.__class__ is not other.__class__:
                 return False
+            if self.ids_are_values and self.id is not None \
+              and other.id is not None:
+                return False
             other = other.datum
         return self.datum == other
 
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        # Hash the value, so Nodes and the plain values they compare equal
+        # to land in the same dict slot.
+        try:
+            return hash(self.datum)
+        except TypeError:
+            return object.__hash__(self)
+
+    # Order as SPARQL does: blank nodes, then URIs, then literals.
+    sort_rank = 0
+    def sort_key(self):
+        return (self.sort_rank, self.datum)
+    def _other_key(self, other):
+        if getattr(other, 'is_node', False):
+            return self.sort_key(), other.sort_key()
+        return self.datum, other
+    def __lt__(self, other):
+        a, b = self._other_key(other)
+        return a < b
+    def __le__(self, other):
+        a, b = self._other_key(other)
+        return a <= b
+    def __gt__(self, other):
+        a, b = self._other_key(other)
+        return a > b
+    def __ge__(self, other):
+        a, b = self._other_key(other)
+        return a >= b
+
     def check(self):
         return True
 
 class URINode(Node):
+    __slots__ = ()
     is_uri = True
+    sort_rank = 1
     def value(self):
         if isinstance(self.datum, unicode):
             return self.datum
@@ -1330,418 +2653,99 @@ class URINode(Node):
         assert (type(uri) in (str, unicode)), (uri, type(uri))
         return True
 class Literal(Node):
+    __slots__ = ('datatype', 'lang')
     is_literal = True
+    sort_rank = 2
+    # Literals of different types or datatypes may still compare equal.
+    ids_are_values = False
+
+    def __new__(cls, datum, datatype=None, lang=None):
+        # A value from Python and the same value parsed from RDF must be
+        # one term, or engines that match by term ID won't find it.
+        if isinstance(datum, str):
+            try:
+                datum = datum.decode('utf-8')
+            except UnicodeDecodeError:
+                pass
+        elif type(datum) is long and -sys.maxint - 1 <= datum <= sys.maxint:
+            datum = int(datum)
+        if datatype is None and lang is None:
+            datatype = literal_datatype(datum)
+        return Node.__new__(cls, datum, datatype=datatype, lang=lang)
+
+    @classmethod
+    def term_key(cls, datum, datatype=None, lang=None):
+        return (cls, type(datum), datum, datatype, lang)
+
     def value(self):
         return self.datum
-    def init(self, datatype=None):
+    def init(self, datatype=None, lang=None):
         self.datatype = datatype
+        self.lang = lang
 class Blank(Node):
+    __slots__ = ()
     is_blank = True
-    def value(self):
-        return None
-
-class Jena(object):
-    def __init__(self, debug=False):
-        if debug:
-            if callable(debug):
-                self.debug = debug
-            else:
-                def debug(x):
-                    print(x)
-                self.debug = debug
-        runJVM()
-
-    def debug(self, msg): pass
-
-    def _parse_literal(self, lit):
-        if isinstance(lit, JClass("com.hp.hpl.jena.rdf.model.Literal")):
-            lit = lit.getValue()
-        if isinstance(lit, java.lang.Integer):
-            return Literal(lit.intValue())
-        elif isinstance(lit, java.lang.String):
-            return Literal(lit.toString())
-        elif isinstance(lit, java.lang.Float):
-            return Literal(lit.floatValue())
-        elif isinstance(lit, java.lang.Boolean):
-            return Literal(lit.boolValue())
-        # TODO: Add conversions for *all* RDF datatypes
-        return Literal(lit)
-
-    def _parse_resource(self, res):
-        if res.isAnon():
-            return Blank(res.getId())
-        elif res.isLiteral():
-            return self._parse_literal(res.asLiteral())
-        elif res.isURIResource():
-            return URINode(res.getURI())
-
-    def _iter_sparql_results(self, qexec):
-        try:
-            jresults = qexec.execSelect() # ResultsSet
-            while jresults.hasNext():
-                result = {}
-                soln = jresults.nextSolution() # QuerySolution
-                for name in soln.varNames():
-                    try:
-                        v = soln.getResource(name)   # Resource // Get a result variable - must be a resource
-                        if v:
-                            v = URINode(v.getURI())
-                    except:
-                        v = soln.getLiteral(name)    # Literal  // Get a result variable - must be a literal
-                        v = self._parse_literal(v)
-                    result[name] = v
-                yield result
-        finally:
-            qexec.close()
-
-    def load_sparql(self, endpoint, query):
-        q_pkg = JPackage("com.hp.hpl.jena.query")
-        qexec = q_pkg.QueryExecutionFactory.sparqlService(JString(endpoint), JString(query))
-        return self._iter_sparql_results(qexec)
-
-
-class JenaGraph(Engine, Jena):
-    _jena_pkg_name = 'com.hp.hpl.jena'
-
-    def __init__(self, **k):
-        super(JenaGraph, self).__init__(**k)
-        self.jena_model = None
-        self.get_model()
-
-    def get_model(self):
-        if not self.jena_model:
-            klass = JClass(self._jena_pkg_name+'.rdf.model.ModelFactory')
-            self.jena_model = klass.createDefaultModel()
-        return self.jena_model
-
-    def _new_submodel(self):
-        model = JClass('com.hp.hpl.jena.rdf.model.ModelFactory').createDefaultModel()
-        model = model.setNsPrefixes(self.jena_model.getNsPrefixMap())
-        return model
-
-    def add_inference(self, type):
-        if type == 'schema':
-            model = JClass(self._jena_pkg_name+'.rdf.model.ModelFactory') \
-              .createRDFSModel(self.get_model())
-            self.jena_model = model
-        else:
-            raise RuntimeError("Unknown inference type", type)
-
-    def expand_uri(self, uri):
-        return str(self.get_model().expandPrefix(JString(uri)))
-
-    def shrink_uri(self, uri):
-        return str(self.get_model().shortForm(JString(uri)))
-
-    def _mk_resource(self, res):
-        "Make this Subject thing suitable to pass to Jena"
-        if res is None:
-            return JObject(None,
-                JPackage(self._jena_pkg_name).rdf.model.Resource,
-            )
-        assert getattr(res, 'is_node', False), (res, type(res))
-#        assert res.is_uri, res # XXX: TODO: This breaks with blank nodes, and shouldn't
-        uri = res.datum
-        assert isinstance(uri, (unicode, str)), (uri, type(uri))
-        return JObject(
-            self.get_model().createResource(JString(uri)),
-            JPackage(self._jena_pkg_name).rdf.model.Resource,
-        )
-
-    def _mk_property(self, uri):
-        "Make this Property thing suitable to pass to Jena"
-        if uri is None:
-            return JObject(None,
-                JPackage(self._jena_pkg_name).rdf.model.Property,
-            )
-        assert getattr(uri, 'is_node', False), uri
-        assert uri.is_uri, uri
-        uri = uri.datum
-        assert isinstance(uri, (unicode, str)), (uri, type(uri))
-        return JObject(
-            self.get_model().createProperty(JString(uri)),
-            JPackage(self._jena_pkg_name).rdf.model.Property,
-        )
-
-    def _mk_object(self, obj):
-        "Make this Object thing suitable to pass to Jena"
-        if obj is None:
-            return JObject(
-                None,
-                JPackage(self._jena_pkg_name).rdf.model.RDFNode,
-            )
-        assert getattr(obj, 'is_node', False), res
-        if obj.is_uri:
-            return JObject(
-                self.get_model().createResource(obj.datum),
-                JPackage(self._jena_pkg_name).rdf.model.RDFNode,
-            )
-        elif obj.is_blank:
-            return obj.datum
-        else:
-            value = obj.value()
-            if isinstance(value, (str, unicode)):
-                value = JString(value)
-            return JObject(
-                self.get_model().createTypedLiteral(value),
-                JPackage(self._jena_pkg_name).rdf.model.RDFNode,
-            )
 
-    def as_node(self, obj):
-        return JObject(
-            self.get_model().createResource(obj.uri),
-            JPackage(self._jena_pkg_name).rdf.model.RDFNode,
-        )
-
-    def get_jena_format(self, format):
-        if isinstance(format, str):
-            return format
-        if format == TURTLE:
-            format = "TTL"
-        elif format == N3:
-            format = "N3"
-        elif format == NTRIPLE:
-            format = "N-TRIPLE"
-        elif format == RDFXML or format is None:
-            format = "RDF/XML"
-        else:
-            raise RuntimeError("bad format", format)
-        return format
-
-    def load_uri(self, uri, format=None, allow_error=False):
-        self.debug("JENA load "+uri)
-        format = self.get_jena_format(format)
-        jena = self.get_model()
-        try:
-            jena = jena.read(uri, format)
-        except:
-            if not allow_error: raise
-        else:
-            self.jena_model = jena
-
-    def load_text(self, text, format=TURTLE, encoding='utf-8'):
-        format = self.get_jena_format(format)
-        self.debug("JENA load text "+format)
-        jena = self.get_model()
-        uri = "tag:string-input"
-        if not isinstance(text, unicode):
-            text = unicode(text, encoding)
-        jstr = JString(text)
-        input = JClass('java.io.StringReader')(jstr)
-        jena = jena.read(input, uri, format)
-        self.jena_model = jena
+    @classmethod
+    def term_key(cls, datum):
+        # Java blank node IDs are distinct objects for the same label.
+        return (cls, unicode(datum))
 
-    def import_sparql(self, endpoint, query):
-        q_pkg = JPackage("com.hp.hpl.jena.query")
-        qexec = q_pkg.QueryExecutionFactory.sparqlService(JString(endpoint), JString(query))
-        qexec.execConstruct(self.jena_model)
-
-    def has_triple(self, x, y, z):
-        self.debug(' '.join(["JENA has_triple ", repr(x), repr(y), repr(z)]))
-        jena = self.get_model()
-        sub = self._mk_resource(x)
-        pred = self._mk_property(y)
-        ob = self._mk_object(z)
-        return bool(jena.contains(sub, pred, ob))
+    def __hash__(self):
+        return hash(unicode(self.datum))
 
-    def set_triple(self, x, y, z):
-        self.debug(' '.join(["JENA add_triple ", repr(x), repr(y), repr(z)]))
-        jena = self.get_model()
-        sub = self._mk_resource(x)
-        pred = self._mk_property(y)
-        ob = self._mk_object(z)
-        stmt = jena.createStatement(
-            sub,
-            pred,
-            ob,
-        )
-        jena.add(stmt)
+    def value(self):
+        return None
 
-    def remove_triples(self, x, y, z):
-        self.debug(' '.join(["JENA remove_triples ", repr(x), repr(y), repr(z)]))
-        jena = self.get_model()
-        sub = self._mk_resource(x)
-        pred = self._mk_property(y)
-        ob = self._mk_object(z)
-        jena.removeAll(sub, pred, ob)
-
-    def triples(self, x, y, z):
-        self.debug(' '.join(["JENA triples ", repr(x), repr(y), repr(z)]))
-        jena = self.get_model()
-        sub = self._mk_resource(x)
-        pred = self._mk_property(y)
-        ob = self._mk_object(z)
-
-        for stmt in jena.listStatements(
-            sub,
-            pred,
-            ob,
-        ):
-            a = self._parse_resource(stmt.getSubject())
-            assert a, (a, stmt)
-            b = self._parse_resource(stmt.getPredicate())
-            assert b, (b, stmt)
-            c = self._parse_resource(stmt.getObject())
-            assert c, (c, stmt)
-            yield a, b, c
-
-    def _dump_model(self, model, format="TTL"):
-        out = JPackage('java').io.StringWriter()
-        model.write(out, format)
-        return unicode.encode(out.toString(), 'utf-8')
-
-    def dump_resources(self, resources, format="TTL", extended=False):
-        model = self._new_submodel()
-        for res in resources:
-            res = res.datum
-            model.add(self.get_model().listStatements(
-                self._mk_resource(res),
-                self._mk_property(None),
-                self._mk_object(None),
-            ))
-            if extended:
-                model.add(self.get_model().listStatements(
-                    self._mk_resource(None),
-                    self._mk_property(None),
-                    self._mk_object(res),
-                ))
-        return self._dump_model(model)
-
-    def to_string(self, format="TTL"):
-        return self._dump_model(self.get_model(), self.get_jena_format(format))
-
-    def dump(self, *t, **k):
-        return self.to_string(*t, **k)
 
-    def add_namespace(self, prefix, uri):
-        self.get_model().setNsPrefix(prefix, uri)
+#
+# The rest of the API lives in modules that load on first use, which keeps
+# `import graphite` cheap. Their names are still found here.
+#
 
-    def namespaces(self):
-        ns_dict = {}
-        for prefix in self.get_model().getNsPrefixMap().entrySet():
-            ns_dict[str(prefix.getKey())] = URINode(prefix.getValue(), self)
-        return ns_dict
+_lazy_modules = {
+    'jenagraph': [
+        'jpype_module', 'jena_classpath', 'jvm_options', 'runJVM',
+        'JenaBridge', 'Jena', 'JenaGraph',
+    ],
+    'rdflibgraph': ['Rdflib', 'RdflibGraph'],
+    'nativegraph': ['NativeGraph', 'DiskGraph'],
+    'federation': [
+        'BatchContext', 'SparqlStats', 'PatternCache', 'Endpoint', 'Dataset',
+    ],
+}
 
-    def sparql(self, query_text): # JenaGraph
-        q_pkg = JPackage("com.hp.hpl.jena.query")
-        model = self.get_model()
-        query = q_pkg.QueryFactory.create(query_text)
-        qexec = q_pkg.QueryExecutionFactory.create(query, model)
-        return self._iter_sparql_results(qexec)
+def lazy_name(name):
+    "Import a name from the module that has it, and keep it here."
+    for module, names in _lazy_modules.items():
+        if name in names:
+            value = getattr(__import__(module, globals(), {}, [name]), name)
+            globals()[name] = value
+            return value
+    raise AttributeError(name)
 
+class LazyModule(types.ModuleType):
+    """Stands in for a module in sys.modules, finding missing names lazily.
 
-class RdflibGraph(Engine, Jena):
-    """Defines a mechanism for accessing a triple store in rdflib.
+    `resolve` is called with any name the module doesn't have; it returns
+    the value or raises AttributeError. `names` are the ones it can find.
     """
-    def __init__(self, **k):
-        super(RdflibGraph, self).__init__(**k)
-        import rdflib
-        import rdfextras
-        self.graph = rdflib.Graph()
-
-    def sparql(self, query_text):
-        qres = self.graph.query(query_text)
-        qvars = qres.vars
-        #raise RuntimeError(qres.bindings, query_text)
-        for soln in qres.bindings:
-            d = {}
-            for v in qvars:
-                try:
-                    value = soln[v]
-                except KeyError:
-                    continue
-                parsed_value = self._convert_rdflib_value(value)
-                d[v.toPython()[1:]] = parsed_value
-            #raise RuntimeError(d, soln)
-            yield d
-        #raise NotImplementedError, "SPARQL querying not supported by this engine"
-
-    def _convert_data_value(self, val):
-        if val is None: return None
-        import rdflib
-        if isinstance(val, URINode):
-            return rdflib.URIRef(val.value())
-        if isinstance(val, Literal):
-            return rdflib.Literal(val.value())
-        raise ValueError(val)
-
-    def _convert_rdflib_value(self, val):
-        if val is None:
-            raise ValueError(val)
-        import rdflib
-        if isinstance(val, rdflib.URIRef):
-            return URINode(val.toPython())
-        if isinstance(val, rdflib.BNode):
-            return Blank(str(val))
-        if isinstance(val, rdflib.Literal):
-            datatype = val.datatype
-            if datatype is not None:
-                datatype = datatype.toPython()
-            return Literal(val.toPython(), datatype=datatype)
-        raise ValueError(val)
-
-    def set_triple(self, subject, predicate, object):
-        self.graph.add((
-            self._convert_data_value(subject),
-            self._convert_data_value(predicate),
-            self._convert_data_value(object),
-        ))
-
-    def remove_triples(self, subject, predicate, object):
-        self.graph.remove((
-            self._convert_data_value(subject),
-            self._convert_data_value(predicate),
-            self._convert_data_value(object),
-        ))
-
-    def _triples(self, subject, predicate, object):
-        for s, p, o in self.graph.triples((
-            self._convert_data_value(subject),
-            self._convert_data_value(predicate),
-            self._convert_data_value(object),
-        )):
-            yield (
-                self._convert_rdflib_value(s),
-                self._convert_rdflib_value(p),
-                self._convert_rdflib_value(o),
-            )
-
-    def triples(self, subject, predicate, object):
-        return list(self._triples(subject, predicate, object))
-
-    def load_uri(self, uri, format=TURTLE):
-        return self.graph.parse(uri, format=self._convert_format_id(format))
-
-    def load_text(self, text, format=TURTLE, encoding='utf8'):
-        #u_text = text.decode(encoding)
-        u_text = text
-        return self.graph.parse(data=u_text, format=self._convert_format_id(format))
-
-    def _convert_format_id(self, format):
-        if format in (TURTLE, N3):
-            return 'n3'
-        if format in (NTRIPLE, ):
-            return 'n3'
-        if format in (RDFXML, ):
-            return 'xml'
-        raise ValueError("Unhandled RDF format descriptor", format)
-
-    def expand_uri(self, uri):
-        if ':' not in uri:
-            return uri
-        prefix, rest = uri.split(':', 1)
-        for p, r in self.graph.namespaces():
-            if prefix == p:
-                return r + rest
-        return uri
-
-    def add_namespace(self, prefix, uri):
-        return self.graph.bind(prefix, uri, True)
-
-    def to_string(self, format=TURTLE):
-        return self.graph.serialize(format=self._convert_format_id(format))
-
-
-# Hook in a more sensible default ;-)
-Graph.use_rdflib()
-
+    def __init__(self, module, resolve, names=()):
+        types.ModuleType.__init__(self, module.__name__, module.__doc__)
+        self.__dict__['_module'] = module
+        self.__dict__['_resolve'] = resolve
+        self.__dict__['_names'] = names
+    def __getattr__(self, name):
+        try:
+            return getattr(self._module, name)
+        except AttributeError:
+            return self._resolve(name)
+    def __setattr__(self, name, value):
+        setattr(self._module, name, value)
+    def __delattr__(self, name):
+        delattr(self._module, name)
+    def __dir__(self):
+        return sorted(set(dir(self._module)) | set(self._names))
+
+sys.modules[__name__] = LazyModule(sys.modules[__name__], lazy_name,
+    sum(_lazy_modules.values(), []))
@@ -0,0 +1,176 @@
+"""The rdflib engine, and conversions between Nodes and rdflib terms.
+"""
+
+from __future__ import print_function
+
+from rdfgraph import Engine, URINode, Literal, Blank, \
+  RDFXML, N3, NTRIPLE, TURTLE, literal_lexical, literal_value
+
+class Rdflib(object):
+    "Conversions between graphite Nodes and rdflib terms."
+
+    def _iter_rdflib_results(self, qres):
+        qvars = qres.vars
+        for soln in qres.bindings:
+            d = {}
+            for v in qvars:
+                try:
+                    value = soln[v]
+                except KeyError:
+                    continue
+                parsed_value = self._convert_rdflib_value(value)
+                d[v.toPython()[1:]] = parsed_value
+            yield d
+
+    def _convert_data_value(self, val):
+        if val is None: return None
+        import rdflib
+        if isinstance(val, URINode):
+            return rdflib.URIRef(val.value())
+        if isinstance(val, Literal):
+            lexical, datatype = literal_lexical(val.value(), val.datatype)
+            if val.lang:
+                return rdflib.Literal(lexical, lang=val.lang)
+            if datatype is None:
+                return rdflib.Literal(lexical)
+            return rdflib.Literal(lexical, datatype=rdflib.URIRef(datatype))
+        if isinstance(val, Blank):
+            return rdflib.BNode(val.datum)
+        raise ValueError(val)
+
+    def _convert_rdflib_value(self, val):
+        if val is None:
+            raise ValueError(val)
+        import rdflib
+        if isinstance(val, rdflib.URIRef):
+            return URINode(val.toPython())
+        if isinstance(val, rdflib.BNode):
+            return Blank(str(val))
+        if isinstance(val, rdflib.Literal):
+            datatype = val.datatype
+            if datatype is not None:
+                datatype = unicode(datatype)
+            return Literal(
+                literal_value(unicode(val), datatype),
+                datatype=datatype,
+                lang=val.language or None,
+            )
+        raise ValueError(val)
+
+    def _convert_format_id(self, format):
+        if format in (TURTLE, N3):
+            return 'n3'
+        if format in (NTRIPLE, ):
+            return 'n3'
+        if format in (RDFXML, ):
+            return 'xml'
+        raise ValueError("Unhandled RDF format descriptor", format)
+
+
+class RdflibGraph(Engine, Rdflib):
+    """Defines a mechanism for accessing a triple store in rdflib.
+    """
+    def __init__(self, debug=False):
+        if debug:
+            if callable(debug):
+                self.debug = debug
+            else:
+                def debug(x):
+                    print(x)
+                self.debug = debug
+        import rdflib
+        import rdfextras
+        self.graph = rdflib.Graph()
+
+    def debug(self, msg): pass
+
+    def sparql(self, query_text):
+        return self._iter_rdflib_results(self.graph.query(query_text))
+
+    def set_triple(self, subject, predicate, object):
+        self.graph.add((
+            self._convert_data_value(subject),
+            self._convert_data_value(predicate),
+            self._convert_data_value(object),
+        ))
+
+    def add_triples(self, triples):
+        convert = self._convert_data_value
+        graph = self.graph
+        graph.addN([
+            (convert(x), convert(y), convert(z), graph)
+            for x, y, z in triples
+        ])
+
+    def remove_triples(self, subject, predicate, object):
+        self.graph.remove((
+            self._convert_data_value(subject),
+            self._convert_data_value(predicate),
+            self._convert_data_value(object),
+        ))
+
+    def has_triple(self, subject, predicate, object):
+        for t in self.graph.triples((
+            self._convert_data_value(subject),
+            self._convert_data_value(predicate),
+            self._convert_data_value(object),
+        )):
+            return True
+        return False
+
+    def count_triples(self, subject, predicate, object):
+        if subject is None and predicate is None and object is None:
+            return len(self.graph)
+        total = 0
+        for t in self.graph.triples((
+            self._convert_data_value(subject),
+            self._convert_data_value(predicate),
+            self._convert_data_value(object),
+        )):
+            total += 1
+        return total
+
+    def triples(self, subject, predicate, object, limit=None, offset=0):
+        import itertools
+        matches = self.graph.triples((
+            self._convert_data_value(subject),
+            self._convert_data_value(predicate),
+            self._convert_data_value(object),
+        ))
+        if limit is not None:
+            stop = offset + limit
+        else:
+            stop = None
+        convert = self._convert_rdflib_value
+        # Only the rows actually returned get converted.
+        for s, p, o in itertools.islice(matches, offset, stop):
+            yield convert(s), convert(p), convert(o)
+
+    def load_uri(self, uri, format=TURTLE):
+        return self.graph.parse(uri, format=self._convert_format_id(format))
+
+    def load_text(self, text, format=TURTLE, encoding='utf8'):
+        #u_text = text.decode(encoding)
+        u_text = text
+        return self.graph.parse(data=u_text, format=self._convert_format_id(format))
+
+    def expand_uri(self, uri):
+        if ':' not in uri:
+            return uri
+        prefix, rest = uri.split(':', 1)
+        for p, r in self.graph.namespaces():
+            if prefix == p:
+                return r + rest
+        return uri
+
+    def add_namespace(self, prefix, uri):
+        return self.graph.bind(prefix, uri, True)
+
+    def namespaces(self):
+        ns_dict = {}
+        for prefix, uri in self.graph.namespaces():
+            ns_dict[str(prefix)] = URINode(unicode(uri))
+        return ns_dict
+
+    def to_string(self, format=TURTLE):
+        return self.graph.serialize(format=self._convert_format_id(format))
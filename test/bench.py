@@ -0,0 +1,410 @@
+#!/usr/bin/env python
+"""
+Rough benchmarks. These print numbers rather than pass or fail - run them
+before and after a change and compare.
+
+    python bench.py [name ...]
+"""
+
+import sys
+import time
+
+
+def timed(f, *t, **k):
+    start = time.time()
+    result = f(*t, **k)
+    return time.time() - start, result
+
+def report(name, **values):
+    print name.ljust(32),
+    print ', '.join([
+        "%s=%s" % (k, values[k]) for k in sorted(values.keys())
+    ])
+
+def best_time(runs, f, format, scale=1):
+    "The quickest of several runs of f, formatted, or 'failed' if any gave None."
+    times = [f() for i in range(runs)]
+    if None in times:
+        return 'failed'
+    return format % (min(times) * scale)
+
+def native_graph(size=0):
+    "A NativeGraph of `size` triples over a small set of properties."
+    g = rdfgraph.Graph(engine=rdfgraph.NativeGraph())
+    for i in xrange(size):
+        g.add('tag:s%d' % (i // 10), 'tag:p%d' % (i % 7), g['tag:o%d' % i])
+    return g
+
+def serve(handler, threaded=False):
+    "Serve HTTP from a handler class on a local port; return the server and its base URI."
+    import threading
+    import BaseHTTPServer
+    import SocketServer
+    server_class = BaseHTTPServer.HTTPServer
+    if threaded:
+        class server_class(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+    server = server_class(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'http://127.0.0.1:%d/' % server.server_port
+
+def stop(server):
+    server.shutdown()
+    server.server_close()
+
+def python_process(code, **k):
+    "Start a fresh interpreter running some code, with this package importable."
+    import os
+    import subprocess
+    mod_path = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+    return subprocess.Popen(
+        [sys.executable, '-c', 'import sys; sys.path.insert(0, %r)\n%s' % (
+            mod_path, code)],
+        **k)
+
+
+def object_bytes(rows):
+    "Bytes held by the distinct Python objects making up a list of rows."
+    seen = {}
+    total = 0
+    todo = []
+    for row in rows:
+        todo.append(row)
+        todo.extend(row)
+        for res in row:
+            todo.append(res.datum)
+    for obj in todo:
+        if id(obj) in seen:
+            continue
+        seen[id(obj)] = obj
+        total += sys.getsizeof(obj)
+        dct = getattr(obj, '__dict__', None)
+        if dct is not None:
+            total += sys.getsizeof(dct)
+        same_as = getattr(obj, '_same_as', None)
+        if same_as is not None:
+            total += sys.getsizeof(same_as)
+    return total
+
+def bench_triples_memory(size=200000):
+    "Memory per result row when iterating triples(None, None, None)."
+    g = native_graph(size)
+    seconds, rows = timed(list, g.triples(None, None, None))
+    assert len(rows) == size, len(rows)
+    report('triples_memory',
+        rows=len(rows),
+        bytes_per_row=object_bytes(rows) // len(rows),
+        seconds='%.2f' % seconds,
+    )
+
+
+def bench_set_operations(sizes=(250000, 500000, 1000000)):
+    "ResourceList union/remove/intersection should scale linearly."
+    g = native_graph()
+    for size in sizes:
+        resources = [g['tag:r%d' % i] for i in xrange(size)]
+        # Two half-overlapping lists, built from fresh Resource objects so
+        # only value equality can match them up.
+        lst1 = resources[:size // 2 + size // 4]
+        lst2 = [
+            rdfgraph.Resource(g, rdfgraph.URINode(r.uri()))
+            for r in resources[size // 4:]
+        ]
+        for op in ['union', 'remove', 'intersection']:
+            seconds, result = timed(
+                lambda: len(getattr(rdfgraph.ResourceList(lst1), op)(lst2)),
+            )
+            report('set_' + op,
+                size=size,
+                result=result,
+                seconds='%.2f' % seconds,
+                ns_per_item=int(seconds * 1e9 / size),
+            )
+
+
+def bench_stream_load(size=200000):
+    "N-Triples load rate through Graph.load_stream."
+    import tempfile
+    import os
+    fno, name = tempfile.mkstemp()
+    f = os.fdopen(fno, 'wb')
+    for i in xrange(size):
+        f.write('<tag:s%d> <tag:p%d> "value %d" .\n' % (i // 10, i % 7, i))
+    f.close()
+    try:
+        g = native_graph()
+        with open(name, 'rb') as f:
+            seconds, _ = timed(g.load_stream, f, 'ntriples')
+    finally:
+        os.remove(name)
+    report('stream_load',
+        triples=size,
+        seconds='%.2f' % seconds,
+        triples_per_second=int(size / seconds),
+    )
+
+
+def bench_add_many(size=200000):
+    "Graph.add_many against one set_triple call per triple."
+    def triples():
+        for i in xrange(size):
+            yield 'tag:s%d' % (i // 10), 'tag:p%d' % (i % 7), g['tag:o%d' % i]
+    g = native_graph()
+    one_by_one, _ = timed(lambda: [g.add(*t) for t in triples()])
+    g = native_graph()
+    batched, _ = timed(g.add_many, triples())
+    report('add_many',
+        triples=size,
+        set_triple_seconds='%.2f' % one_by_one,
+        add_many_seconds='%.2f' % batched,
+    )
+
+
+def bench_cache_load(size=20000):
+    "Loading a cached document: RDF/XML parse against the binary format."
+    g = native_graph(size)
+    rdfxml = g.to_string(format=rdfgraph.RDFXML)
+    binary = rdfgraph.dump_binary(g.engine.triples(None, None, None))
+    parse_seconds, _ = timed(
+        native_graph().load_rdfxml, rdfxml)
+    def load():
+        triples, namespaces = rdfgraph.load_binary(binary)
+        native_graph().engine.add_triples(triples)
+    binary_seconds, _ = timed(load)
+    report('cache_load',
+        triples=size,
+        rdfxml_bytes=len(rdfxml),
+        binary_bytes=len(binary),
+        rdfxml_seconds='%.2f' % parse_seconds,
+        binary_seconds='%.2f' % binary_seconds,
+    )
+
+
+def bench_disk_store(size=200000):
+    "Opening a merged DiskGraph and answering bound patterns from its files."
+    import shutil
+    import tempfile
+    path = tempfile.mkdtemp()
+    try:
+        engine = rdfgraph.DiskGraph(path)
+        engine.add_triples(native_graph(size).engine.triples(None, None, None))
+        merge_seconds, _ = timed(engine.merge)
+        engine.close()
+        open_seconds, engine = timed(rdfgraph.DiskGraph, path)
+        g = rdfgraph.Graph(engine=engine)
+        def lookups():
+            for i in xrange(0, size // 10, 10):
+                list(g.triples('tag:s%d' % i, None, None))
+        lookup_seconds, _ = timed(lookups)
+        count_seconds, count = timed(g.count, None, 'tag:p1', None)
+        engine.close()
+    finally:
+        shutil.rmtree(path)
+    report('disk_store',
+        triples=size,
+        merge_seconds='%.2f' % merge_seconds,
+        open_seconds='%.4f' % open_seconds,
+        lookup_seconds='%.2f' % lookup_seconds,
+        count_seconds='%.4f' % count_seconds,
+    )
+
+
+def bench_parallel_load(count=40, delay=0.05):
+    "Loading many documents from a slow server, one at a time and together."
+    import shutil
+    import tempfile
+    import BaseHTTPServer
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(delay)
+            self.send_response(200)
+            self.send_header('content-type', 'text/turtle')
+            self.end_headers()
+            self.wfile.write('<tag:%s> <tag:p> <tag:o> .\n' % self.path[1:])
+        def log_message(self, *t):
+            pass
+    server, base = serve(Handler, threaded=True)
+    path = tempfile.mkdtemp()
+    try:
+        def load(uris):
+            g = native_graph()
+            g.web_cache = rdfgraph.ContentCache(path)
+            g.load(*uris)
+            return g
+        serial_seconds, _ = timed(lambda: [
+            load([base + 's%d' % i]) for i in xrange(count)])
+        parallel_seconds, g = timed(load, [base + 'p%d' % i for i in xrange(count)])
+        assert len(g) == count, len(g)
+    finally:
+        stop(server)
+        shutil.rmtree(path)
+    report('parallel_load',
+        documents=count,
+        per_host=rdfgraph.Config.fetch_per_host,
+        serial_seconds='%.2f' % serial_seconds,
+        parallel_seconds='%.2f' % parallel_seconds,
+    )
+
+
+def bench_http_keep_alive(count=500):
+    "Small requests to one host: a new connection each time, or pooled."
+    import urllib2
+    import BaseHTTPServer
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Send each response in one go rather than a packet per header.
+        wbufsize = -1
+        def do_GET(self):
+            data = '<tag:s> <tag:p> <tag:o> .\n'
+            self.send_response(200)
+            self.send_header('content-type', 'application/n-triples')
+            self.send_header('content-length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        def log_message(self, *t):
+            pass
+    server, base = serve(Handler)
+    uri = base + 'data'
+    try:
+        def fresh():
+            for i in xrange(count):
+                urllib2.urlopen(uri).read()
+        client = rdfgraph.HttpClient()
+        def pooled():
+            for i in xrange(count):
+                client.request(uri)
+        pooled_seconds, _ = timed(pooled)
+        client.close()
+        fresh_seconds, _ = timed(fresh)
+    finally:
+        stop(server)
+    report('http_keep_alive',
+        requests=count,
+        urllib2_seconds='%.2f' % fresh_seconds,
+        pooled_seconds='%.2f' % pooled_seconds,
+    )
+
+
+def jena_graph(size=0):
+    "A JenaGraph of `size` triples, or None if there's no JVM to run one."
+    try:
+        engine = rdfgraph.JenaGraph()
+        engine.count_triples(None, None, None)
+    except Exception:
+        return None
+    g = rdfgraph.Graph(engine=engine)
+    g.add_many(
+        ('tag:s%d' % i, 'tag:p', g['tag:o%d' % i]) for i in xrange(size)
+    )
+    return g
+
+def bench_jena_call_overhead(size=2000, calls=20000):
+    "The cost of a triples() call on Jena, beyond its results."
+    g = jena_graph(size)
+    if g is None:
+        report('jena_call_overhead', skipped='no JVM')
+        return
+    engine = g.engine
+    subjects = [rdfgraph.URINode('tag:s%d' % (i % size)) for i in xrange(calls)]
+    prop = rdfgraph.URINode('tag:p')
+    def bound():
+        for s in subjects:
+            list(engine.triples(s, prop, None))
+    def wildcards():
+        for i in xrange(calls):
+            engine.has_triple(None, None, None)
+    bound_seconds, _ = timed(bound)
+    wild_seconds, _ = timed(wildcards)
+    report('jena_call_overhead',
+        calls=calls,
+        bound_us='%.1f' % (bound_seconds / calls * 1e6),
+        wildcard_us='%.1f' % (wild_seconds / calls * 1e6),
+    )
+
+def bench_jena_iteration(size=100000):
+    "Reading every statement out of a Jena model."
+    g = jena_graph(size)
+    if g is None:
+        report('jena_iteration', skipped='no JVM')
+        return
+    engine = g.engine
+    seconds, count = timed(
+        lambda: sum(1 for _ in engine.triples(None, None, None)))
+    assert count == size, count
+    report('jena_iteration',
+        triples=count,
+        seconds='%.2f' % seconds,
+        triples_per_second='%.0f' % (count / seconds),
+    )
+
+def run_python(code):
+    "Seconds a fresh interpreter takes to run some code, or None on failure."
+    import os
+    import subprocess
+    start = time.time()
+    devnull = open(os.devnull, 'w')
+    status = python_process(code, stdout=devnull, stderr=subprocess.STDOUT).wait()
+    if status:
+        return None
+    return time.time() - start
+
+def bench_import_time(runs=5):
+    """Import cost of the package, and of each module it loads on first use.
+
+    Times are cumulative: each includes the modules it imports.
+    """
+    results = {}
+    for name in ['graphite', 'graphite.rdfgraph', 'graphite.rdflibgraph',
+      'graphite.nativegraph', 'graphite.jenagraph', 'graphite.federation',
+      'graphite.htmldump']:
+        code = 'import time; start = time.time(); import %s\n' \
+            'sys.stderr.write("%%f" %% (time.time() - start))' % (name,)
+        results[name] = best_time(runs, lambda: import_seconds(code), '%.1fms', 1e3)
+    report('import_time', **results)
+
+def import_seconds(code):
+    "What a fresh interpreter running `code` writes to stderr, as a float."
+    import os
+    import subprocess
+    p = python_process(code, stdout=open(os.devnull, 'w'), stderr=subprocess.PIPE)
+    err = p.communicate()[1]
+    if p.returncode:
+        return None
+    return float(err)
+
+def bench_jvm_startup(runs=3):
+    "Wall time for a short job: import, then first use of an engine."
+    jobs = [
+        ('import', 'import graphite.rdfgraph'),
+        ('native', 'import graphite.rdfgraph as r\n'
+            'r.Graph(engine=r.NativeGraph()).load_ttl("<tag:a> <tag:b> <tag:c> .")'),
+        ('jena', 'import graphite.rdfgraph as r\n'
+            'r.Graph(engine=r.JenaGraph()).load_ttl("<tag:a> <tag:b> <tag:c> .")'),
+    ]
+    results = {}
+    for name, code in jobs:
+        results[name] = best_time(runs, lambda: run_python(code), '%.3fs')
+    report('jvm_startup', **results)
+
+def main(argv):
+    names = argv[1:]
+    for name, f in sorted(globals().items()):
+        if not name.startswith('bench_'):
+            continue
+        if names and name[len('bench_'):] not in names:
+            continue
+        f()
+
+if __name__ == '__main__':
+    # Same bootstrap as test.py
+    import os
+    mod_path = os.path.join(os.path.dirname(__file__), os.pardir)
+    mod_path = os.path.abspath(mod_path)
+    sys.path.insert(0, mod_path)
+
+    import graphite.rdfgraph as rdfgraph
+    globals()['rdfgraph'] = rdfgraph
+
+    main(sys.argv)
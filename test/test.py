@@ -126,6 +126,87 @@ class TestGraph(Test):
         self.failUnless(r)
         self.failUnless(getattr(r, 'isURIResource', False), r)
 
+    def test_count(self):
+        self.assertEquals(len(self.g), 1)
+        self.assertEquals(self.g.count('tag:dummy1', None, None), 1)
+        self.assertEquals(self.g.count('tag:dummy2', None, None), 0)
+        self.failUnless(rdfgraph.Graph(engine=self.g.engine.scratch_engine()))
+
+    def test_limit(self):
+        self.g.add_many(
+            ('tag:dummy1', 'tag:p', self.g.literal(i)) for i in range(10)
+        )
+        everything = list(self.g.triples('tag:dummy1', 'tag:p', None))
+        self.assertEquals(len(everything), 10)
+        page = list(self.g.triples('tag:dummy1', 'tag:p', None, limit=4, offset=3))
+        self.assertEquals(page, everything[3:7])
+        self.assertEquals(len(list(self.g.triples(None, None, None, offset=10))), 1)
+        self.assertEquals(len(list(self.g.triples(None, None, None, limit=0))), 0)
+        self.failUnless(self.g['tag:dummy1']['tag:p'] in everything[0])
+
+    def test_has_triple(self):
+        self.g['tag:dummy1']['tag:int'] = 2
+        for pattern, expected in [
+            (('tag:dummy1', None, None), True),
+            ((None, 'rdf:type', 'tag:dummy2'), True),
+            ((None, None, self.g.literal(2)), True),
+            ((None, None, self.g.literal(3)), False),
+            (('tag:dummy2', None, None), False),
+            (('tag:unknown', None, None), False),
+        ]:
+            self.assertEquals(self.g.has_triple(*pattern), expected, pattern)
+        lst = rdfgraph.ResourceList([self.g['tag:dummy2'], self.g['tag:dummy1']])
+        self.failUnless(lst.has('tag:int'))
+        self.failIf(lst.has('tag:nothing'))
+
+    def test_literal_lookup(self):
+        self.g.load_ttl("""
+        <tag:a> <tag:s> "x" .
+        <tag:a> <tag:int> 42 .
+        <tag:a> <tag:typed> "7"^^<http://www.w3.org/2001/XMLSchema#integer> .
+        <tag:a> <tag:bool> true .
+        """)
+        for prop, value in [
+            ('tag:s', 'x'),
+            ('tag:s', u'x'),
+            ('tag:int', 42),
+            ('tag:typed', 7L),
+            ('tag:bool', True),
+        ]:
+            self.failUnless(
+                self.g.has_triple('tag:a', prop, self.g.literal(value)),
+                (prop, value))
+            self.assertEquals(
+                self.g.count('tag:a', prop, self.g.literal(value)), 1)
+        self.failIf(self.g.has_triple('tag:a', 'tag:int', self.g.literal(43)))
+
+    def test_literal_round_trip(self):
+        self.g.load_ttl("""
+        <tag:a> <tag:lang> "chat"@en .
+        <tag:a> <tag:int> "5"^^<http://www.w3.org/2001/XMLSchema#int> .
+        """)
+        for prop in ['tag:lang', 'tag:int']:
+            value = self.g['tag:a'][prop]
+            self.failUnless(self.g.has_triple('tag:a', prop, value), prop)
+            self.g['tag:b'][prop] = value
+            self.failUnless(self.g.has_triple('tag:b', prop, value), prop)
+        self.assertEquals(self.g.count('tag:b', None, None), 2)
+        self.assertEquals(self.g['tag:b']['tag:lang'].datum.lang, 'en')
+
+    def test_add_while_iterating(self):
+        self.g.load_ttl("""
+        <tag:a> a <tag:T1> .
+        <tag:b> a <tag:T1> .
+        """)
+        for t in self.g['tag:a'].all('rdf:type'):
+            self.g.add('tag:a', 'rdf:type', 'tag:T2')
+        for s, p, o in self.g.triples(None, 'rdf:type', None):
+            self.g.add(s, 'rdf:type', 'tag:T3')
+            self.g.add('tag:c', 'rdf:type', 'tag:T3')
+        for s, p, o in self.g.triples(None, None, None):
+            self.g.remove(s, p, o)
+        self.assertEquals(self.g.count(None, None, None), 0)
+
     def test_set(self, other=None):
         r = self.g.get('tag:dummy1')
         if other is None:
@@ -146,6 +227,38 @@ class TestGraph(Test):
         self.test_set(other=2)
         self.test_set(other="Wibble")
 
+    def test_add_many(self):
+        self.g.add_many(
+            ('tag:s%d' % i, 'tag:p', self.g.literal(i)) for i in range(25)
+        )
+        self.g.add_many([('tag:s0', 'tag:q', self.g['tag:o'])], batch_size=1)
+        self.assertEquals(self.g['tag:s3']['tag:p'], 3)
+        self.assertEquals(self.g['tag:s0']['tag:q'], 'tag:o')
+        self.assertEquals(len(list(self.g.triples(None, 'tag:p', None))), 25)
+
+    def test_remove_many(self):
+        self.g.add_many(
+            ('tag:s%d' % i, 'tag:p', self.g.literal(i)) for i in range(10)
+        )
+        self.g.remove_many([
+            ('tag:s1', None, None),
+            ('tag:s2', 'tag:p', self.g.literal(2)),
+            ('tag:s3', 'tag:p', self.g.literal(4)),
+        ])
+        self.assertEquals(len(list(self.g.triples(None, 'tag:p', None))), 8)
+        self.failIf(self.g.has_triple('tag:s2', None, None))
+        self.failUnless(self.g.has_triple('tag:s3', None, None))
+
+    def test_replace(self):
+        r = self.g.get('tag:dummy1')
+        r.add('tag:p', 1)
+        r.add('tag:p', 2)
+        self.g.replace(r, 'tag:p', [self.g.literal(3), self.g.literal(4)])
+        self.assertEquals(sorted(r.all('tag:p')), [3, 4])
+        self.g.replace(r, 'tag:p', self.g['tag:o'])
+        self.assertEquals(list(r.all('tag:p')), ['tag:o'])
+        self.assertEquals(r['rdf:type'], 'tag:dummy2')
+
 
 class TestURIResource(Test):
     def setUp(self):
@@ -241,6 +354,35 @@ class TestResourceList(Test):
         self.failUnless(self.r1 in lst3, list(lst3))
         self.failIf(    self.r2 in lst3, list(lst3))
 
+    def test_union(self):
+        lst1 = rdfgraph.ResourceList([self.r1, self.r2])
+        lst2 = rdfgraph.ResourceList([self.g.get('tag:2'), self.g.get('tag:3')])
+        lst3 = list(lst1.union(lst2))
+        self.assertEquals(len(lst3), 3, lst3)
+
+    def test_intersection(self):
+        lst1 = rdfgraph.ResourceList([self.r1, self.r2])
+        lst2 = rdfgraph.ResourceList([self.g.get('tag:2')])
+        lst3 = lst1.intersection(lst2)
+        self.failIf(    self.r1 in lst3, list(lst3))
+        self.failUnless(self.r2 in lst3, list(lst3))
+
+    def test_hash(self):
+        r1 = rdfgraph.Resource(self.g, rdfgraph.URINode('tag:1'))
+        self.failIf(r1 is self.r1)
+        self.assertEquals(hash(r1), hash(self.r1))
+        self.assertEquals(len(set([r1, self.r1, self.r2])), 2)
+        self.failUnless('tag:1' in set([self.r1]))
+        self.failIf(r1 != self.r1)
+
+    def test_order(self):
+        lst = sorted([
+            self.g.literal(1),
+            self.r2,
+            self.r1,
+        ])
+        self.assertEquals(lst, [self.r1, self.r2, 1])
+
     def test_join(self):
         lst1 = rdfgraph.ResourceList([self.r1, self.r2])
         self.assertEquals(
@@ -333,6 +475,1015 @@ class TestSparql(Test):
             self.assertEquals(lst[0], expected)
 
 
+class TestTerms(Test):
+    def test_nodes_are_shared(self):
+        a = rdfgraph.URINode('tag:shared')
+        self.failUnless(a is rdfgraph.URINode('tag:shared'))
+        self.failIf(a is rdfgraph.URINode('tag:other'))
+        self.failIf(a is rdfgraph.Literal('tag:shared'))
+        self.assertEquals(a, 'tag:shared')
+
+    def test_literals_keep_types(self):
+        self.failIf(rdfgraph.Literal(2) is rdfgraph.Literal(2.0))
+        self.assertEquals(rdfgraph.Literal(2), rdfgraph.Literal(2.0))
+        self.assertEquals(hash(rdfgraph.Literal(2)), hash(rdfgraph.Literal(2.0)))
+
+    def test_literal_lexical(self):
+        import datetime, decimal
+        xsd = 'http://www.w3.org/2001/XMLSchema#'
+        for value, lexical, datatype in [
+            (True, u'true', xsd+'boolean'),
+            (12, u'12', xsd+'integer'),
+            (1.5, u'1.5', xsd+'double'),
+            (decimal.Decimal('2.50'), u'2.50', xsd+'decimal'),
+            (datetime.date(2001, 2, 3), u'2001-02-03', xsd+'date'),
+            (datetime.datetime(2001, 2, 3, 4, 5, 6), u'2001-02-03T04:05:06',
+                xsd+'dateTime'),
+        ]:
+            self.assertEquals(rdfgraph.literal_lexical(value),
+                (lexical, datatype))
+            self.assertEquals(rdfgraph.literal_value(lexical, datatype), value)
+        self.assertEquals(rdfgraph.literal_lexical(u'x'), (u'x', None))
+        # Bad lexical forms keep their text.
+        self.assertEquals(rdfgraph.literal_value(u'x', xsd+'int'), u'x')
+
+    def test_literal_lang(self):
+        en = rdfgraph.Literal(u'chat', lang='en')
+        self.failUnless(en is rdfgraph.Literal(u'chat', lang='en'))
+        self.failIf(en is rdfgraph.Literal(u'chat', lang='fr'))
+        self.assertEquals(rdfgraph.sparql_term(en), u'"chat"@en')
+
+    def test_threads_share_nodes(self):
+        import threading
+        uris = ['tag:threaded%d' % i for i in range(2000)]
+        made = []
+        def make():
+            made.append([rdfgraph.URINode(uri) for uri in uris])
+        threads = [threading.Thread(target=make) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        for nodes in made[1:]:
+            for a, b in zip(made[0], nodes):
+                self.failUnless(a is b, (a, b))
+        ids = [node.id for node in made[0]]
+        self.assertEquals(len(set(ids)), len(ids))
+
+    def test_resources_are_shared(self):
+        self.g.load_ttl("""
+        <tag:dummy1> a <tag:dummy2> .
+        <tag:dummy3> a <tag:dummy2> .
+        """)
+        types = [z for x, y, z in self.g.triples(None, 'rdf:type', None)]
+        self.assertEquals(len(types), 2)
+        self.failUnless(types[0] is types[1], types)
+        self.failUnless(types[0] is self.g['tag:dummy2'])
+
+
+class TestStream(Test):
+    def load(self, data, format='ntriples', **k):
+        import StringIO
+        self.g.load_stream(StringIO.StringIO(data), format, **k)
+        return list(self.g.triples(None, None, None))
+
+    def test_ntriples(self):
+        self.load(SAMPLE_NTRIPLES)
+        self.assertEquals(
+            self.g['tag:dummy1']['rdf:type'].uri(),
+            'tag:dummy2',
+            self.g.to_string()
+        )
+
+    def test_literals(self):
+        self.load(r"""
+        # A comment
+        <tag:a> <tag:str> "say \"hi\"\n\u00a3" .
+        <tag:a> <tag:lang> "chat"@en-GB .
+        <tag:a> <tag:int> "42"^^<http://www.w3.org/2001/XMLSchema#integer> .
+        <tag:a> <tag:bool> "true"^^<http://www.w3.org/2001/XMLSchema#boolean> .
+        """)
+        r = self.g['tag:a']
+        self.assertEquals(r['tag:str'], u'say "hi"\n\xa3')
+        self.assertEquals(r['tag:lang'], u'chat')
+        self.assertEquals(r['tag:int'], 42)
+        self.assertEquals(r['tag:bool'], True)
+
+    def test_datatypes(self):
+        import datetime, decimal
+        self.load(r"""
+        <tag:a> <tag:lang> "chat"@en-GB .
+        <tag:a> <tag:dec> "1.50"^^<http://www.w3.org/2001/XMLSchema#decimal> .
+        <tag:a> <tag:long> "-7"^^<http://www.w3.org/2001/XMLSchema#long> .
+        <tag:a> <tag:when> "2001-02-03T04:05:06Z"^^<http://www.w3.org/2001/XMLSchema#dateTime> .
+        <tag:a> <tag:day> "2001-02-03"^^<http://www.w3.org/2001/XMLSchema#date> .
+        <tag:a> <tag:odd> "x"^^<tag:type> .
+        """)
+        objects = dict(
+            (y.datum, z)
+            for x, y, z in self.g.engine.triples(None, None, None)
+        )
+        self.assertEquals(objects['tag:lang'].lang, 'en-GB')
+        self.assertEquals(objects['tag:dec'].value(), decimal.Decimal('1.50'))
+        self.assertEquals(objects['tag:dec'].datatype,
+            'http://www.w3.org/2001/XMLSchema#decimal')
+        self.assertEquals(objects['tag:long'].value(), -7)
+        when = objects['tag:when'].value()
+        self.assertEquals(when.replace(tzinfo=None),
+            datetime.datetime(2001, 2, 3, 4, 5, 6))
+        self.assertEquals(when.utcoffset(), datetime.timedelta(0))
+        self.assertEquals(objects['tag:day'].value(), datetime.date(2001, 2, 3))
+        self.assertEquals(objects['tag:odd'].value(), 'x')
+        self.assertEquals(objects['tag:odd'].datatype, 'tag:type')
+
+    def test_blanks(self):
+        data = "_:b0 <tag:p> _:b1 .\n_:b1 <tag:p> <tag:o> .\n"
+        ts = self.load(data)
+        self.assertEquals(len(ts), 2)
+        ts = self.load(data)
+        # Labels are scoped to one document.
+        self.assertEquals(len(ts), 4)
+        for x, y, z in self.g.triples(None, None, 'tag:o'):
+            self.failUnless(x.is_blank())
+            self.assertEquals(len(list(self.g.triples(None, None, x))), 1)
+
+    def test_chunks(self):
+        data = "".join([
+            "<tag:s%d> <tag:p> <tag:o%d> .\n" % (i, i) for i in range(100)
+        ])
+        ts = self.load(data, chunk_size=7, batch_size=3)
+        self.assertEquals(len(ts), 100)
+        self.failUnless(self.g.has_triple('tag:s99', 'tag:p', 'tag:o99'))
+
+    def test_nquads(self):
+        data = "<tag:s> <tag:p> <tag:o> <tag:g> .\n"
+        self.assertEquals(len(self.load(data, 'nquads')), 1)
+        self.assertRaises(ValueError, self.load, data, 'ntriples')
+
+    def test_bad_line(self):
+        self.assertRaises(ValueError, self.load, "<tag:s> <tag:p> .\n")
+
+def _fill_cache(path, n, prefix):
+    cache = rdfgraph.ContentCache(path)
+    cache.journal_limit = 256
+    for i in range(n):
+        cache[prefix + str(i)] = "data %d" % i
+
+class TestContentCache(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.dir = tempfile.mkdtemp()
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.dir)
+
+    def new_cache(self):
+        return rdfgraph.ContentCache(self.dir)
+
+    def test_set_get(self):
+        c = self.new_cache()
+        self.failIf('tag:a' in c)
+        c['tag:a'] = u'\xa3 data'
+        self.failUnless('tag:a' in c)
+        self.assertEquals(c['tag:a'], u'\xa3 data')
+        with open(c.get_path('tag:a'), 'rb') as f:
+            self.assertEquals(f.read(), '\xc2\xa3 data')
+        self.assertRaises(KeyError, c.get, 'tag:b')
+
+    def test_shared(self):
+        c1 = self.new_cache()
+        c2 = self.new_cache()
+        c1['tag:a'] = 'one'
+        self.assertEquals(c2['tag:a'], 'one')
+        c2['tag:a'] = 'two'
+        c2['tag:b'] = 'two'
+        self.assertEquals(c1.get_path('tag:b'), c2.get_path('tag:a'))
+        c1.refresh()
+        self.assertEquals(c1['tag:a'], 'two')
+
+    def test_compact(self):
+        c = self.new_cache()
+        c.journal_limit = 100
+        for i in range(20):
+            c['tag:%d' % i] = str(i)
+        c2 = self.new_cache()
+        for i in range(20):
+            self.assertEquals(c2['tag:%d' % i], str(i))
+
+    def test_meta(self):
+        c = self.new_cache()
+        c.set('tag:a', 'data', meta={'etag': '"x y"'})
+        self.assertEquals(self.new_cache().meta('tag:a')['etag'], '"x y"')
+        self.failUnless(c.is_fresh('tag:a'))
+        c.ttl = 0
+        c.touch('tag:a')
+        self.failIf(c.is_fresh('tag:a'))
+        self.assertEquals(c.meta('tag:a')['etag'], '"x y"')
+
+    def test_eviction(self):
+        import os
+        c = self.new_cache()
+        c.max_bytes = 350
+        for i in range(3):
+            c['tag:%d' % i] = str(i) * 100
+            # Make the order of use unambiguous.
+            os.utime(c.get_path('tag:%d' % i), (i, i))
+        c.get_path('tag:0')
+        c['tag:3'] = '3' * 100
+        c2 = self.new_cache()
+        self.failUnless('tag:0' in c2)
+        self.failIf(    'tag:1' in c2)
+        self.failUnless('tag:2' in c2)
+        self.failUnless('tag:3' in c2)
+        del c2['tag:3']
+        self.failIf('tag:3' in self.new_cache())
+
+    def test_evicted_elsewhere(self):
+        import os
+        c = self.new_cache()
+        c['tag:a'] = 'one'
+        c2 = self.new_cache()
+        c2['tag:b'] = 'two'
+        # Another process evicts tag:a; this one hasn't seen the journal yet.
+        os.remove(c.get_path('tag:a'))
+        self.failUnless('tag:b' in c2)
+        c2['tag:a'] = 'three'
+        self.assertEquals(c['tag:a'], 'three')
+        os.remove(c.get_path('tag:b'))
+        self.assertRaises(KeyError, c.get_path, 'tag:b')
+        self.assertRaises(KeyError, c.read, 'tag:b')
+
+    def test_processes(self):
+        import multiprocessing
+        procs = [
+            multiprocessing.Process(target=_fill_cache, args=(self.dir, 30, 'p%d-' % p))
+            for p in range(4)
+        ]
+        for proc in procs:
+            proc.start()
+        for proc in procs:
+            proc.join()
+            self.assertEquals(proc.exitcode, 0)
+        c = self.new_cache()
+        for p in range(4):
+            for i in range(30):
+                self.assertEquals(c['p%d-%d' % (p, i)], 'data %d' % i)
+
+class TestBinary(Test):
+    def test_round_trip(self):
+        self.g.load_ttl(SAMPLE_TTL)
+        self.g.add_many([
+            ('tag:a', 'tag:int', self.g.literal(1)),
+            ('tag:a', 'tag:float', self.g.literal(1.5)),
+            ('tag:a', 'tag:str', self.g.literal(u'\xa3')),
+            ('tag:a', 'tag:bool', self.g.literal(True)),
+        ])
+        self.g.load_stream(__import__('StringIO').StringIO(
+            '<tag:a> <tag:lang> "chat"@en .\n'
+            '<tag:a> <tag:dec> "1.5"^^<http://www.w3.org/2001/XMLSchema#decimal> .\n'
+        ), 'ntriples')
+        self.g.load_stream(
+            __import__('StringIO').StringIO('_:x <tag:p> _:x .\n'),
+            'ntriples',
+        )
+        triples = list(self.g.engine.triples(None, None, None))
+        data = rdfgraph.dump_binary(triples, {'ex': 'tag:ex#'})
+        self.failUnless(rdfgraph.is_binary(data))
+        loaded, namespaces = rdfgraph.load_binary(data)
+        self.assertEquals(namespaces, {'ex': 'tag:ex#'})
+        self.assertEquals(sorted(loaded), sorted(triples))
+        for a, b in zip(sorted(loaded), sorted(triples)):
+            for x, y in zip(a, b):
+                self.assertEquals(type(x.value()), type(y.value()))
+                if y.is_literal:
+                    self.assertEquals(x.lang, y.lang)
+
+    def test_not_binary(self):
+        self.assertRaises(ValueError, rdfgraph.load_binary, SAMPLE_RDFXML)
+
+class TestWebCache(Test):
+    "Loads through the web cache from a local HTTP server."
+    def setUp(self):
+        super(TestWebCache, self).setUp()
+        import tempfile
+        import threading
+        import BaseHTTPServer
+        self.dir = tempfile.mkdtemp()
+        self.g.web_cache = rdfgraph.ContentCache(self.dir)
+        self.requests = requests = []
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                requests.append(self.headers.get('if-none-match'))
+                if self.headers.get('if-none-match') == '"v1"':
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('content-type', 'text/turtle')
+                self.send_header('etag', '"v1"')
+                self.end_headers()
+                self.wfile.write(SAMPLE_TTL)
+            def log_message(self, *t):
+                pass
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.uri = 'http://127.0.0.1:%d/data' % self.server.server_port
+
+    def tearDown(self):
+        import shutil
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.dir)
+        super(TestWebCache, self).tearDown()
+
+    def load(self, **k):
+        self.new_graph(rdfgraph.Graph(engine=self.g.engine.scratch_engine()))
+        self.g.web_cache = rdfgraph.ContentCache(self.dir)
+        self.g.web_cache.ttl = self.ttl
+        self.g.load(self.uri, **k)
+        self.assertEquals(self.g['tag:dummy1']['rdf:type'], 'tag:dummy2')
+
+    def test_fresh(self):
+        self.ttl = 60
+        self.load()
+        self.load()
+        self.assertEquals(self.requests, [None])
+
+    def test_revalidate(self):
+        self.ttl = 0
+        self.load()
+        self.load()
+        self.load(reload=True)
+        self.assertEquals(self.requests, [None, '"v1"', '"v1"'])
+
+    def test_evicted(self):
+        import os
+        self.ttl = 60
+        self.load()
+        os.remove(self.g.web_cache.get_path(self.uri))
+        self.load()
+        self.assertEquals(self.requests, [None, None])
+
+    def test_many(self):
+        uris = [self.uri + '?%d' % i for i in range(5)]
+        self.g.load(*uris)
+        self.assertEquals(len(self.requests), 5)
+        self.assertEquals(len(self.g), 1)
+        self.g.load(*uris)
+        self.assertEquals(len(self.requests), 5)
+
+class TestHttpClient(Test):
+    "Talks HTTP/1.1 to a local server."
+    def setUp(self):
+        super(TestHttpClient, self).setUp()
+        import gzip
+        import json
+        import threading
+        import BaseHTTPServer
+        import SocketServer
+        import StringIO
+        self.connections = connections = set()
+        def gzipped(data):
+            buf = StringIO.StringIO()
+            f = gzip.GzipFile(fileobj=buf, mode='wb')
+            f.write(data)
+            f.close()
+            return buf.getvalue()
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            def reply(self, status, data='', **headers):
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name.replace('_', '-'), value)
+                self.send_header('content-length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            def do_GET(self):
+                connections.add(self.client_address)
+                if self.path == '/data':
+                    self.reply(200, SAMPLE_TTL, content_type='text/turtle')
+                elif self.path == '/latin':
+                    self.reply(200, gzipped(u'<tag:a> <tag:b> "caf\xe9" .'.encode('latin-1')),
+                        content_type='text/turtle; charset=iso-8859-1',
+                        content_encoding='gzip')
+                elif self.path == '/redirect':
+                    self.reply(303, location='/data')
+                elif self.path.startswith('/sparql?'):
+                    if 'json' in self.headers.get('accept'):
+                        self.reply(200, json.dumps({
+                            'head': {'vars': ['x', 'n']},
+                            'results': {'bindings': [{
+                                'x': {'type': 'uri', 'value': 'tag:dummy1'},
+                                'n': {'type': 'literal', 'value': '3', 'datatype':
+                                    'http://www.w3.org/2001/XMLSchema#integer'},
+                            }]},
+                        }), content_type='application/sparql-results+json')
+                    else:
+                        self.reply(200, SAMPLE_NTRIPLES,
+                            content_type='application/n-triples')
+                else:
+                    self.reply(404)
+            def log_message(self, *t):
+                pass
+        class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+        self.server = Server(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.base = 'http://127.0.0.1:%d/' % self.server.server_port
+        self.client = rdfgraph.HttpClient(timeout=5)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        super(TestHttpClient, self).tearDown()
+
+    def test_keep_alive(self):
+        for i in range(3):
+            r = self.client.request(self.base + 'data')
+            self.assertEquals(r.status, 200)
+            self.assertEquals(r.data, SAMPLE_TTL)
+        self.assertEquals(len(self.connections), 1)
+
+    def test_gzip_charset(self):
+        r = self.client.request(self.base + 'latin')
+        self.assertEquals(r.mime(), 'text/turtle')
+        self.assertEquals(r.charset(), 'iso-8859-1')
+        self.assertEquals(r.text(), u'<tag:a> <tag:b> "caf\xe9" .')
+
+    def test_redirect(self):
+        r = self.client.request(self.base + 'redirect')
+        self.assertEquals(r.uri, self.base + 'data')
+        self.assertEquals(r.data, SAMPLE_TTL)
+
+    def test_error(self):
+        try:
+            self.client.request(self.base + 'missing')
+        except rdfgraph.HttpError as e:
+            self.assertEquals(e.code, 404)
+        else:
+            self.fail("No error for a 404")
+
+    def test_sparql(self):
+        endpoint = self.base + 'sparql'
+        results = list(rdfgraph.sparql_select(endpoint, 'SELECT * {}', client=self.client))
+        self.assertEquals(results, [{
+            'x': rdfgraph.URINode('tag:dummy1'),
+            'n': rdfgraph.Literal(3),
+        }])
+        self.g.engine.import_sparql(endpoint, 'CONSTRUCT {?s ?p ?o} {?s ?p ?o}')
+        self.assertEquals(self.g['tag:dummy1']['rdf:type'], 'tag:dummy2')
+
+class TestPatternCache(unittest.TestCase):
+    def test_subsumes(self):
+        cache = rdfgraph.PatternCache()
+        cache.add(('s', None, None))
+        self.failUnless(cache.covers(('s', None, None)))
+        self.failUnless(cache.covers(('s', 'p', 'o')))
+        self.failIf(cache.covers((None, 'p', None)))
+        self.failIf(cache.covers(('t', 'p', 'o')))
+        cache.add((None, None, None))
+        self.failUnless(cache.covers(('t', 'p', 'o')))
+        self.assertEquals((cache.hits, cache.misses), (3, 2))
+
+    def test_lru(self):
+        cache = rdfgraph.PatternCache(max_entries=2)
+        cache.add(('a', None, None))
+        cache.add(('b', None, None))
+        self.failUnless(cache.covers(('a', 'p', None)))
+        cache.add(('c', None, None))
+        self.assertEquals(len(cache), 2)
+        self.failUnless(cache.covers(('a', None, None)))
+        self.failIf(cache.covers(('b', None, None)))
+        self.failUnless(cache.covers(('c', None, None)))
+
+    def test_ttl(self):
+        cache = rdfgraph.PatternCache(ttl=0)
+        cache.add(('a', None, None))
+        import time
+        time.sleep(0.01)
+        self.failIf(cache.covers(('a', None, None)))
+        self.assertEquals(len(cache), 0)
+
+    def test_discard(self):
+        cache = rdfgraph.PatternCache()
+        cache.add(('a', 'p', None))
+        cache.discard(('a', 'p', None))
+        self.failIf(('a', 'p', 'o') in cache)
+
+class TestDataset(Test):
+    "Auto-queries local SPARQL endpoints."
+    def setUp(self):
+        super(TestDataset, self).setUp()
+        self.servers = []
+        self.queries = []
+        self.stats_queries = []
+        import tempfile
+        self.stats_dir = tempfile.mkdtemp()
+        rdfgraph.caches.caches['sparql-stats'] = rdfgraph.ContentCache(self.stats_dir)
+        self.ds = rdfgraph.Dataset(endpoint=self.serve())
+
+    def serve(self, delay=0, status=200, predicates=['tag:p'], stats_status=200):
+        """Start an endpoint answering for <tag:s0> to <tag:s4>; return its URI.
+
+        Queries for its statistics are logged apart from the rest.
+        """
+        import json
+        import threading
+        import time
+        import urlparse
+        import BaseHTTPServer
+        queries = self.queries
+        stats_queries = self.stats_queries
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                query = urlparse.parse_qs(urlparse.urlsplit(self.path)[3])['query'][0]
+                if 'SELECT DISTINCT' in query or 'GROUP BY' in query or 'ASK' in query:
+                    stats_queries.append(query)
+                    if 'ASK' in query:
+                        result = {'boolean': any(['<%s>' % p in query for p in predicates])}
+                    else:
+                        bindings = []
+                        if 'GROUP BY ?p' in query:
+                            bindings = [{'p': {'type': 'uri', 'value': p}} for p in predicates]
+                        result = {'head': {'vars': []}, 'results': {'bindings': bindings}}
+                    data = json.dumps(result)
+                    self.send_response(stats_status)
+                    self.send_header('content-type', 'application/sparql-results+json')
+                    self.end_headers()
+                    self.wfile.write(data)
+                    return
+                queries.append(query)
+                time.sleep(delay)
+                if 'json' in self.headers.get('accept'):
+                    ctype = 'application/sparql-results+json'
+                    data = json.dumps({'head': {'vars': ['x']}, 'results': {'bindings': [
+                        {'x': {'type': 'literal', 'value': str(delay)}}]}})
+                else:
+                    ctype = 'application/n-triples'
+                    data = ''.join([
+                        '<tag:s%d> <tag:p> "%d" .\n' % (i, i) for i in range(5)
+                        if '<tag:s%d>' % i in query
+                    ])
+                self.send_response(status)
+                self.send_header('content-type', ctype)
+                self.end_headers()
+                self.wfile.write(data)
+            def log_message(self, *t):
+                pass
+        server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.servers.append(server)
+        return 'http://127.0.0.1:%d/sparql' % server.server_port
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        super(TestDataset, self).tearDown()
+        import shutil
+        del rdfgraph.caches.caches['sparql-stats']
+        shutil.rmtree(self.stats_dir)
+
+    def values(self, triples):
+        return sorted(o.value() for s, p, o in triples)
+
+    def test_auto_query(self):
+        self.assertEquals(self.values(self.ds.triples('tag:s1', 'tag:p', None)), ['1'])
+        self.assertEquals(len(self.queries), 1)
+        self.failIf('VALUES' in self.queries[0])
+        self.ds.triples('tag:s1', 'tag:p', None)
+        self.assertEquals(len(self.queries), 1)
+
+    def test_batch(self):
+        with self.ds.batch():
+            results = [self.ds.triples('tag:s%d' % i, None, None) for i in range(4)]
+            results.append(self.ds.triples(None, 'tag:p', '"4"'))
+            self.assertEquals(self.queries, [])
+        self.assertEquals(len(self.queries), 1)
+        self.failUnless('VALUES' in self.queries[0])
+        self.failUnless('UNION' in self.queries[0])
+        for i in range(4):
+            self.assertEquals(self.values(results[i]), [str(i)])
+
+    def test_lazy_batch(self):
+        with self.ds.batch():
+            a = self.ds.triples('tag:s1', None, None)
+            b = self.ds.triples('tag:s2', None, None)
+            self.assertEquals(self.values(a), ['1'])
+            self.assertEquals(len(self.queries), 1)
+            self.assertEquals(self.values(b), ['2'])
+        self.assertEquals(len(self.queries), 1)
+
+    def test_failed_batch(self):
+        def fail():
+            with self.ds.batch():
+                self.ds.triples('tag:s1', None, None)
+                raise ValueError()
+        self.assertRaises(ValueError, fail)
+        self.assertEquals(self.queries, [])
+        self.assertEquals(self.values(self.ds.triples('tag:s1', None, None)), ['1'])
+        self.assertEquals(len(self.queries), 1)
+
+    def test_fan_out(self):
+        import time
+        self.ds.add_endpoints(self.serve(delay=0.3), self.serve(delay=0.3))
+        start = time.time()
+        self.assertEquals(self.values(self.ds.triples('tag:s1', None, None)), ['1'])
+        self.failUnless(time.time() - start < 0.5)
+        self.assertEquals(len(self.queries), 3)
+        rows = sorted(row['x'].value() for row in self.ds.sparql('SELECT ?x WHERE { ?x ?y ?z }'))
+        # The local data cache answers too.
+        self.assertEquals(rows, ['0', '0.3', '0.3', 'tag:s1'])
+
+    def test_partial_results(self):
+        slow = self.serve(delay=1)
+        broken = self.serve(status=500)
+        self.ds.add_endpoints(slow, broken)
+        self.ds.endpoints[slow].timeout = 0.2
+        self.assertEquals(self.values(self.ds.triples('tag:s1', None, None)), ['1'])
+        self.assertEquals(sorted(self.ds.failures), sorted([slow, broken]))
+
+    def test_source_selection(self):
+        other = self.serve(predicates=['tag:other'])
+        self.ds.add_endpoints(other)
+        self.assertEquals(self.values(self.ds.triples('tag:s1', 'tag:p', None)), ['1'])
+        self.assertEquals(len(self.queries), 1)
+        self.ds.triples('tag:s2', 'tag:other', None)
+        self.assertEquals(len(self.queries), 2)
+        # Patterns without a predicate go everywhere.
+        self.ds.triples('tag:s3', None, None)
+        self.assertEquals(len(self.queries), 4)
+
+    def test_ask_probes(self):
+        stats = self.ds.endpoint_stats.values()[0]
+        # Too many predicates to list them all.
+        stats.limit = 0
+        self.failUnless(stats.has_predicate('tag:p'))
+        self.failIf(stats.has_predicate('tag:q'))
+        self.failIf(stats.has_predicate('tag:q'))
+        asks = [q for q in self.stats_queries if 'ASK' in q]
+        self.assertEquals(len(asks), 2)
+        # Saved for next time.
+        count = len(self.stats_queries)
+        stats = rdfgraph.SparqlStats(stats.uri, self.ds)
+        self.failIf(stats.has_predicate('tag:q'))
+        self.assertEquals(len(self.stats_queries), count)
+
+    def test_ask_fan_out(self):
+        class Stats(rdfgraph.SparqlStats):
+            limit = 0
+        ds = rdfgraph.Dataset()
+        ds.stats_class = Stats
+        other = self.serve(predicates=['tag:other'])
+        ds.add_endpoints(self.serve(), other)
+        self.assertEquals(ds.select_endpoints(None, ds._parse_property('tag:other'), None), [other])
+        asks = [q for q in self.stats_queries if 'ASK' in q]
+        self.assertEquals(len(asks), 2)
+        # Both answers were kept.
+        for uri, stats in ds.endpoint_stats.items():
+            self.failIf(Stats(uri, ds).unasked((None, ds._parse_property('tag:other'), None)))
+
+    def test_stats_failed(self):
+        broken = self.serve(stats_status=500)
+        self.ds.add_endpoints(broken)
+        self.ds.triples('tag:s1', 'tag:q', None)
+        # Everything goes to it, without an ASK for each predicate.
+        self.assertEquals(len(self.queries), 1)
+        self.ds.triples('tag:s1', 'tag:r', None)
+        self.assertEquals(len(self.queries), 2)
+        self.failUnless(broken in self.ds.failures)
+        self.failIf([q for q in self.stats_queries if 'ASK' in q])
+        # Nor is it asked again by the next process, for a while.
+        count = len(self.stats_queries)
+        stats = rdfgraph.SparqlStats(broken, self.ds)
+        self.failUnless(stats.has_predicate('tag:q'))
+        self.assertEquals(len(self.stats_queries), count)
+        # Once that's over, it is.
+        stats.stats['failed'] = 0
+        del rdfgraph.caches['sparql-stats'][broken]
+        self.failUnless(stats.has_predicate('tag:q'))
+        self.failUnless(len(self.stats_queries) > count)
+
+    def test_retry_failed(self):
+        self.ds.add_endpoints(self.serve(status=500))
+        self.ds.triples('tag:s1', None, None)
+        self.assertEquals(len(self.queries), 2)
+        # Only the failed endpoint is asked again.
+        self.ds.triples('tag:s1', None, None)
+        self.assertEquals(len(self.queries), 3)
+
+class TestFetcher(unittest.TestCase):
+    def test_per_host(self):
+        import threading
+        import time
+        lock = threading.Lock()
+        active = {}
+        most = {}
+        def f(uri):
+            host = rdfgraph.Fetcher.host(uri)
+            with lock:
+                active[host] = active.get(host, 0) + 1
+                most[host] = max(most.get(host, 0), active[host])
+            time.sleep(0.01)
+            with lock:
+                active[host] -= 1
+            return uri.upper()
+        uris = ['http://h%d/%d' % (i % 2, i) for i in range(12)]
+        results = list(rdfgraph.Fetcher(threads=6, per_host=2).run(f, uris))
+        self.assertEquals(
+            sorted(item for item, result, error in results), sorted(uris))
+        for item, result, error in results:
+            self.assertEquals(result, item.upper())
+            self.assertEquals(error, None)
+        self.assertEquals(most, {'h0': 2, 'h1': 2})
+
+    def test_timeout(self):
+        import time
+        def f(uri):
+            time.sleep(uri.endswith('slow') and 1 or 0)
+            return uri
+        start = time.time()
+        results = dict(
+            (item, error) for item, result, error
+            in rdfgraph.Fetcher(threads=2).run(
+                f, ['http://a/slow', 'http://b/fast'], timeout=0.2)
+        )
+        self.failUnless(time.time() - start < 0.5)
+        self.assertEquals(results['http://b/fast'], None)
+        self.assertEquals(results['http://a/slow'][0], rdfgraph.FetchTimeout)
+
+    def test_error(self):
+        def f(uri):
+            if uri.endswith('bad'):
+                raise ValueError(uri)
+            return uri
+        results = dict(
+            (item, error) for item, result, error
+            in rdfgraph.Fetcher(threads=2).run(f, ['http://a/ok', 'http://a/bad'])
+        )
+        self.assertEquals(results['http://a/ok'], None)
+        self.assertEquals(results['http://a/bad'][0], ValueError)
+
+class TestJvmConfig(unittest.TestCase):
+    def test_options(self):
+        class config:
+            jvm_initial_heap = None
+            jvm_heap = '1g'
+            jvm_gc = 'SerialGC'
+            jvm_share = 'auto'
+            jvm_extra_args = '-Da=1 -Db=2'
+        args = rdfgraph.jvm_options(config)
+        for arg in ['-Xmx1g', '-XX:+UseSerialGC', '-Xshare:auto', '-Da=1', '-Db=2']:
+            self.failUnless(arg in args, args)
+        self.failIf([arg for arg in args if arg.startswith('-Xms')], args)
+
+    def test_classpath(self):
+        import os, shutil, tempfile
+        libs = tempfile.mkdtemp()
+        try:
+            for name in ['arq-2.8.7.jar', 'arq-2.8.10.jar', 'iri-0.8.jar', 'notes.txt']:
+                open(os.path.join(libs, name), 'w').close()
+            jars = map(os.path.basename, rdfgraph.jena_classpath(libs))
+            self.assertEquals(jars, ['arq-2.8.10.jar', 'iri-0.8.jar'])
+        finally:
+            shutil.rmtree(libs)
+
+class TestImports(unittest.TestCase):
+    def imported(self, code):
+        "The modules a fresh interpreter has loaded after running `code`."
+        import os, subprocess, sys
+        mod_path = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+        out = subprocess.Popen([sys.executable, '-c',
+            'import sys; sys.path.insert(0, %r)\n%s\n'
+            'print " ".join(m for m in sys.modules if sys.modules[m])' % (
+                mod_path, code)],
+            stdout=subprocess.PIPE,
+        ).communicate()[0]
+        return set(out.split())
+
+    def test_core_only(self):
+        modules = self.imported('import graphite')
+        self.failUnless('graphite.rdfgraph' in modules, modules)
+        for name in ['graphite.jenagraph', 'graphite.rdflibgraph',
+          'graphite.nativegraph', 'graphite.federation', 'graphite.htmldump',
+          'jpype', 'rdflib', 'decimal', 'ConfigParser']:
+            self.failIf(name in modules, name)
+
+    def test_lazy_names(self):
+        modules = self.imported(
+            'import graphite, graphite.rdfgraph as r\n'
+            'assert graphite.Dataset is r.Dataset\n'
+            'assert r.DiskGraph.__module__ == "graphite.nativegraph"'
+        )
+        self.failUnless('graphite.federation' in modules, modules)
+        self.failUnless('graphite.nativegraph' in modules, modules)
+        self.failIf('jpype' in modules, modules)
+
+class NativeTest(Test):
+    "Runs a test case against the pure Python engine."
+    def new_graph(self, g=None):
+        if g is None:
+            g = rdfgraph.Graph(engine=rdfgraph.NativeGraph())
+        self.g = g
+
+class TestNativeGraph(NativeTest, TestGraph): pass
+class TestNativeURIResource(NativeTest, TestURIResource): pass
+class TestNativeStream(NativeTest, TestStream): pass
+
+class TestNativeIndexes(NativeTest):
+    def setUp(self):
+        super(TestNativeIndexes, self).setUp()
+        for s, p, o in [
+            ('tag:s1', 'tag:p1', 'tag:o1'),
+            ('tag:s1', 'tag:p1', 'tag:o2'),
+            ('tag:s1', 'tag:p2', 'tag:o1'),
+            ('tag:s2', 'tag:p1', 'tag:o1'),
+        ]:
+            self.g.add(s, p, self.g[o])
+
+    def count(self, x, y, z):
+        return len(list(self.g.triples(x, y, z)))
+
+    def test_patterns(self):
+        for pattern, expected in [
+            ((None, None, None), 4),
+            (('tag:s1', None, None), 3),
+            ((None, 'tag:p1', None), 3),
+            ((None, None, 'tag:o1'), 3),
+            (('tag:s1', 'tag:p1', None), 2),
+            (('tag:s1', None, 'tag:o1'), 2),
+            ((None, 'tag:p1', 'tag:o1'), 2),
+            (('tag:s1', 'tag:p1', 'tag:o1'), 1),
+            (('tag:s2', 'tag:p2', None), 0),
+            (('tag:unknown', None, None), 0),
+        ]:
+            self.assertEquals(self.count(*pattern), expected, pattern)
+
+    def test_count(self):
+        for pattern in [
+            (None, None, None),
+            ('tag:s1', None, None),
+            (None, 'tag:p1', None),
+            (None, None, 'tag:o1'),
+            ('tag:s1', 'tag:p1', None),
+            (None, 'tag:p1', 'tag:o1'),
+            ('tag:s1', None, 'tag:o1'),
+            ('tag:s1', 'tag:p1', 'tag:o1'),
+            ('tag:s2', 'tag:p2', 'tag:o1'),
+            ('tag:unknown', None, None),
+        ]:
+            self.assertEquals(self.g.count(*pattern), self.count(*pattern), pattern)
+        self.g.remove('tag:s1', None, 'tag:o1')
+        self.assertEquals(len(self.g), 2)
+        self.assertEquals(self.g.count('tag:s1', None, None), 1)
+        self.assertEquals(self.g.count(None, None, 'tag:o1'), 1)
+
+    def test_duplicate_add(self):
+        self.g.add('tag:s1', 'tag:p1', self.g['tag:o1'])
+        self.assertEquals(self.count(None, None, None), 4)
+
+    def test_remove(self):
+        self.g.remove('tag:s1', 'tag:p1', None)
+        self.assertEquals(self.count(None, None, None), 2)
+        self.assertEquals(self.count(None, 'tag:p1', None), 1)
+        self.assertEquals(self.count(None, None, 'tag:o2'), 0)
+        self.failIf(self.g.has_triple('tag:s1', 'tag:p1', None))
+        self.failUnless(self.g.has_triple('tag:s1', None, None))
+
+
+class DiskTest(Test):
+    "Runs a test case against the on-disk engine, in a scratch directory."
+    def new_graph(self, g=None):
+        if g is None:
+            import tempfile
+            self.dir = tempfile.mkdtemp()
+            g = rdfgraph.Graph(engine=rdfgraph.DiskGraph(self.dir))
+        self.g = g
+
+    def reopen(self):
+        "Close the store and open it again from its files."
+        self.g.engine.close()
+        self.g = rdfgraph.Graph(engine=rdfgraph.DiskGraph(self.dir))
+
+    def tearDown(self):
+        import shutil
+        self.g.engine.close()
+        self.g = None
+        shutil.rmtree(self.dir)
+
+class TestDiskGraph(DiskTest, TestGraph): pass
+class TestDiskIndexes(DiskTest, TestNativeIndexes): pass
+
+class TestMergedDiskIndexes(TestDiskIndexes):
+    "The index tests again, with the triples merged into the files."
+    def setUp(self):
+        super(TestMergedDiskIndexes, self).setUp()
+        self.g.engine.merge()
+
+class TestDiskStore(DiskTest):
+    def setUp(self):
+        super(TestDiskStore, self).setUp()
+        self.g.add('tag:s1', 'tag:p1', self.g['tag:o1'])
+        self.g.add('tag:s1', 'tag:p2', u'caf\xe9')
+        self.g.add('tag:s2', 'tag:p1', rdfgraph.Literal(3))
+
+    def triples(self):
+        return sorted(self.g.triples(None, None, None))
+
+    def test_reopen(self):
+        before = self.triples()
+        self.reopen()
+        self.assertEquals(self.triples(), before)
+        self.g.engine.merge()
+        self.reopen()
+        self.assertEquals(self.triples(), before)
+        self.assertEquals(self.g['tag:s2']['tag:p1'], 3)
+
+    def test_merge(self):
+        self.g.engine.merge()
+        self.assertEquals(self.g.engine.size, 0)
+        self.g.add('tag:s3', 'tag:p1', self.g['tag:o1'])
+        self.assertEquals(len(self.g), 4)
+        self.assertEquals(self.g.count(None, 'tag:p1', None), 3)
+        self.g.engine.merge()
+        self.assertEquals(self.g.engine.triple_count, 4)
+        self.assertEquals(self.g.count(None, 'tag:p1', None), 3)
+        self.assertEquals(self.g['tag:s1']['tag:p2'], u'caf\xe9')
+
+    def test_remove_stored(self):
+        self.g.engine.merge()
+        self.g.remove('tag:s1', None, None)
+        self.assertEquals(len(self.g), 1)
+        self.failIf(self.g.has_triple('tag:s1', 'tag:p1', None))
+        self.reopen()
+        self.assertEquals(len(self.g), 1)
+        self.g.add('tag:s1', 'tag:p1', self.g['tag:o1'])
+        self.assertEquals(len(self.g), 2)
+        self.g.engine.merge()
+        self.reopen()
+        self.assertEquals(len(self.g), 2)
+        self.failUnless(self.g.has_triple('tag:s1', 'tag:p1', 'tag:o1'))
+
+    def test_merged_literals(self):
+        # Parsed terms have unicode datatypes and tags; Python values don't.
+        self.g.load_ttl('<tag:s4> <tag:p1> 5 ; <tag:p2> "chat"@en .')
+        self.g.engine.merge()
+        import gc
+        gc.collect()
+        typed = self.g.literal(5)
+        tagged = rdfgraph.Literal(u'chat', lang='en')
+        for p, o in [('tag:p1', typed), ('tag:p2', tagged)]:
+            self.failUnless(self.g.has_triple('tag:s4', p, o))
+            self.assertEquals(self.g.count('tag:s4', p, o), 1)
+        self.g.add('tag:s4', 'tag:p1', typed)
+        self.g.add('tag:s4', 'tag:p2', tagged)
+        self.assertEquals(len(self.g), 5)
+
+    def test_namespaces(self):
+        self.g.add_ns({'ex': 'tag:example#'})
+        self.reopen()
+        self.assertEquals(self.g.expand_uri('ex:x'), 'tag:example#x')
+        self.g.engine.merge()
+        self.reopen()
+        self.assertEquals(self.g.expand_uri('ex:x'), 'tag:example#x')
+
+    def test_namespaces_logged_once(self):
+        import os
+        log = os.path.join(self.dir, 'log')
+        self.reopen()
+        size = os.path.getsize(log)
+        self.reopen()
+        self.reopen()
+        self.assertEquals(os.path.getsize(log), size)
+        # Namespace changes count towards a merge too.
+        engine = self.g.engine
+        engine.merge_limit = engine.size + engine.ns_changes + 2
+        self.g.add_ns({'ex': 'tag:example#'})
+        self.g.add_ns({'ex': 'tag:example2#'})
+        self.assertEquals(os.path.getsize(log), 0)
+        self.reopen()
+        self.assertEquals(self.g.expand_uri('ex:x'), 'tag:example2#x')
+
+    def test_torn_log(self):
+        import os
+        self.g.engine.close()
+        log = os.path.join(self.dir, 'log')
+        with open(log, 'ab') as f:
+            f.write('\x00\x01')
+        self.reopen()
+        self.assertEquals(len(self.g), 3)
+        self.g.add('tag:s3', 'tag:p1', self.g['tag:o1'])
+        self.reopen()
+        self.assertEquals(len(self.g), 4)
+
+
 if __name__ == '__main__':
     # A bit of bootstrap to make sure we test the right stuff
     import sys